@@ -4,10 +4,37 @@ import numpy as np
 from ..elements.adjustable import AdjustableFS
 from ..epics.adjustable import AdjustablePv
 from ..epics.detector import DetectorPvDataStream
+from ..epics.subscription_hub import hub
 from ..detector.detectors_psi import DetectorBsStream
+from ..detector.bs_stream_manager import bs_stream_manager
 
 from ..elements.assembly import Assembly
 
+def _good_mask(values, thresholds):
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid="ignore"):
+        return np.logical_and(values > thresholds[0], values < thresholds[1])
+
+
+def _good_pulse_mask(values, thresholds):
+    """Good flag per value, a waveform value is good if all its elements are
+    inside the thresholds (elementwise as in stop_and_analyze)."""
+    try:
+        values_arr = np.asarray(values, dtype=float)
+        if values_arr.ndim == 1:
+            return _good_mask(values_arr, thresholds)
+    except (ValueError, TypeError):
+        pass
+    return np.array(
+        [bool(np.all(_good_mask(value, thresholds))) for value in values], dtype=bool
+    )
+
+
+def _expected_pulse_ids(start_id, stop_id, pulse_step=1):
+    """Pulse ids from start_id to stop_id recorded at every pulse_step-th pulse."""
+    pulse_ids = np.arange(start_id, stop_id + 1)
+    return pulse_ids[pulse_ids % pulse_step == 0]
+
 
 class CheckerCA(Assembly):
     def __init__(
@@ -17,9 +44,18 @@ class CheckerCA(Assembly):
         required_fraction=None,
         filepath_thresholds="/photonics/home/gac-bernina/eco/configuration/checker_thresholds",
         filepath_fraction="/photonics/home/gac-bernina/eco/configuration/checker_required_fraction",
+        pulse_aligned=False,
+        max_reacquisitions=3,
+        pulse_id_pvname="SGE-CPCW-85-EVR0:RX-PULSEID",
+        pulse_rate=100,
         name=None,
     ):
         super().__init__(name=name)
+        self.pulse_aligned = pulse_aligned
+        self.max_reacquisitions = max_reacquisitions
+        self.pulse_id_pvname = pulse_id_pvname
+        self.pulse_rate = pulse_rate
+        self._cb_indices = []
         self._append(DetectorPvDataStream, pvname, name="monitor")
         self._append(
             AdjustableFS,
@@ -47,6 +83,78 @@ class CheckerCA(Assembly):
 
     def clear_and_start_counting(self):
         self.monitor.accumulate_start()
+        if self.pulse_aligned:
+            self._start_recording_updates()
+
+    def _start_recording_updates(self):
+        """Record (timestamp, value) of the checker and pulse id PVs, starting
+        with the current checker value, which holds until its next update."""
+        self._stop_recording_updates()
+        pv = hub.get_pv(self.monitor.pvname)
+        self._updates = []
+        if pv.value is not None:
+            self._updates.append((pv.timestamp, pv.value))
+        self._pulse_id_updates = []
+
+        def add_update(value=None, timestamp=None, **kwargs):
+            self._updates.append((timestamp, value))
+
+        def add_pulse_id_update(value=None, timestamp=None, **kwargs):
+            self._pulse_id_updates.append((timestamp, value))
+
+        self._cb_indices = [
+            (self.monitor.pvname, hub.add_callback(self.monitor.pvname, add_update)),
+            (
+                self.pulse_id_pvname,
+                hub.add_callback(self.pulse_id_pvname, add_pulse_id_update),
+            ),
+        ]
+
+    def _stop_recording_updates(self):
+        for pvname, index in self._cb_indices:
+            hub.remove_callback(pvname, index)
+        self._cb_indices = []
+
+    def _get_pulse_rate(self, pid_ts, pids):
+        """Pulse id rate (Hz) of the machine from the recorded pulse id PV
+        updates, self.pulse_rate if they do not span any time."""
+        if len(pids) > 1 and pid_ts[-1] > pid_ts[0] and pids[-1] > pids[0]:
+            return (pids[-1] - pids[0]) / (pid_ts[-1] - pid_ts[0])
+        return self.pulse_rate
+
+    def stop_and_get_mask(self, start_id, stop_id, pulse_step=1, timeout=1):
+        """Stop counting, returns (pulse_ids, good, received) for the pulse
+        ids from start_id to stop_id recorded at every pulse_step-th pulse.
+        The IOC timestamps of the checker updates are converted to pulse ids
+        with the pulse id PV updates, a value is valid from its update until
+        the next one. Pulses without a valid value are not received and not
+        good."""
+        self.monitor.accumulate_stop()
+        t_start = time.time()
+        while time.time() - t_start < timeout:
+            if self._pulse_id_updates and self._pulse_id_updates[-1][1] >= stop_id:
+                break
+            time.sleep(0.01)
+        self._stop_recording_updates()
+        pulse_ids = _expected_pulse_ids(start_id, stop_id, pulse_step)
+        if not (self._updates and self._pulse_id_updates):
+            print("Checker: no updates recorded to align to pulse ids.")
+            nothing = np.zeros(len(pulse_ids), dtype=bool)
+            return pulse_ids, nothing, nothing
+        ts, values = zip(*self._updates)
+        ts = np.asarray(ts, dtype=float)
+        good_updates = _good_pulse_mask(values, self.thresholds())
+        pid_ts, pids = (
+            np.asarray(tmp, dtype=float) for tmp in zip(*self._pulse_id_updates)
+        )
+        pulse_rate = self._get_pulse_rate(pid_ts, pids)
+        ix = np.maximum(np.searchsorted(pid_ts, ts, side="right") - 1, 0)
+        update_ids = pids[ix] + np.round((ts - pid_ts[ix]) * pulse_rate)
+        update_ids = np.maximum.accumulate(update_ids)
+        iv = np.searchsorted(update_ids, pulse_ids, side="right") - 1
+        received = iv >= 0
+        good = np.logical_and(received, good_updates[np.maximum(iv, 0)])
+        return pulse_ids, good, received
 
     # def stopcounting(self):
     #     self.PV.clear_callbacks()
@@ -71,9 +179,13 @@ class CheckerBS(Assembly):
         required_fraction=None,
         filepath_thresholds="/photonics/home/gac-bernina/eco/configuration/checker_thresholds",
         filepath_fraction="/photonics/home/gac-bernina/eco/configuration/checker_required_fraction",
+        pulse_aligned=False,
+        max_reacquisitions=3,
         name=None,
     ):
         super().__init__(name=name)
+        self.pulse_aligned = pulse_aligned
+        self.max_reacquisitions = max_reacquisitions
         self._append(DetectorBsStream, bs_channel, name="monitor")
         self._append(
             AdjustableFS,
@@ -104,7 +216,32 @@ class CheckerBS(Assembly):
     #     self.data.append(kwargs["value"])
 
     def clear_and_start_counting(self):
-        self.monitor.accumulate_start()
+        if self.pulse_aligned:
+            self.monitor.accumulate_start(force_bsstream=True)
+        else:
+            self.monitor.accumulate_start()
+
+    def stop_and_get_mask(self, start_id, stop_id, pulse_step=1, timeout=1):
+        """Stop counting, returns (pulse_ids, good, received) for the pulse
+        ids from start_id to stop_id recorded at every pulse_step-th pulse.
+        Pulses missing in the bs stream are not received and not good."""
+        bs_stream_manager.wait_for_pulse_id(
+            self.monitor.bs_channel, stop_id, timeout=timeout
+        )
+        values = self.monitor.accumulate_stop()
+        pulse_ids_received = np.asarray(self.monitor.pulse_ids_accumulated, dtype=int)
+        pulse_ids = _expected_pulse_ids(start_id, stop_id, pulse_step)
+        received = np.isin(pulse_ids, pulse_ids_received)
+        good = np.zeros(len(pulse_ids), dtype=bool)
+        if received.any():
+            order = np.argsort(pulse_ids_received, kind="stable")
+            ix = order[
+                np.searchsorted(pulse_ids_received[order], pulse_ids[received])
+            ]
+            good[received] = _good_pulse_mask(
+                [values[i] for i in ix], self.thresholds()
+            )
+        return pulse_ids, good, received
 
     # def stopcounting(self):
     #     self.PV.clear_callbacks()
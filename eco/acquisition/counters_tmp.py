@@ -6,14 +6,12 @@
 # likely never worked ...
 # def _wait_for_tasks(scan, **kwargs):
 #     print("checking remaining tasks from previous scan ...")
-#     for task in scan.remaining_tasks:
-#         task.join()
+#     scan.wait_remaining_tasks()
 #     print("... done.")
 
 import json
 from pathlib import Path
 import shutil
-from threading import Thread
 
 
 class CounterChecker:
@@ -150,18 +148,16 @@ class CounterAliasesToDAQ:
             if not aliasfile.group() == aliasfile.parent.group():
                 shutil.chown(aliasfile, group=aliasfile.parent.group())
 
-            scan.remaining_tasks.append(
-                Thread(
-                    target=daq.append_aux,
-                    args=[aliasfile.resolve().as_posix()],
-                    kwargs=dict(pgroup=pgroup, run_number=runno),
-                )
-            )
             # DEBUG
             print(
                 f"Sending scan_info_rel.json in {Path(aliasfile).parent.stem} to run number {runno}."
             )
-            scan.remaining_tasks[-1].start()
+            scan.submit_task(
+                daq.append_aux,
+                aliasfile.resolve().as_posix(),
+                pgroup=pgroup,
+                run_number=runno,
+            )
             # response = daq.append_aux(
             #     aliasfile.resolve().as_posix(),
             #     pgroup=pgroup,
@@ -266,18 +262,13 @@ def _copy_scan_info_to_raw(scan, daq=daq, **kwargs):
         shutil.chown(scaninfofile, group=scaninfofile.parent.group())
     # print(f"Copying info file to run {runno} to the raw directory of {pgroup}.")
 
-    scan.remaining_tasks.append(
-        Thread(
-            target=daq.append_aux,
-            args=[scaninfofile.as_posix()],
-            kwargs=dict(pgroup=pgroup, run_number=runno),
-        )
-    )
     # DEBUG
     print(
         f"Sending scan_info_rel.json in {Path(scaninfofile).parent.stem} to run number {runno}."
     )
-    scan.remaining_tasks[-1].start()
+    scan.submit_task(
+        daq.append_aux, scaninfofile.as_posix(), pgroup=pgroup, run_number=runno
+    )
     # response = daq.append_aux(scaninfofile.as_posix(), pgroup=pgroup, run_number=runno)
     # print(f"Status: {response.json()['status']} Message: {response.json()['message']}")
     # print(
@@ -326,8 +317,7 @@ def _copy_selected_JF_pedestals_to_raw(
             )
 
     if copy_selected_JF_pedestals_to_raw:
-        scan.remaining_tasks.append(Thread(target=copy_to_aux, args=[daq, scan]))
-        scan.remaining_tasks[-1].start()
+        scan.submit_task(copy_to_aux, daq, scan)
 
 
 def _increment_daq_run_number(scan, daq=daq, **kwargs):
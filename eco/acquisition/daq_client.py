@@ -1,12 +1,11 @@
 import json
 import pickle
 import shutil
-from threading import Thread
 import time
 import traceback
 import colorama
 import numpy as np
-import requests
+from ..utilities.http_transport import get_transport
 from pathlib import Path
 from time import sleep
 
@@ -18,6 +17,7 @@ from ..epics.detector import DetectorPvDataStream
 from ..epics.utilities_epics import Monitor
 from epics import PV
 from ..acquisition.utilities import Acquisition
+from .scan_info_log import ScanInfoLog
 from ..elements.assembly import Assembly
 from ..utilities.path_alias import PathAlias
 import inputimeout
@@ -83,6 +83,7 @@ class Daq(Assembly):
         self.name = name
         self.namespace = namespace
         self.checker = checker
+        self._checker_window_result = None
         self.run_table = run_table
         self.pulse_picker = pulse_picker
         self._default_file_path = None
@@ -107,12 +108,18 @@ class Daq(Assembly):
         self.callbacks_step_counting = []
         self.callbacks_end_step = [
             self.pulse_picker_action_end_step,
-            self.copy_scan_info_to_raw,
             self.check_checker_after_step,
+            self.copy_scan_info_to_raw,
+        ]
+        # run by pipelined scans as soon as the acquisition window of a step
+        # is closed, their end step callbacks run while the next step starts
+        self.callbacks_window_closed = [
+            self.pulse_picker_action_end_step,
+            self.stop_checker_at_window_closed,
         ]
         self.callbacks_end_scan = [
             self.append_status_to_scan_and_store,
-            self.copy_scan_info_to_raw,
+            self.consolidate_scan_info_to_raw,
             self.end_scan_monitors,
         ]
         self.elog = elog
@@ -184,6 +191,7 @@ class Daq(Assembly):
                 channels_BSCAM=self.channels["channels_BSCAM"].get_current_value(),
                 channels_CA=self.channels["channels_CA"].get_current_value(),
                 pgroup=pgroup,
+                on_window_closed=acquisition.set_window_closed,
                 **acq_pars,
             )
             acquisition.acquisition_kwargs.update({"file_names": response["files"]})
@@ -201,7 +209,15 @@ class Daq(Assembly):
 
         return acquisition
 
-    def acquire_pulses(self, Npulses, label=None, wait=True, pgroup=None, **kwargs):
+    def acquire_pulses(
+        self,
+        Npulses,
+        label=None,
+        wait=True,
+        pgroup=None,
+        on_window_closed=None,
+        **kwargs,
+    ):
         if pgroup is None:
             pgroup = self.pgroup
         ix = self.start(label=label, **kwargs)
@@ -210,6 +226,7 @@ class Daq(Assembly):
             acq_ix=ix,
             wait=wait,
             pgroup=pgroup,
+            on_window_closed=on_window_closed,
         )
 
     def start(self, label=None, scan=None, **kwargs):
@@ -285,6 +302,7 @@ class Daq(Assembly):
         wait_cycle_sleep=0.01,
         scan=None,
         pgroup=None,
+        on_window_closed=None,
     ):
         if pgroup is None:
             pgroup = self.pgroup
@@ -298,6 +316,7 @@ class Daq(Assembly):
 
         acq_pars = self.running.pop(acq_ix)
         acq_pars["stop_id"] = stop_id
+        self.last_pulse_ids = (acq_pars["start_id"], stop_id)
 
         label = acq_pars.pop("label")
 
@@ -308,6 +327,8 @@ class Daq(Assembly):
         if wait:
             while int(self.pulse_id.get_current_value()) < stop_id:
                 sleep(wait_cycle_sleep)
+        if on_window_closed:
+            on_window_closed()
 
         acq_pars["pgroup"] = pgroup
         response = self.retrieve(**acq_pars)
@@ -406,8 +427,8 @@ class Daq(Assembly):
         # print("----- debug info ----->\n", parameters, "\n<----- debug info -----")
         self._last_server_post = f"{self.broker_address}/retrieve_from_buffers"
         self._last_server_post_parameters = parameters
-        self._last_server_resp = requests.post(
-            f"{self.broker_address}/retrieve_from_buffers",
+        self._last_server_resp = self._broker.post(
+            "retrieve_from_buffers",
             json=parameters,
             timeout=self.timeout,
         )
@@ -428,11 +449,19 @@ class Daq(Assembly):
 
         return response
 
+    @property
+    def _broker(self):
+        return get_transport(self.broker_address)
+
+    @property
+    def _broker_aux(self):
+        return get_transport(self.broker_address_aux)
+
     def get_next_run_number(self, pgroup=None):
         if pgroup is None:
             pgroup = self.pgroup
-        res = requests.post(
-            f"{self.broker_address}/advance_run_number",
+        res = self._broker.post(
+            "advance_run_number",
             json={"pgroup": pgroup},
             timeout=self.timeout,
         )
@@ -444,8 +473,8 @@ class Daq(Assembly):
     def get_last_run_number(self, pgroup=None):
         if pgroup is None:
             pgroup = self.pgroup
-        res = requests.get(
-            f"{self.broker_address}/get_current_run_number",
+        res = self._broker.get(
+            "get_current_run_number",
             json={"pgroup": pgroup},
             timeout=self.timeout,
         )
@@ -458,12 +487,12 @@ class Daq(Assembly):
         ].frequency.get_current_value()
 
     def get_JFs_available(self):
-        return requests.get(f"{self.broker_address}/get_allowed_detectors").json()[
+        return self._broker.get("get_allowed_detectors").json()[
             "detectors"
         ]
 
     def get_JFs_running(self, return_full_response=False):
-        res = requests.get(f"{self.broker_address}/get_running_detectors").json()
+        res = self._broker.get("get_running_detectors").json()
         if return_full_response:
             return res
         else:
@@ -471,8 +500,8 @@ class Daq(Assembly):
 
     def power_on_JF(self, JF_channel):
         par = {"detector_name": JF_channel}
-        return requests.post(
-            f"{self.broker_address}/power_on_detector", json=par
+        return self._broker.post(
+            "power_on_detector", json=par
         ).json()
 
     def take_pedestal(
@@ -492,11 +521,11 @@ class Daq(Assembly):
             print(self.broker_address)
             print(parameters)
 
-        return requests.post(
-            f"{self.broker_address}/take_pedestal", json=parameters
+        return self._broker.post(
+            "take_pedestal", json=parameters
         ).json()
 
-    def append_aux(self, *file_names, run_number=None, pgroup=None, check_group=True):
+    def _get_aux_request(self, file_names, run_number=None, pgroup=None, check_group=True):
         if pgroup is None:
             pgroup = self.pgroup
         if run_number is None:
@@ -505,10 +534,27 @@ class Daq(Assembly):
             for file_name in file_names:
                 if not Path(file_name).group() == pgroup:
                     shutil.chown(file_name, group=pgroup)
+        return {"pgroup": pgroup, "run_number": run_number, "files": file_names}
 
-        return requests.post(
-            self.broker_address_aux + "/copy_user_files",
-            json={"pgroup": pgroup, "run_number": run_number, "files": file_names},
+    def append_aux(self, *file_names, run_number=None, pgroup=None, check_group=True):
+        return self._broker_aux.post(
+            "copy_user_files",
+            json=self._get_aux_request(
+                file_names, run_number=run_number, pgroup=pgroup, check_group=check_group
+            ),
+        )
+
+    def append_aux_async(
+        self, *file_names, run_number=None, pgroup=None, check_group=True
+    ):
+        """Like append_aux, but returns a Future of the response. Uploads of
+        several files sent like this go out in parallel."""
+        return self._broker_aux.submit(
+            "POST",
+            "copy_user_files",
+            json=self._get_aux_request(
+                file_names, run_number=run_number, pgroup=pgroup, check_group=check_group
+            ),
         )
 
     def pulse_picker_action_start_step(
@@ -610,11 +656,18 @@ class Daq(Assembly):
             )
 
     def append_start_status_to_scan(
-        self, scan=None, pgroup=None, append_status_info=True, **kwargs
+        self,
+        scan=None,
+        pgroup=None,
+        append_status_info=True,
+        status_ca_snapshot=True,
+        **kwargs,
     ):
         if not append_status_info:
             return
-        namespace_status = self.namespace.get_status(base=None)
+        namespace_status = self.namespace.get_status(
+            base=None, ca_snapshot=status_ca_snapshot
+        )
         stat = {"status_run_start": namespace_status}
         scan.namespace_status = stat
 
@@ -716,33 +769,48 @@ class Daq(Assembly):
             print("WARNING: issue adding data to run table")
         print(f"Runtable appending took: {time.time()-t_start_rt:.3f} s")
 
-    def copy_scan_info_to_raw(self, scan, pgroup=None, **kwargs):
-        t_start = time.time()
-
+    def _get_scan_aux_dir(self, scan, pgroup=None):
         if pgroup is None:
             pgroup = self.pgroup
-
         if hasattr(scan, "daq_run_number"):
             runno = scan.daq_run_number.get_current_value()
         else:
             runno = self.get_last_run_number()
-
-        # get data that should come later from api or similar.
-        # run_directory = list(
-        #     Path(f"/sf/bernina/data/{self.pgroup}/raw").glob(f"run{runno:04d}*")
-        # )[0].as_posix()
-
-        # Get scan info from scan
-        si = scan.scan_info
-        # save temprary file and send then to raw
-        if pgroup is None:
-            pgroup = self.pgroup
         tmpdir = Path(f"/sf/bernina/data/{pgroup}/res/run_data/daq/run{runno:04d}/aux")
         tmpdir.mkdir(exist_ok=True, parents=True)
         try:
             tmpdir.chmod(0o775)
         except:
             pass
+        return tmpdir, runno, pgroup
+
+    def copy_scan_info_to_raw(self, scan, pgroup=None, **kwargs):
+        """Append the last step of scan.scan_info to scan_info_rel.jsonl in
+        the aux directory of the run. Only the new step (and changed scan
+        parameters) are serialized; the log and the full scan_info_rel.json
+        are sent to raw once at the end of the scan by
+        consolidate_scan_info_to_raw."""
+        tmpdir, runno, pgroup = self._get_scan_aux_dir(scan, pgroup=pgroup)
+        scaninfolog = tmpdir / Path("scan_info_rel.jsonl")
+        if not (
+            hasattr(scan, "_scan_info_log")
+            and scan._scan_info_log.file_path == scaninfolog
+        ):
+            scan._scan_info_log = ScanInfoLog(scaninfolog)
+        scan._scan_info_log.append(scan.scan_info)
+        if not scaninfolog.group() == scaninfolog.parent.group():
+            shutil.chown(scaninfolog, group=scaninfolog.parent.group())
+
+    def consolidate_scan_info_to_raw(self, scan, pgroup=None, **kwargs):
+        """Write the complete scan_info_rel.json once and send it together
+        with the final step log to raw."""
+        tmpdir, runno, pgroup = self._get_scan_aux_dir(scan, pgroup=pgroup)
+        si = scan.scan_info
+        files = []
+        if hasattr(scan, "_scan_info_log"):
+            scan._scan_info_log.set_length(len(si["scan_values"]))
+            files.append(scan._scan_info_log.file_path.as_posix())
+
         scaninfofile = tmpdir / Path("scan_info_rel.json")
         if not Path(scaninfofile).exists():
             with open(scaninfofile, "w") as f:
@@ -754,28 +822,19 @@ class Daq(Assembly):
                 f.truncate()
         if not scaninfofile.group() == scaninfofile.parent.group():
             shutil.chown(scaninfofile, group=scaninfofile.parent.group())
-        # print(f"Copying info file to run {runno} to the raw directory of {pgroup}.")
+        files.append(scaninfofile.as_posix())
 
         scan.remaining_tasks.append(
-            Thread(
-                target=self.append_aux,
-                args=[scaninfofile.as_posix()],
-                kwargs=dict(pgroup=pgroup, run_number=runno),
-            )
+            self.append_aux_async(*files, pgroup=pgroup, run_number=runno)
         )
-        # DEBUG
-        # print(
-        #     f"Sending scan_info_rel.json in {Path(scaninfofile).parent.stem} to run number {runno}."
-        # )
-        scan.remaining_tasks[-1].start()
-        # response = daq.append_aux(scaninfofile.as_posix(), pgroup=pgroup, run_number=runno)
-        # print(f"Status: {response.json()['status']} Message: {response.json()['message']}")
-        # print(
-        #     f"--> creating and copying file took{time.time()-t_start} s, presently adding to deadtime."
-        # )
 
     def append_status_to_scan_and_store(
-        self, scan, pgroup=None, append_status_info=True, **kwargs
+        self,
+        scan,
+        pgroup=None,
+        append_status_info=True,
+        status_ca_snapshot=True,
+        **kwargs,
     ):
         if not append_status_info:
             return
@@ -783,7 +842,9 @@ class Daq(Assembly):
         if not len(scan.values_done()) > 0:
             return
 
-        namespace_status = self.namespace.get_status(base=None)
+        namespace_status = self.namespace.get_status(
+            base=None, ca_snapshot=status_ca_snapshot
+        )
         scan.namespace_status["status_run_end"] = namespace_status
         if hasattr(scan, "daq_run_number"):
             runno = scan.daq_run_number.get_current_value()
@@ -816,10 +877,12 @@ class Daq(Assembly):
         if not statusfile.group() == statusfile.parent.group():
             shutil.chown(statusfile, group=statusfile.parent.group())
 
-        response = self.append_aux(
-            statusfile.resolve().as_posix(),
-            pgroup=pgroup,
-            run_number=runno,
+        scan.remaining_tasks.append(
+            self.append_aux_async(
+                statusfile.resolve().as_posix(),
+                pgroup=pgroup,
+                run_number=runno,
+            )
         )
         # print("####### transfer status #######")
         # print(response.json())
@@ -850,11 +913,138 @@ class Daq(Assembly):
                 )
             self.checker.clear_and_start_counting()
 
+    def stop_checker_at_window_closed(self, scan, **kwargs):
+        """Evaluate the checker data of the step when its acquisition window
+        closes, check_checker_after_step uses this result. In pipelined scans
+        a failed step is marked here already, before the next step starts."""
+        if not self.checker:
+            return
+        if getattr(self.checker, "pulse_aligned", False):
+            try:
+                pulse_step = self.rate_multiplicator
+            except Exception:
+                pulse_step = 1
+            start_id, stop_id = self.last_pulse_ids
+            pulse_ids, good, received = self.checker.stop_and_get_mask(
+                start_id, stop_id, pulse_step=pulse_step
+            )
+            self._checker_window_result = (
+                start_id,
+                stop_id,
+                (pulse_ids, good, received),
+            )
+            # pipelined scans do not reacquire, see check_pulses_and_reacquire
+            n_required = int(
+                np.ceil(self.checker.required_fraction() * len(pulse_ids))
+            )
+            step_ok = received.any() and int(good.sum()) >= n_required
+        else:
+            self._checker_window_result = self.checker.stop_and_analyze()
+            step_ok = bool(self._checker_window_result)
+        if getattr(scan, "_pipelined", False) and not step_ok:
+            scan._current_step_ok = False
+
     def check_checker_after_step(self, scan, **kwargs):
         if self.checker:
-            if not self.checker.stop_and_analyze():
+            window_result = self._checker_window_result
+            self._checker_window_result = None
+            if getattr(self.checker, "pulse_aligned", False):
+                if not self.check_pulses_and_reacquire(
+                    scan, window_result=window_result, **kwargs
+                ):
+                    scan._current_step_ok = False
+            elif window_result is not None:
+                if not window_result:
+                    scan._current_step_ok = False
+            elif not self.checker.stop_and_analyze():
                 scan._current_step_ok = False
 
+    def check_pulses_and_reacquire(self, scan, pgroup=None, window_result=None, **kwargs):
+        """Pulse id aligned check of the step acquisition. The good pulse
+        masks are added to the step info as "checker", missing good pulses
+        are acquired in additional acquisitions of the step, up to
+        checker.max_reacquisitions times (not in pipelined scans, where the
+        adjustables already move to the next step). Returns whether enough
+        good pulses were recorded. The required number is the required
+        fraction of the pulses recorded in the acquisition window, pulses
+        without checker data count as bad, without any checker data the step
+        fails. window_result is the result of stop_checker_at_window_closed,
+        if the window was already evaluated."""
+        checker = self.checker
+        step_info = scan.scan_info["scan_step_info"][-1]
+        step_files = scan.scan_info["scan_files"][-1]
+        try:
+            pulse_step = self.rate_multiplicator
+        except Exception:
+            pulse_step = 1
+        if window_result is not None:
+            start_id, stop_id, (pulse_ids, good, received) = window_result
+        else:
+            start_id, stop_id = self.last_pulse_ids
+            pulse_ids, good, received = checker.stop_and_get_mask(
+                start_id, stop_id, pulse_step=pulse_step
+            )
+        n_required = int(np.ceil(checker.required_fraction() * len(pulse_ids)))
+        acquisitions = []
+        n_good = 0
+        no_data = False
+        while True:
+            n_good += int(good.sum())
+            acquisitions.append(
+                {
+                    "start_id": int(start_id),
+                    "stop_id": int(stop_id),
+                    "pulse_ids": pulse_ids.tolist(),
+                    "good": good.tolist(),
+                    "received": received.tolist(),
+                }
+            )
+            if not received.any():
+                print("Checker: no checker data recorded in the acquisition window.")
+                no_data = True
+                break
+            if not received.all():
+                print(
+                    f"Checker: no checker data for {int((~received).sum())} of {len(received)} pulses."
+                )
+            if n_good >= n_required:
+                break
+            if getattr(scan, "_pipelined", False):
+                break
+            if len(acquisitions) > checker.max_reacquisitions:
+                break
+            n_missing = n_required - n_good
+            print(
+                colorama.Fore.RED
+                + f"Checker: {n_good} of {n_required} required good pulses, acquiring {n_missing} more."
+                + colorama.Fore.RESET
+            )
+            self.check_checker_before_step(scan)
+            self.pulse_picker_action_start_step(scan, **kwargs)
+            acq = self.acquire(
+                scan=scan,
+                Npulses=int(n_missing * pulse_step),
+                pgroup=pgroup,
+            )
+            acq.wait()
+            self.pulse_picker_action_end_step(scan, **kwargs)
+            if hasattr(acq, "file_names") and step_files is not None:
+                step_files.extend(acq.file_names)
+            start_id, stop_id = self.last_pulse_ids
+            pulse_ids, good, received = checker.stop_and_get_mask(
+                start_id, stop_id, pulse_step=pulse_step
+            )
+
+        step_info["checker"] = {
+            "n_good": n_good,
+            "n_required": n_required,
+            "acquisitions": acquisitions,
+        }
+        if no_data or n_good < n_required:
+            print(f"Checker: {n_good} good pulses, {n_required} were required.")
+            return False
+        return True
+
     def copy_aliases_to_scan(self, scan, send_aliases_now=False, pgroup=None, **kwargs):
         if send_aliases_now or (len(scan.values_done()) == 1):
             namespace_aliases = self.namespace.alias.get_all()
@@ -889,17 +1079,14 @@ class Daq(Assembly):
                 shutil.chown(aliasfile, group=aliasfile.parent.group())
 
             scan.remaining_tasks.append(
-                Thread(
-                    target=self.append_aux,
-                    args=[aliasfile.resolve().as_posix()],
-                    kwargs=dict(pgroup=pgroup, run_number=runno),
+                self.append_aux_async(
+                    aliasfile.resolve().as_posix(), pgroup=pgroup, run_number=runno
                 )
             )
             # DEBUG
             # print(
             #     f"Sending scan_info_rel.json in {Path(aliasfile).parent.stem} to run number {runno}."
             # )
-            scan.remaining_tasks[-1].start()
             # response = daq.append_aux(
             #     aliasfile.resolve().as_posix(),
             #     pgroup=pgroup,
@@ -1015,12 +1202,21 @@ class Daq(Assembly):
                 pickle.dump(monitor_result, f)
 
         print(f"Copying monitor file to run {runno} to the raw directory of {pgroup}.")
-        response = self.append_aux(
+        def print_response(fut):
+            try:
+                response = fut.result()
+                print(
+                    f"Status: {response.json()['status']} Message: {response.json()['message']}"
+                )
+            except Exception as e:
+                print(f"Copying monitor file to run {runno} failed: {e}")
+
+        fut = self.append_aux_async(
             scanmonitorfile.as_posix(), pgroup=pgroup, run_number=runno
         )
-        print(
-            f"Status: {response.json()['status']} Message: {response.json()['message']}"
-        )
+        fut.add_done_callback(print_response)
+        if hasattr(scan, "remaining_tasks"):
+            scan.remaining_tasks.append(fut)
 
     def get_callback_keywords(self):
         kws_all = set([])
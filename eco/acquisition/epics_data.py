@@ -3,13 +3,15 @@ import h5py
 from epics import PV
 import os
 import datetime
-from threading import Thread
+from queue import Queue
+from threading import Condition, Thread
 from time import sleep
 from pathlib import Path
 from .utilities import Acquisition
 import time
 from ..elements.adjustable import AdjustableFS
 from escape import ArrayTimestamps
+from ..epics.subscription_hub import hub
 
 
 class RunFilenameGenerator:
@@ -68,6 +70,166 @@ class RunFilenameGenerator:
         )
 
 
+class CountdownLatch:
+    """Released when count_down() was called count times."""
+
+    def __init__(self, count):
+        self._count = count
+        self._condition = Condition()
+
+    @property
+    def count(self):
+        return self._count
+
+    def count_down(self):
+        with self._condition:
+            self._count -= 1
+            if self._count <= 0:
+                self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """True if released, False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._count <= 0, timeout)
+
+
+class H5StreamWriter:
+    """Appends chunks of channel data to an HDF5 file in a writer thread,
+    one group per channel with datasets data and timestamps."""
+
+    def __init__(self, file_name):
+        self.file = h5py.File(name=file_name, mode="w")
+        self._queue = Queue()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def create(self, name, shape, dtype):
+        if np.dtype(dtype).kind == "O":
+            dtype = h5py.string_dtype()
+        grp = self.file.create_group(name=name)
+        grp.create_dataset(
+            name="data", shape=(0,) + shape, maxshape=(None,) + shape, dtype=dtype
+        )
+        grp.create_dataset(name="timestamps", shape=(0,), maxshape=(None,), dtype=float)
+
+    def write(self, name, values, timestamps):
+        self._queue.put((name, values, timestamps))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            name, values, timestamps = item
+            for dsname, arr in [("data", values), ("timestamps", timestamps)]:
+                ds = self.file[name][dsname]
+                n = len(ds)
+                ds.resize(n + len(arr), axis=0)
+                ds[n:] = arr
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.file.close()
+
+
+class ChannelCollector:
+    """Collects Npulses updates of a PV into preallocated arrays typed by
+    the PV value (dtype and count), or with a writer in chunks of chunk_size
+    which are handed to the writer when full."""
+
+    def __init__(self, name, value, Npulses, latch, writer=None, chunk_size=1000):
+        self.name = name
+        self.Npulses = Npulses
+        self.latch = latch
+        self.writer = writer
+        arr = np.asarray(value if value is not None else np.nan)
+        if arr.dtype.kind in "USOV":
+            self.dtype, self.shape = object, ()
+        else:
+            self.dtype, self.shape = arr.dtype, arr.shape
+        self.size = min(chunk_size, Npulses) if writer else Npulses
+        self.count = 0
+        self._new_buffers()
+        if writer:
+            writer.create(name, self.shape, self.dtype)
+
+    def _new_buffers(self):
+        self.values = np.empty((self.size,) + self.shape, dtype=self.dtype)
+        self.timestamps = np.full(self.size, np.nan)
+        self._n = 0
+
+    def callback(self, value=None, timestamp=None, **kwargs):
+        if self.count >= self.Npulses:
+            return
+        self.values[self._n] = value
+        self.timestamps[self._n] = np.nan if timestamp is None else timestamp
+        self._n += 1
+        self.count += 1
+        if self.writer and (self._n == self.size or self.count == self.Npulses):
+            self.flush()
+        if self.count == self.Npulses:
+            self.latch.count_down()
+
+    def flush(self):
+        if self._n:
+            self.writer.write(
+                self.name, self.values[: self._n], self.timestamps[: self._n]
+            )
+            self._new_buffers()
+
+    def get_data(self):
+        return {
+            "values": self.values[: self.count],
+            "timestamps": self.timestamps[: self.count],
+        }
+
+
+def collect_channels(channels, Npulses, timeout=None, file_name=None, chunk_size=1000):
+    """Collect Npulses monitor updates of every PV in channels (name: PV).
+
+    Completes when all channels have Npulses values, or after timeout
+    seconds with the values collected so far. With file_name the data is
+    streamed to an HDF5 file while collecting instead of being returned."""
+    latch = CountdownLatch(len(channels))
+    writer = H5StreamWriter(file_name) if file_name else None
+    collectors = {
+        k: ChannelCollector(
+            k,
+            channel.get(),
+            Npulses,
+            latch,
+            writer=writer,
+            chunk_size=chunk_size,
+        )
+        for k, channel in channels.items()
+    }
+    cb_indices = {
+        k: hub.add_callback(channel.pvname, collectors[k].callback)
+        for k, channel in channels.items()
+    }
+    try:
+        if not latch.wait(timeout=timeout):
+            print(
+                "Timeout, incomplete channels: "
+                + ", ".join(
+                    f"{k} ({c.count}/{Npulses})"
+                    for k, c in collectors.items()
+                    if c.count < Npulses
+                )
+            )
+    finally:
+        for k, channel in channels.items():
+            hub.remove_callback(channel.pvname, cb_indices[k])
+        if writer:
+            for collector in collectors.values():
+                collector.flush()
+            writer.close()
+    if writer:
+        return {k: {"count": c.count} for k, c in collectors.items()}
+    return {k: c.get_data() for k, c in collectors.items()}
+
+
 class EpicsDaq:
     def __init__(
         self,
@@ -115,7 +277,7 @@ class EpicsDaq:
         channels = self.channel_list.get_current_value()
         for channel in channels:
             if not (channel in self.channels.keys()):
-                self.channels[channel] = PV(channel, auto_monitor=True)
+                self.channels[channel] = hub.get_pv(channel)
 
     def generate_run_number(self, scan, **kwargs):
         os.glob(self._default_file_path)
@@ -133,7 +295,7 @@ class EpicsDaq:
         channels = self.channel_list.get_current_value()
         for channel in channels:
             if not (channel in self.channels.keys()):
-                self.channels[channel] = PV(channel, auto_monitor=True)
+                self.channels[channel] = hub.get_pv(channel)
 
     def write_scan_info(self, scan, **kwargs):
         if not Path(scan.scan_info_filename).exists():
@@ -145,12 +307,16 @@ class EpicsDaq:
                 json.dump(self.scan_info, f, sort_keys=True, cls=NumpyEncoder)
                 f.truncate()
 
-    def h5(self, fina=None, channel_list=None, Npulses=None, queue_size=100):
-        if channel_list is None:
-            channel_list = self.channel_list
-        if not channel_list.get_current_value() == list(self.channels.keys()):
-            self.update_channels()
-
+    def h5(
+        self,
+        fina=None,
+        channel_list=None,
+        Npulses=None,
+        queue_size=100,
+        timeout=None,
+        chunk_size=1000,
+    ):
+        """Stream Npulses updates of all channels to the HDF5 file fina."""
         if os.path.isfile(fina):
             print("!!! File %s already exists, would you like to delete it?" % fina)
             if input("(y/n)") == "y":
@@ -159,64 +325,46 @@ class EpicsDaq:
             else:
                 return
 
-        data = self.get_data(channel_list=None, Npulses=None, queue_size=100)
+        data = self.get_data(
+            channel_list=channel_list,
+            Npulses=Npulses,
+            timeout=timeout,
+            file_name=fina,
+            chunk_size=chunk_size,
+        )
 
-        f = h5py.File(name=fina, mode="w")
-        for k in data.keys():
-            dat = f.create_group(name=k)
-            dat.create_dataset(name="data", data=data[k]["values"])
-            dat.create_dataset(name="timestamps", data=data[k]["timestamps"])
-            dat.create_dataset(
-                name="pulse_id", data=np.arange(Npulses) + round(time.time() * 100)
-            )
+        with h5py.File(name=fina, mode="a") as f:
+            for k in data.keys():
+                f[k].create_dataset(
+                    name="pulse_id",
+                    data=np.arange(data[k]["count"]) + round(time.time() * 100),
+                )
         return data
 
-    def get_data(self, channel_list=None, Npulses=None, queue_size=100, **kwargs):
+    def get_data(
+        self,
+        channel_list=None,
+        Npulses=None,
+        queue_size=100,
+        timeout=None,
+        file_name=None,
+        chunk_size=1000,
+        **kwargs,
+    ):
+        """Npulses monitor updates of all channels as {channel: {"values":
+        array, "timestamps": array}}, see collect_channels."""
         if channel_list is None:
             channel_list = self.channel_list
         if not channel_list.get_current_value() == list(self.channels.keys()):
             self.update_channels()
 
-        data = {}
-        counters = {}
-        channels = self.channels
-        for k, channel in channels.items():
-            channelval = channel.value
-            if type(channelval) == np.ndarray:
-                shape = (Npulses,) + channelval.shape
-                dtype = channelval.dtype
-            else:
-                shape = (Npulses,)
-                dtype = type(channelval)
-
-            data[k] = {
-                "values": np.ndarray(
-                    shape,
-                    dtype=dtype,
-                ),
-                "timestamps": np.ndarray(
-                    (Npulses,),
-                    dtype=float,
-                ),
-            }
-
-            counters[k] = 0
-
-        def cb_getdata(ch=None, k="", *args, **kwargs):
-            data[k]["values"][counters[k]] = kwargs["value"]
-            data[k]["timestamps"][counters[k]] = kwargs["timestamp"]
-            counters[k] = counters[k] + 1
-            if counters[k] == Npulses:
-                ch.clear_callbacks()
-
-        for k, channel in channels.items():
-            channel.add_callback(callback=cb_getdata, ch=channel, k=k)
-        while True:
-            sleep(0.005)
-            if np.mean(list(counters.values())) == Npulses:
-                break
-
-        return data
+        return collect_channels(
+            self.channels,
+            Npulses,
+            timeout=timeout,
+            file_name=file_name,
+            chunk_size=chunk_size,
+        )
 
     # def acquire(self, Npulses=100, default_path=True, scan=None):
     #    file_name = scan._description
@@ -268,7 +416,7 @@ class EpicsDaq:
 
         def acquire():
             t_tmp = time.time()
-            data_step = self.get_data(Npulses)
+            data_step = self.get_data(Npulses=Npulses)
             scan_wr().data.append(data_step)
             t_stop = time.time()
             scan_wr().timestamp_intervals.append(StepTime(t_tmp, t_stop))
@@ -385,9 +533,17 @@ class Epicstools:
         else:
             self.channel_list = channel_list
         for channel in self.channel_list:
-            self.channels.append(PV(channel, auto_monitor=True))
+            self.channels.append(hub.get_pv(channel))
 
-    def h5(self, fina=None, channel_list=None, Npulses=None, queue_size=100):
+    def h5(
+        self,
+        fina=None,
+        channel_list=None,
+        Npulses=None,
+        queue_size=100,
+        timeout=None,
+        chunk_size=1000,
+    ):
         channel_list = self.channel_list
 
         if os.path.isfile(fina):
@@ -398,40 +554,19 @@ class Epicstools:
             else:
                 return
 
-        data = []
-        counters = []
-        channels = self.channels
-        for channel in channels:
-            channelval = channel.value
-            if type(channelval) == np.ndarray:
-                shape = (Npulses,) + channelval.shape
-                dtype = channelval.dtype
-            else:
-                shape = (Npulses,)
-                dtype = type(channelval)
-            data.append(np.ndarray(shape, dtype=dtype))
-            counters.append(0)
-
-        def cb_getdata(ch=None, m=0, *args, **kwargs):
-            data[m][counters[m]] = kwargs["value"]
-            counters[m] = counters[m] + 1
-            if counters[m] == Npulses:
-                ch.clear_callbacks()
-
-        for m, channel in enumerate(channels):
-            channel.add_callback(callback=cb_getdata, ch=channel, m=m)
-        while True:
-            sleep(0.005)
-            if np.mean(counters) == Npulses:
-                break
-
-        f = h5py.File(name=fina, mode="w")
-        for n, channel in enumerate(channel_list):
-            dat = f.create_group(name=channel)
-            dat.create_dataset(name="data", data=data[n])
-            dat.create_dataset(
-                name="pulse_id", data=np.arange(Npulses) + round(time.time() * 100)
-            )
+        data = collect_channels(
+            dict(zip(channel_list, self.channels)),
+            Npulses,
+            timeout=timeout,
+            file_name=fina,
+            chunk_size=chunk_size,
+        )
+        with h5py.File(name=fina, mode="a") as f:
+            for channel in channel_list:
+                f[channel].create_dataset(
+                    name="pulse_id",
+                    data=np.arange(data[channel]["count"]) + round(time.time() * 100),
+                )
         return data
 
     def acquire(self, file_name=None, Npulses=100, default_path=True):
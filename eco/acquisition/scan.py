@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 import copy
 from datetime import datetime
 from itertools import product
@@ -11,10 +12,16 @@ from pathlib import Path
 import colorama
 
 from eco.elements.protocols import Adjustable
-from eco.utilities.utilities import NumpyEncoder, foo_get_kwargs, linlog_intervals
+from eco.utilities.utilities import (
+    NumpyEncoder,
+    PropagatingThread,
+    foo_get_kwargs,
+    linlog_intervals,
+)
 from ..elements.adjustable import AdjustableMemory, DummyAdjustable
 from IPython import get_ipython
 from .daq_client import Daq
+from .step_order import grid_index_plan
 from eco.elements.assembly import Assembly
 from rich.progress import Progress
 import inputimeout
@@ -23,6 +30,9 @@ import inputimeout
 # TODO circular import issue
 from eco.elements.detector import DetectorGet, DetectorMemory
 
+# background tasks of scans, e.g. copying files to the raw directory
+_task_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="scan_task")
+
 inval_chars = [" ", "/"]
 ScanNameError = Exception(
     f"invalid character in acquisition name, please use a name without {inval_chars}"
@@ -56,10 +66,23 @@ class StepScan(Assembly):
         return_at_end="timeout",
         timeout_adjustables=60,
         gridspecs=None,
+        pipelined=False,
         # elog=None,
         name="current_scan",
         **kwargs_callbacks,
     ):
+        """Step scan of adjustables over values, acquiring with counters at every step.
+
+        With pipelined=True, the data retrieval, file bookkeeping and end step
+        callbacks of a step run in the background once its acquisition window
+        is closed, while the next step starts. As in sequential scans the
+        start step callbacks run before the adjustables move. Counter
+        callbacks in callbacks_window_closed (e.g. the checker evaluation of
+        the acquisition window and closing the pulse picker) run in the
+        foreground right when the window closes. A step rejected there is
+        repeated before the start step callbacks of the next step run; a step
+        only rejected by end step callbacks is found after the adjustables
+        moved on, they are moved back and the step is acquired again."""
         # if np.any([char in fina for char in inval_chars]):
         #     raise ScanNameError
 
@@ -160,6 +183,7 @@ class StepScan(Assembly):
         self.return_at_end = return_at_end
         self.timeout_adjustables = timeout_adjustables
         # self._elog = elog
+        # concurrent.futures.Future of the background tasks of the scan
         self.remaining_tasks = []
         self.callbacks_start_scan = callbacks_start_scan
         self.callbacks_start_step = callbacks_start_step
@@ -169,6 +193,25 @@ class StepScan(Assembly):
         self.callbacks_kwargs = kwargs_callbacks
 
         self._have_run_callbacks_start_scan = False
+        self._pipelined = pipelined
+        self._pending_step = None
+
+    def submit_task(self, foo, *args, **kwargs):
+        """Run foo(*args, **kwargs) in the background, its future is added to
+        remaining_tasks."""
+        fut = _task_executor.submit(foo, *args, **kwargs)
+        self.remaining_tasks.append(fut)
+        return fut
+
+    def wait_remaining_tasks(self, timeout=None):
+        """Wait for the background tasks of the scan, returns the futures
+        which are not done yet."""
+        done, not_done = wait(self.remaining_tasks, timeout=timeout)
+        for fut in done:
+            if fut.exception() is not None:
+                print(f"Background task of scan failed: {fut.exception()}")
+        self.remaining_tasks = list(not_done)
+        return not_done
 
     def _get_names(self, elements):
         """Get the names of the elements."""
@@ -217,13 +260,26 @@ class StepScan(Assembly):
                 return True
         return False
 
-    def run_callbacks_end_step(self):
+    def run_callbacks_window_closed(self):
+        """Counter callbacks run when the acquisition window of a step is
+        closed (pipelined scans), they are skipped in the end step callbacks."""
+        for ctr in self.counters:
+            if hasattr(ctr, "callbacks_window_closed") and ctr.callbacks_window_closed:
+                for tcb in ctr.callbacks_window_closed:
+                    tcb(self, **self.callbacks_kwargs)
+
+    def run_callbacks_end_step(self, skip_window_closed=False):
         if self.callbacks_end_step:
             for caller in self.callbacks_end_step:
                 caller(self, **self.callbacks_kwargs)
         for ctr in self.counters:
             if hasattr(ctr, "callbacks_end_step") and ctr.callbacks_end_step:
+                skip = []
+                if skip_window_closed:
+                    skip = getattr(ctr, "callbacks_window_closed", None) or []
                 for tcb in ctr.callbacks_end_step:
+                    if tcb in skip:
+                        continue
                     tcb(self, **self.callbacks_kwargs)
 
     def run_callbacks_end_scan(self):
@@ -243,6 +299,8 @@ class StepScan(Assembly):
     #     return fina
 
     def do_next_step(self, step_info=None, verbose=True):
+        if self._pipelined:
+            return self._do_next_step_pipelined(step_info=step_info, verbose=verbose)
         self._current_step_ok = True
         t_step_start = time()
         self.run_callbacks_start_step()
@@ -374,6 +432,172 @@ class StepScan(Assembly):
 
         return True
 
+    def _do_next_step_pipelined(self, step_info=None, verbose=True):
+        # while a step is pending in the background it is still _values_todo[0]
+        pending = self._pending_step
+        n_ahead = 1 if pending else 0
+        if not len(self._values_todo) > n_ahead:
+            if pending:
+                self._finish_pending_step()
+                return True
+            return False
+        values_step = self._values_todo[n_ahead]
+
+        # the checker decision and pulse picker of the pending step were
+        # handled when its window closed, a rejected step is repeated before
+        # anything of the next step starts.
+        if pending and not self._current_step_ok:
+            self._finish_pending_step()
+            return True
+
+        t_step_start = time()
+        self.run_callbacks_start_step()
+        dt_callbacks_step_start = time() - t_step_start
+
+        t_adj_start = time()
+        ms = []
+        for adj, tv in zip(self.adjustables, values_step):
+            ms.append(adj.set_target_value(tv))
+        for tm in ms:
+            tm.wait(timeout=self.timeout_adjustables)
+        dt_adj = time() - t_adj_start
+
+        if pending:
+            if not self._finish_pending_step():
+                # rejected by an end step callback, the step is still
+                # _values_todo[0], move back and repeat it.
+                return True
+
+        self._current_step_ok = True
+        self.values_current_step = values_step
+        statstr = "Step %d of %d" % (
+            self.next_step + 1,
+            len(self._values_todo) + len(self._values_done),
+        )
+
+        sleep(self._settling_time)
+
+        t_ctr_start = time()
+        self.readbacks_current_step = []
+        statstr += "   "
+        for adj in self.adjustables:
+            self.readbacks_current_step.append(adj.get_current_value())
+            try:
+                if hasattr(adj, "name"):
+                    statstr += f"{adj.name} @ {self.readbacks_current_step[-1]:.3f}, "
+            except:
+                pass
+
+        statstr += " ; Ctrs "
+        if not self.has_callbacks_step_counting():
+            acs = []
+            for ctr in self.counters:
+                acs.append(
+                    ctr.acquire(
+                        scan=self,
+                        Npulses=self.pulses_per_step[0],
+                        **self.callbacks_kwargs,
+                    )
+                )
+                try:
+                    if hasattr(ctr, "name"):
+                        statstr += f"{ctr.name}, "
+                except:
+                    pass
+            for ta in acs:
+                if hasattr(ta, "wait_window_closed"):
+                    ta.wait_window_closed()
+                else:
+                    ta.wait()
+
+            def get_filenames():
+                filenames = []
+                for ta in acs:
+                    ta.wait()
+                    if hasattr(ta, "file_names"):
+                        filenames.extend(ta.file_names)
+                return filenames
+
+        else:
+            # counters started and stopped by the scan are retrieved in the foreground.
+            for ctr in self.counters:
+                ctr.start(scan=self, **self.callbacks_kwargs)
+                try:
+                    if hasattr(ctr, "name"):
+                        statstr += f"{ctr.name}, "
+                except:
+                    pass
+            self.run_callbacks_step_counting()
+            filenames_counted = []
+            for ctr in self.counters:
+                resp = ctr.stop(scan=self, **self.callbacks_kwargs)
+                filenames_counted.extend(resp["files"])
+            get_filenames = lambda: filenames_counted
+        dt_ctr = time() - t_ctr_start
+        self.run_callbacks_window_closed()
+
+        if callable(step_info):
+            tstepinfo = step_info.get_current_value()
+        else:
+            tstepinfo = {}
+        gridspecs = self.grid_specs.get_current_value()
+        if gridspecs:
+            tstepinfo["grid_index"] = gridspecs["index_plan"][self.next_step]
+        tstepinfo["times"] = {
+            "callbacks_step_start": dt_callbacks_step_start,
+            "adjustables": dt_adj,
+            "counters": dt_ctr,
+        }
+        readbacks_step = self.readbacks_current_step
+
+        def finish_step():
+            t_background_start = time()
+            filenames = get_filenames()
+            tstepinfo["times"]["retrieve"] = time() - t_background_start
+            t_callbacks_step_end = time()
+            self.append_scan_info(
+                values_step,
+                readbacks_step,
+                step_files=filenames,
+                step_info=tstepinfo,
+            )
+            self.run_callbacks_end_step(skip_window_closed=True)
+            tstepinfo["times"]["callbacks_step_end"] = time() - t_callbacks_step_end
+            print(statstr[:-2] + " done.", end="\n")
+
+        thread = PropagatingThread(target=finish_step)
+        self._pending_step = {
+            "thread": thread,
+            "readbacks": readbacks_step,
+            "step_info": tstepinfo,
+            "t_window_closed": time(),
+        }
+        thread.start()
+        return True
+
+    def _finish_pending_step(self):
+        """Join the background part of the pending step and book it as done
+        or rejected. Returns whether the step was ok."""
+        pending = self._pending_step
+        t_join_start = time()
+        try:
+            pending["thread"].join()
+        finally:
+            self._pending_step = None
+        times = pending["step_info"]["times"]
+        times["wait_background"] = time() - t_join_start
+        times["overlap_background"] = t_join_start - pending["t_window_closed"]
+
+        if self._current_step_ok:
+            self._values_done.append(self._values_todo.pop(0))
+            self.pulses_done.append(self.pulses_per_step.pop(0))
+            self.readbacks.append(pending["readbacks"])
+            self.next_step += 1
+            return True
+        else:
+            self.remove_last_scan_info_entry()
+            return False
+
     def append_scan_info(
         self, values_step, readbacks_step, step_files=None, step_info=None
     ):
@@ -495,6 +719,11 @@ class StepScan(Assembly):
                 tb = "Ended all steps without interruption."
             finally:
                 self._progress.stop()
+                if self._pending_step:
+                    try:
+                        self._finish_pending_step()
+                    except:
+                        tb += "\n" + traceback.format_exc()
                 print(tb)
 
                 self.run_callbacks_end_scan()
@@ -860,6 +1089,73 @@ class Scans(Assembly):
             s.scan_all(step_info=step_info)
         return s
 
+    def flyscan(
+        self,
+        adjustable,
+        start_pos,
+        end_pos,
+        N_intervals,
+        velocity=None,
+        description="",
+        counters=[],
+        start_immediately=True,
+        return_at_end="timeout",
+        settling_time=0,
+        step_info=None,
+        **kwargs_callbacks,
+    ):
+        """Continuous motion scan: the adjustable moves once from start_pos to
+        end_pos (with velocity if given, requires a speed child like in
+        MotorRecord) within a single pulse id window of the counters.
+        Readback and pulse id are monitored during the motion, and afterwards
+        the acquired pulses are binned into virtual steps around the positions
+        defined by N_intervals (int: number of intervals, float: interval
+        size) which are stored in the scan step info."""
+
+        if type(N_intervals) is float:
+            positions = np.arange(start_pos, end_pos + N_intervals, N_intervals)
+        else:
+            positions = np.linspace(start_pos, end_pos, N_intervals + 1)
+
+        if not counters:
+            counters = self._default_counters
+        pulse_id_pvnames = [
+            ctr.pulse_id.pvname
+            for ctr in counters
+            if hasattr(ctr, "pulse_id") and hasattr(ctr.pulse_id, "pvname")
+        ]
+        if not pulse_id_pvnames:
+            raise ValueError("flyscan needs a counter with a pulse_id channel.")
+
+        fly = FlyMotion(
+            adjustable,
+            end_pos,
+            positions,
+            pulse_id_pvname=pulse_id_pvnames[0],
+            velocity=velocity,
+        )
+
+        s = StepScan(
+            [adjustable],
+            [[start_pos]],
+            counters,
+            Npulses=1,
+            description=description,
+            return_at_end=return_at_end,
+            settling_time=settling_time,
+            callbacks_start_scan=self.callbacks_start_scan,
+            callbacks_start_step=self.callbacks_start_step,
+            callbacks_step_counting=[fly.move],
+            callbacks_end_step=[fly.bin_virtual_steps] + self.callbacks_end_step,
+            callbacks_end_scan=self.callbacks_end_scan,
+            name="acquiring_scan",
+            **kwargs_callbacks,
+        )
+        self._append(s, name="acquiring_scan", overwrite=True, delete_old=True)
+        if start_immediately:
+            s.scan_all(step_info=step_info)
+        return s
+
     def snakescan(
         self,
         adjustable_slow,
@@ -989,11 +1285,17 @@ class Scans(Assembly):
         settling_time=0,
         step_info=None,
         repetitions=1,
+        axis_motions=None,
+        planning_time_limit=5,
         **kwargs_callbacks,
     ):
         """
         Mesh scan, i.e. a scan in multiple dimensions, where the last adjustable is moved first.
-        The scanning order can be changed by setting the `scanning_order` parameter.
+        The scanning order can be changed by setting the `scanning_order` parameter:
+        "last_fastest", "first_fastest" or "optimized", the order with minimal predicted
+        motion time from the current positions. Motions are estimated from the speed and
+        acceleration_time of the adjustables unless axis_motions (AxisMotion per
+        dimension) are given.
         """
         adjustables = []
         positions = []
@@ -1006,10 +1308,13 @@ class Scans(Assembly):
 
         shape = [len(tp) for tp in positions]
 
-        if scanning_order == "last_fastest":
-            index_plan = list(product(*[range(n) for n in shape]))
-        elif scanning_order == "fist_fastst":
-            index_plan = [tc[::-1] for tc in product(*[range(n) for n in shape][::-1])]
+        index_plan, predicted_motion_time = grid_index_plan(
+            scanning_order,
+            positions,
+            adjustables,
+            axis_motions=axis_motions,
+            time_limit=planning_time_limit,
+        )
 
         values = []
         for ixs in index_plan:
@@ -1020,6 +1325,8 @@ class Scans(Assembly):
             "positions": positions,
             "index_plan": index_plan,
         }
+        if predicted_motion_time is not None:
+            gridspecs["predicted_motion_time"] = predicted_motion_time
 
         if not counters:
             counters = self._default_counters
@@ -1060,11 +1367,17 @@ class Scans(Assembly):
         return_at_end="timeout",
         settling_time=0,
         step_info=None,
+        axis_motions=None,
+        planning_time_limit=5,
         **kwargs_callbacks,
     ):
         """
         Most general scan, i.e. a scan of multiple adjustable in multiple dimensions, where the last adjustable is moved first.
-        The scanning order can be changed by setting the `scanning_order` parameter.
+        The scanning order can be changed by setting the `scanning_order` parameter:
+        "last_fastest", "first_fastest" or "optimized", the order with minimal predicted
+        motion time from the current positions. Motions are estimated from the speed and
+        acceleration_time of the adjustables unless axis_motions (AxisMotion per
+        dimension) are given.
         """
         adjustables = []
         positions = []
@@ -1091,10 +1404,13 @@ class Scans(Assembly):
 
         shape = [len(tp) for tp in positions]
 
-        if scanning_order == "last_fastest":
-            index_plan = list(product(*[range(n) for n in shape]))
-        elif scanning_order == "fist_fastst":
-            index_plan = [tc[::-1] for tc in product(*[range(n) for n in shape][::-1])]
+        index_plan, predicted_motion_time = grid_index_plan(
+            scanning_order,
+            positions,
+            adjustables,
+            axis_motions=axis_motions,
+            time_limit=planning_time_limit,
+        )
 
         values = []
         for ixs in index_plan:
@@ -1127,6 +1443,8 @@ class Scans(Assembly):
             "index_plan": index_plan,
             "adjustables": adjustables_names,
         }
+        if predicted_motion_time is not None:
+            gridspecs["predicted_motion_time"] = predicted_motion_time
 
         adjustables_flat = []
         for ta in adjustables:
@@ -1163,6 +1481,164 @@ class Scans(Assembly):
         return s
 
 
+class FlyMotion:
+    """Continuous move of one adjustable as counting callback of a scan step,
+    with epics monitors of its readback and of the pulse id to tag the
+    readback values with pulse ids."""
+
+    def __init__(
+        self,
+        adjustable,
+        end_pos,
+        positions,
+        pulse_id_pvname,
+        velocity=None,
+        readback_pvname=None,
+    ):
+        self.adjustable = adjustable
+        self.end_pos = end_pos
+        self.positions = np.asarray(positions)
+        self.velocity = velocity
+        if velocity is not None and not hasattr(adjustable, "speed"):
+            raise ValueError(
+                "Adjustable has no speed to set a fly scan velocity, use velocity=None."
+            )
+        if readback_pvname is None:
+            if hasattr(adjustable, "readback") and hasattr(
+                adjustable.readback, "pvname"
+            ):
+                readback_pvname = adjustable.readback.pvname
+            else:
+                readback_pvname = adjustable.pvname
+        self.readback_pvname = readback_pvname
+        self.pulse_id_pvname = pulse_id_pvname
+        self._monitors = {}
+
+    def move(self, scan, **kwargs):
+        from eco.epics.monitor import Monitor
+
+        self._monitors = {
+            "readback": Monitor(self.readback_pvname),
+            "pulse_id": Monitor(self.pulse_id_pvname),
+        }
+        if self.velocity is not None:
+            velocity_before = self.adjustable.speed.get_current_value()
+            self.adjustable.speed.set_target_value(self.velocity).wait()
+        try:
+            self.adjustable.set_target_value(self.end_pos).wait()
+        finally:
+            for tmon in self._monitors.values():
+                tmon.stop_callback()
+            if self.velocity is not None:
+                self.adjustable.speed.set_target_value(velocity_before).wait()
+
+    def bin_virtual_steps(self, scan, **kwargs):
+        rb = self._monitors["readback"].data
+        pid = self._monitors["pulse_id"].data
+        acquisition_pulse_ids = None
+        pulse_step = 1
+        for ctr in scan.counters:
+            if getattr(ctr, "last_pulse_ids", None):
+                acquisition_pulse_ids = ctr.last_pulse_ids
+                try:
+                    pulse_step = ctr.rate_multiplicator
+                except Exception:
+                    pass
+                break
+        virtual_steps, trace = bin_fly_readbacks(
+            pid["value"],
+            pid["timestamp"],
+            rb["value"],
+            rb["timestamp"],
+            self.positions,
+            acquisition_pulse_ids=acquisition_pulse_ids,
+            pulse_step=pulse_step,
+        )
+        tstepinfo = scan.scan_info["scan_step_info"][-1]
+        tstepinfo["virtual_steps"] = virtual_steps
+        tstepinfo["fly_readbacks"] = trace
+
+
+def bin_fly_readbacks(
+    pulse_ids,
+    pulse_id_timestamps,
+    readbacks,
+    readback_timestamps,
+    positions,
+    acquisition_pulse_ids=None,
+    pulse_step=1,
+    pulse_rate=100,
+):
+    """Tag readbacks with pulse ids and bin all pulses into virtual steps.
+
+    The pulse id of every readback update is interpolated from the pulse id
+    monitor via the epics timestamps (extrapolated with pulse_rate in Hz if
+    the monitor has a single update). The readback is then interpolated to
+    every recorded pulse id, those of the acquisition (start_id, stop_id)
+    given as acquisition_pulse_ids, every pulse_step-th one, or else those
+    covered by the monitors. Pulses are assigned to the position in
+    positions they are closest to.
+
+    Returns (virtual_steps, trace) dictionaries, virtual_steps holding per
+    position the pulse id range, number of pulses and mean readback."""
+    pulse_ids = np.asarray(pulse_ids, dtype=float)
+    pulse_id_timestamps = np.asarray(pulse_id_timestamps, dtype=float)
+    readbacks = np.asarray(readbacks, dtype=float)
+    readback_timestamps = np.asarray(readback_timestamps, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+
+    if len(pulse_ids) == 0 or len(readbacks) == 0:
+        print("Fly scan: no pulse id or readback updates recorded, no virtual steps.")
+        rb_pulse_ids = np.empty(0)
+        all_pulse_ids = np.empty(0)
+        all_readbacks = np.empty(0)
+    else:
+        if len(pulse_ids) == 1:
+            rb_pulse_ids = pulse_ids[0] + np.round(
+                (readback_timestamps - pulse_id_timestamps[0]) * pulse_rate
+            )
+        else:
+            rb_pulse_ids = np.interp(readback_timestamps, pulse_id_timestamps, pulse_ids)
+        if acquisition_pulse_ids is not None:
+            start_id, stop_id = acquisition_pulse_ids
+        else:
+            covered = np.concatenate([pulse_ids, rb_pulse_ids])
+            start_id, stop_id = covered.min(), covered.max()
+        all_pulse_ids = np.arange(
+            np.ceil(start_id / pulse_step) * pulse_step, stop_id + 1, pulse_step
+        )
+        all_readbacks = np.interp(all_pulse_ids, rb_pulse_ids, readbacks)
+
+    order = np.argsort(positions)
+    edges = (positions[order][1:] + positions[order][:-1]) / 2
+    step_index = order[np.searchsorted(edges, all_readbacks)]
+
+    virtual_steps = {
+        "values": positions.tolist(),
+        "pulse_id_start": [],
+        "pulse_id_stop": [],
+        "N_pulses": [],
+        "readback_mean": [],
+    }
+    for n in range(len(positions)):
+        sel = step_index == n
+        if sel.any():
+            virtual_steps["pulse_id_start"].append(int(all_pulse_ids[sel].min()))
+            virtual_steps["pulse_id_stop"].append(int(all_pulse_ids[sel].max()))
+            virtual_steps["N_pulses"].append(int(sel.sum()))
+            virtual_steps["readback_mean"].append(float(all_readbacks[sel].mean()))
+        else:
+            virtual_steps["pulse_id_start"].append(None)
+            virtual_steps["pulse_id_stop"].append(None)
+            virtual_steps["N_pulses"].append(0)
+            virtual_steps["readback_mean"].append(None)
+    trace = {
+        "pulse_id": rb_pulse_ids.tolist(),
+        "readback": readbacks.tolist(),
+    }
+    return virtual_steps, trace
+
+
 class RunFilenameGenerator:
     def __init__(self, path, prefix="run", Ndigits=4, separator="_", suffix="json"):
         self.separator = separator
@@ -1,7 +1,11 @@
+from collections import OrderedDict
 from numbers import Number
 import os
 from pathlib import Path
+from threading import RLock
+from time import time
 from escape.swissfel import load_dataset_from_scan
+from lazy_object_proxy import Proxy
 
 # from eco.elements.assembly import Assembly
 import json
@@ -9,6 +13,195 @@ import json
 from pandas import DataFrame
 
 
+class RunIndex:
+    """Cached listing of the run directories (runXXXX) in a raw directory.
+
+    The directory mtime is checked on every refresh, the directory is
+    rescanned only when it changed, and then only new entries are checked.
+    Runs without the file required_file are rechecked at most every
+    min_refresh_interval seconds. The listing is
+    kept in cache_file between sessions."""
+
+    def __init__(
+        self, path, required_file=None, cache_file=None, min_refresh_interval=2.0
+    ):
+        self.path = Path(path)
+        self.required_file = required_file
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = RLock()
+        self._dir_mtime = None
+        self._last_refresh = 0
+        self._runs = {}
+        self._load_cache()
+
+    def _load_cache(self):
+        if not (self.cache_file and self.cache_file.exists()):
+            return
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+            if cache["path"] == self.path.as_posix():
+                self._dir_mtime = cache["dir_mtime"]
+                self._runs = {int(k): v for k, v in cache["runs"].items()}
+        except Exception as e:
+            print(f"Could not read run index cache {self.cache_file}: {e}")
+
+    def _store_cache(self):
+        if not self.cache_file:
+            return
+        try:
+            if not self.cache_file.parent.exists():
+                self.cache_file.parent.mkdir(parents=True)
+            with open(self.cache_file.as_posix() + "tmp", "w") as f:
+                json.dump(
+                    {
+                        "path": self.path.as_posix(),
+                        "dir_mtime": self._dir_mtime,
+                        "runs": self._runs,
+                    },
+                    f,
+                )
+            Path(self.cache_file.as_posix() + "tmp").replace(self.cache_file)
+        except Exception as e:
+            print(f"Could not write run index cache {self.cache_file}: {e}")
+
+    def _has_required_file(self, run_number):
+        if not self.required_file:
+            return True
+        return (self.path / f"run{run_number:04d}" / self.required_file).exists()
+
+    def refresh(self, force=False):
+        with self._lock:
+            changed = False
+            dir_mtime = self.path.stat().st_mtime
+            if force or not dir_mtime == self._dir_mtime:
+                names = set()
+                with os.scandir(self.path) as it:
+                    for entry in it:
+                        if not entry.name[:3] == "run":
+                            continue
+                        numstring = entry.name.split("run")[1]
+                        if not numstring.isdecimal():
+                            continue
+                        run_number = int(numstring)
+                        names.add(run_number)
+                        if run_number in self._runs:
+                            continue
+                        if not entry.is_dir():
+                            continue
+                        self._runs[run_number] = {
+                            "mtime": entry.stat().st_mtime,
+                            "complete": self._has_required_file(run_number),
+                        }
+                        changed = True
+                for run_number in set(self._runs) - names:
+                    self._runs.pop(run_number)
+                    changed = True
+                self._dir_mtime = dir_mtime
+            now = time()
+            if force or now - self._last_refresh >= self.min_refresh_interval:
+                self._last_refresh = now
+                for run_number, info in self._runs.items():
+                    if not info["complete"] and self._has_required_file(run_number):
+                        info["complete"] = True
+                        changed = True
+            if changed:
+                self._store_cache()
+
+    def get_run_numbers(self):
+        self.refresh()
+        return sorted(rn for rn, info in self._runs.items() if info["complete"])
+
+    def get_run_path(self, run_number):
+        return self.path / f"run{run_number:04d}"
+
+
+def _default_index_cache(path, name):
+    return (
+        Path.home()
+        / ".cache"
+        / "eco"
+        / "run_index"
+        / (Path(path).as_posix().strip("/").replace("/", "_") + f"_{name}.json")
+    )
+
+
+def _estimate_nbytes(obj, depth=2):
+    """Memory held by obj, summing nbytes of numpy like attributes."""
+    if hasattr(obj, "nbytes") and isinstance(getattr(obj, "nbytes"), int):
+        return obj.nbytes
+    if depth == 0:
+        return 0
+    if isinstance(obj, dict):
+        values = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    elif hasattr(obj, "__dict__"):
+        values = obj.__dict__.values()
+    else:
+        return 0
+    return sum(_estimate_nbytes(v, depth=depth - 1) for v in list(values))
+
+
+class LRUCache:
+    """Ordered cache evicting the least recently used entries beyond
+    max_items or beyond memory_budget bytes, as estimated by size_func at
+    insertion."""
+
+    def __init__(
+        self,
+        max_items=None,
+        memory_budget=None,
+        size_func=_estimate_nbytes,
+        on_evict=None,
+    ):
+        self.max_items = max_items
+        self.memory_budget = memory_budget
+        self.size_func = size_func
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = RLock()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return self._data.keys()
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._sizes[key] = self.size_func(value) if self.memory_budget else 0
+            self._evict()
+
+    def pop(self, key, *args):
+        with self._lock:
+            self._sizes.pop(key, None)
+            return self._data.pop(key, *args)
+
+    @property
+    def nbytes(self):
+        return sum(self._sizes.values())
+
+    def _evict(self):
+        while len(self._data) > 1 and (
+            (self.max_items and len(self._data) > self.max_items)
+            or (self.memory_budget and self.nbytes > self.memory_budget)
+        ):
+            key, value = self._data.popitem(last=False)
+            self._sizes.pop(key, None)
+            if self.on_evict:
+                self.on_evict(key, value)
+
+
 class RunData:
     def __init__(
         self,
@@ -16,29 +209,57 @@ class RunData:
         path_search="/sf/bernina/data/{pgroup:s}/raw",
         load_kwargs={},
         name="",
+        max_loaded_runs=20,
+        memory_budget=8 * 2**30,
     ):
         # super().__init__(name=name)
         # self._append(pgroup_adj, name="pgroup")
         self.pgroup = pgroup_adj
         self.path_search = path_search
         self.load_kwargs = load_kwargs
-        self.loaded_runs = {}
+        self._indices = {}
+        self.loaded_runs = LRUCache(
+            max_items=max_loaded_runs,
+            memory_budget=memory_budget,
+            size_func=lambda trun: _estimate_nbytes(trun["dataset"]),
+            on_evict=self._unload_run,
+        )
+
+    def _get_index(self):
+        path = self.path_search.format(pgroup=self.pgroup.get_current_value())
+        if path not in self._indices:
+            self._indices[path] = RunIndex(
+                path, cache_file=_default_index_cache(path, "runs")
+            )
+        return self._indices[path]
 
     def get_available_run_numbers(self):
-        pgroup = self.pgroup.get_current_value()
-        p = Path(self.path_search.format(pgroup=pgroup))
-        runs = []
-        for tp in p.iterdir():
-            if not tp.is_dir():
-                continue
-            if tp.name[:3] == "run":
-                numstring = tp.name.split("run")[1]
-                if numstring.isdecimal():
-                    runs.append(int(numstring))
-        runs.sort()
-        return runs
-
-    def load_run(self, run_number, **kwargs):
+        return self._get_index().get_run_numbers()
+
+    def get_run_info(self, run_number):
+        """Metadata of a run (meta/*.json files) without loading its data."""
+        if run_number < 0:
+            run_number = self.get_available_run_numbers()[run_number]
+        info = {}
+        meta_dir = self._get_index().get_run_path(run_number) / "meta"
+        for tf in sorted(meta_dir.glob("*.json")):
+            try:
+                with open(tf, "r") as fh:
+                    info[tf.stem] = json.load(fh)
+            except Exception as e:
+                print(f"Could not read {tf}: {e}")
+        return info
+
+    def _unload_run(self, run_number, trun):
+        self.__dict__.pop(f"run{run_number:04d}", None)
+
+    def load_run(self, run_number, lazy=False, **kwargs):
+        """Load a run dataset; with lazy=True a proxy is returned which loads
+        the dataset on first use."""
+        if lazy:
+            if run_number < 0:
+                run_number = self.get_available_run_numbers()[run_number]
+            return Proxy(lambda: self.get_run(run_number, **kwargs))
         if run_number < 0:
             run_number = self.get_available_run_numbers()[run_number]
             print(f"Loading run number {run_number}")
@@ -89,11 +310,13 @@ class RunData:
             + f" /sf/bernina/data/{self.pgroup.get_current_value()}/{subdir_type}"
         )
 
-    def get_run(self, run_number, **kwargs):
+    def get_run(self, run_number, lazy=False, **kwargs):
         if run_number < 0:
             run_number = self.get_available_run_numbers()[run_number]
             print(f"Finding run number {run_number}")
-        if run_number in self.loaded_runs.keys():
+        if lazy and run_number not in self.loaded_runs:
+            return self.load_run(run_number, lazy=True, **kwargs)
+        if run_number in self.loaded_runs:
             return self.loaded_runs[run_number]["dataset"]
         else:
             return self.load_run(run_number, **kwargs)
@@ -109,7 +332,11 @@ class RunData:
         )
         runnos = self.get_available_run_numbers()
         s += "\n"
-        s += f"{len(runnos)} available from {min(runnos)} to {max(runnos)}."
+        if runnos:
+            s += f"{len(runnos)} available from {min(runnos)} to {max(runnos)}."
+        else:
+            s += "No runs available."
+        s += f"\n{len(self.loaded_runs.keys())} loaded."
         return s
 
 
@@ -124,6 +351,7 @@ class StatusData:
         status_search="aux/status.json",
         load_kwargs={},
         name="",
+        max_loaded_statii=500,
     ):
         # super().__init__(name=name)
         # self._append(pgroup_adj, name="pgroup")
@@ -131,29 +359,28 @@ class StatusData:
         self.path_search = path_search
         self.status_search = status_search
         self.load_kwargs = load_kwargs
-        self.loaded_statii = {}
+        self._indices = {}
+        self.loaded_statii = LRUCache(max_items=max_loaded_statii)
         STATUS_DATA[self.pgroup.get_current_value()] = self
 
+    def _get_index(self):
+        path = self.path_search.format(pgroup=self.pgroup.get_current_value())
+        if path not in self._indices:
+            self._indices[path] = RunIndex(
+                path,
+                required_file=self.status_search,
+                cache_file=_default_index_cache(path, "status"),
+            )
+        return self._indices[path]
+
     def get_available_run_numbers(self):
-        pgroup = self.pgroup.get_current_value()
-        p = Path(self.path_search.format(pgroup=pgroup))
-        runs = []
-        for tp in p.iterdir():
-            if not tp.is_dir():
-                continue
-            if tp.name[:3] == "run":
-                numstring = tp.name.split("run")[1]
-                if numstring.isdecimal():
-                    if (tp / Path(self.status_search)).exists():
-                        runs.append(int(numstring))
-        runs.sort()
-        return runs
+        return self._get_index().get_run_numbers()
 
     def get_run_status(self, run_number, **kwargs):
         if run_number < 0:
             run_number = self.get_available_run_numbers()[run_number]
             print(f"Finding run number {run_number}")
-        if run_number in self.loaded_statii.keys():
+        if run_number in self.loaded_statii:
             return self.loaded_statii[run_number]
         else:
             return self.load_run_status(run_number, **kwargs)
@@ -162,7 +389,7 @@ class StatusData:
         if run_number < 0:
             run_number = self.get_available_run_numbers()[run_number]
             print(f"Loading run number {run_number}")
-        tkwargs = self.load_kwargs
+        tkwargs = self.load_kwargs.copy()
         tkwargs.update(kwargs)
 
         tks = {}
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from pathlib import Path
+
+from eco.utilities.utilities import NumpyEncoder
+
+STEP_KEYS = ["scan_values", "scan_readbacks", "scan_files", "scan_step_info"]
+
+
+class ScanInfoLog:
+    """Append-only JSON Lines record of a growing scan_info dictionary.
+
+    Every call of append() writes only what changed since the previous call:
+    a "header" record when any of the non-step entries (e.g. scan_parameters)
+    changed, compared by a hash of their JSON, and one "step" record for the
+    last step. A step record with index i replaces all previously written
+    steps >= i, so a step that was rejected and acquired again is overwritten
+    on re-acquisition.
+    read_scan_info_log() reconstructs the scan_info dictionary."""
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        self._header_fingerprint = None
+        with open(self.file_path, "w"):
+            pass
+
+    def _write(self, records):
+        with open(self.file_path, "a") as f:
+            for record in records:
+                if not isinstance(record, str):
+                    record = json.dumps(record, cls=NumpyEncoder)
+                f.write(record + "\n")
+
+    def append(self, scan_info):
+        """Write header changes and the last step of scan_info."""
+        records = []
+        header = {"record": "header"}
+        header.update(
+            {key: value for key, value in scan_info.items() if key not in STEP_KEYS}
+        )
+        header = json.dumps(header, cls=NumpyEncoder, sort_keys=True)
+        fingerprint = hashlib.sha1(header.encode()).hexdigest()
+        if not fingerprint == self._header_fingerprint:
+            records.append(header)
+            self._header_fingerprint = fingerprint
+        n_steps = len(scan_info["scan_values"])
+        if n_steps > 0:
+            record = {"record": "step", "index": n_steps - 1}
+            record.update({key: scan_info[key][-1] for key in STEP_KEYS})
+            records.append(record)
+        self._write(records)
+
+    def set_length(self, n_steps):
+        """Mark steps beyond n_steps (e.g. a rejected last step) as removed."""
+        self._write([{"record": "length", "length": n_steps}])
+
+
+def read_scan_info_log(file_path):
+    """Reconstruct a scan_info dictionary from a ScanInfoLog file.
+
+    A truncated last line (file still being written) is ignored."""
+    scan_info = {key: [] for key in STEP_KEYS}
+    with open(file_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            kind = record.pop("record")
+            if kind == "header":
+                scan_info.update(record)
+            elif kind == "step":
+                index = record.pop("index")
+                for key in STEP_KEYS:
+                    del scan_info[key][index:]
+                    scan_info[key].append(record[key])
+            elif kind == "length":
+                for key in STEP_KEYS:
+                    del scan_info[key][record["length"] :]
+    return scan_info
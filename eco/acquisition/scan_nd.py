@@ -1,6 +1,7 @@
 from .scan import StepScan
 import numpy as np
 from numpy.random import RandomState
+from .step_order import AxisMotion, plan_grid_order
 
 
 # class Scan:
@@ -75,7 +76,42 @@ class ScanND:
     def shape(self):
         return tuple([len(ta[0]) for ta in self.scan_array])
 
-    def create_stepping_order(self, order="C"):
+    def get_positions(self):
+        """Positions per dimension, shape (n,) or (n, m) for m adjustables."""
+        return [np.asarray(ta, dtype=float).T for ta in self.scan_array]
+
+    def create_stepping_order(
+        self, order="C", indices=None, axis_motions=None, start=None, time_limit=5
+    ):
+        """Grid index tuples in C or F order or, with order="optimized", in
+        the order of minimal predicted motion time (starting from start,
+        default the current positions). indices selects a subset of the grid,
+        e.g. from create_random_selection. The predicted motion time is
+        stored in self.predicted_motion_time."""
+        if order == "optimized":
+            if axis_motions is None:
+                axis_motions = [
+                    [AxisMotion.from_adjustable(tadj) for tadj in tadjs]
+                    for tadjs in self.scan_adjustables
+                ]
+            if start is None:
+                start = [
+                    tadj.get_current_value()
+                    for tadjs in self.scan_adjustables
+                    for tadj in tadjs
+                ]
+            index_plan, self.predicted_motion_time = plan_grid_order(
+                self.get_positions(),
+                axis_motions,
+                start=start,
+                indices=indices,
+                time_limit=time_limit,
+            )
+            return index_plan
+        if indices is not None:
+            flat = np.ravel_multi_index(np.asarray(indices).T, self.shape, order=order)
+            indices = np.asarray(indices)[np.argsort(flat)]
+            return [tuple(int(ti) for ti in te) for te in indices]
         return [
             tuple(te)
             for te in np.vstack(
@@ -87,9 +123,15 @@ class ScanND:
         self,
         N_elements=None,
         scan_percentage=None,
-        random_type=equal,
-        sort_dimensions=False,
+        seed=0,
     ):
-
-        rs = RandomState(seed=0)
-        rs.choice(a, 5, p=np.exp(-a) / sum(np.exp(-a)), replace=False)
+        """Random subset of grid index tuples (n_points, n_dims), of
+        N_elements or scan_percentage of all steps, to be ordered by
+        create_stepping_order(indices=...)."""
+        if N_elements is None:
+            if scan_percentage is None:
+                raise Exception("Either N_elements or scan_percentage is required.")
+            N_elements = int(round(self.steps_total * scan_percentage / 100))
+        rs = RandomState(seed=seed)
+        flat = rs.choice(self.steps_total, N_elements, replace=False)
+        return np.vstack(np.unravel_index(np.sort(flat), self.shape)).T
@@ -0,0 +1,248 @@
+"""Step ordering by predicted motion time.
+
+The time of a step is the longest move time of all axes (the adjustables of
+a step are moved simultaneously), each axis modelled with a trapezoidal
+velocity profile and a settling time (AxisMotion). plan_step_order orders
+arbitrary point lists (nearest neighbour followed by 2-opt improvement),
+plan_grid_order tries the serpentine orders over all axis nestings of a grid
+and improves the best one, grid_index_plan gives the index_plan of grid scans
+for the scanning orders of Scans.meshscan and Scans.scan."""
+
+from itertools import permutations, product
+from time import time
+
+import numpy as np
+
+
+class AxisMotion:
+    """Move time estimate of an axis: velocity (units/s), acceleration_time
+    (s to reach velocity) and settling_time (s after every move)."""
+
+    def __init__(self, velocity=1.0, acceleration_time=0.0, settling_time=0.0):
+        self.velocity = float(velocity)
+        self.acceleration_time = float(acceleration_time)
+        self.settling_time = float(settling_time)
+
+    @classmethod
+    def from_adjustable(
+        cls, adjustable, velocity=None, acceleration_time=None, settling_time=0.0
+    ):
+        """Estimate from the speed and acceleration_time children of e.g. a
+        MotorRecord, velocity 1 and no acceleration if they do not exist."""
+        if velocity is None:
+            try:
+                velocity = adjustable.speed.get_current_value()
+            except Exception:
+                velocity = 1.0
+        if acceleration_time is None:
+            try:
+                acceleration_time = adjustable.acceleration_time.get_current_value()
+            except Exception:
+                acceleration_time = 0.0
+        if not velocity or velocity <= 0:
+            velocity = 1.0
+        return cls(velocity, acceleration_time or 0.0, settling_time)
+
+    def move_time(self, distance):
+        distance = np.abs(distance)
+        v = self.velocity
+        ta = self.acceleration_time
+        if ta > 0:
+            # distance below v*ta: triangular profile with acceleration v/ta
+            t = np.where(
+                distance >= v * ta,
+                distance / v + ta,
+                2 * np.sqrt(distance * ta / v),
+            )
+        else:
+            t = distance / v
+        return np.where(distance > 0, t + self.settling_time, 0.0)
+
+    def __repr__(self):
+        return (
+            f"AxisMotion(velocity={self.velocity}, acceleration_time="
+            f"{self.acceleration_time}, settling_time={self.settling_time})"
+        )
+
+
+def step_times(points_from, points_to, axes):
+    """Move times from points_from to points_to (arrays of shape (..., n_axes),
+    broadcast against each other)."""
+    diff = np.asarray(points_to, dtype=float) - np.asarray(points_from, dtype=float)
+    t = np.zeros(diff.shape[:-1])
+    for n, axis in enumerate(axes):
+        t = np.maximum(t, axis.move_time(diff[..., n]))
+    return t
+
+
+def predict_motion_time(points, axes, start=None):
+    """Total move time visiting points (n_points, n_axes) in their order."""
+    points = np.asarray(points, dtype=float)
+    if start is not None:
+        points = np.vstack([np.asarray(start, dtype=float)[None, :], points])
+    if len(points) < 2:
+        return 0.0
+    return float(step_times(points[:-1], points[1:], axes).sum())
+
+
+def _nearest_neighbour(points, axes, first):
+    n = len(points)
+    order = [first]
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[first] = False
+    for _ in range(n - 1):
+        candidates = np.flatnonzero(unvisited)
+        t = step_times(points[order[-1]], points[candidates], axes)
+        nxt = candidates[np.argmin(t)]
+        order.append(nxt)
+        unvisited[nxt] = False
+    return np.array(order)
+
+
+def _two_opt(points, axes, order, fixed_first, time_limit):
+    """Improve an open path by segment reversals until no reversal helps or
+    time_limit (s) is exceeded."""
+    order = np.array(order)
+    n = len(order)
+    t_start = time()
+    improved = True
+    while improved and time() - t_start < time_limit:
+        improved = False
+        for i in range(-1 if not fixed_first else 0, n - 2):
+            if time() - t_start > time_limit:
+                break
+            p = points[order]
+            j = np.arange(i + 2, n) if i >= 0 else np.arange(1, n)
+            # reversing order[i+1..j] replaces edges (i, i+1) and (j, j+1)
+            if i >= 0:
+                gain = step_times(p[i], p[i + 1], axes) - step_times(p[i], p[j], axes)
+            else:
+                gain = np.zeros(len(j))
+            has_next = j + 1 < n
+            jn = j[has_next]
+            gain[has_next] += step_times(p[jn], p[jn + 1], axes) - step_times(
+                p[i + 1], p[jn + 1], axes
+            )
+            best = np.argmax(gain)
+            if gain[best] > 1e-9:
+                order[i + 1 : j[best] + 1] = order[i + 1 : j[best] + 1][::-1]
+                improved = True
+    return order
+
+
+def plan_step_order(points, axes, start=None, initial_order=None, time_limit=5):
+    """Order of points (n_points, n_axes) with minimal predicted motion time,
+    starting from start (e.g. the current positions) if given.
+    Returns (order, predicted_time), order being indices into points."""
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        return np.array([], dtype=int), 0.0
+    fixed_first = start is not None
+    if fixed_first:
+        points = np.vstack([np.asarray(start, dtype=float)[None, :], points])
+        if initial_order is not None:
+            initial_order = np.concatenate([[0], np.asarray(initial_order) + 1])
+    if initial_order is None:
+        initial_order = _nearest_neighbour(points, axes, 0)
+    order = _two_opt(points, axes, initial_order, fixed_first, time_limit)
+    if fixed_first:
+        order = order[1:] - 1
+        points = points[1:]
+    return order, predict_motion_time(points[order], axes, start=start)
+
+
+def _serpentine_indices(shape, nesting):
+    """Grid indices (n_points, n_dims) in serpentine order, nesting lists the
+    dimensions from slowest to fastest."""
+    indices = np.zeros((1, 0), dtype=int)
+    for dim in nesting:
+        n = shape[dim]
+        block = []
+        for m, prefix in enumerate(indices):
+            steps = np.arange(n) if m % 2 == 0 else np.arange(n)[::-1]
+            block.append(
+                np.hstack([np.repeat(prefix[None, :], n, axis=0), steps[:, None]])
+            )
+        indices = np.vstack(block)
+    return indices[:, np.argsort(nesting)]
+
+
+def plan_grid_order(positions, axes, start=None, indices=None, time_limit=5):
+    """Order of the points of a grid with minimal predicted motion time.
+    positions has one array per dimension, of shape (n,) or (n, m) for m
+    adjustables moved together, axes one AxisMotion (or a list of m) per
+    dimension, start the positions of all adjustables. indices
+    (n_points, n_dims) selects a subset of the grid, e.g. a random one.
+    Returns (index_plan, predicted_time), index_plan being a list of grid
+    index tuples."""
+    shape = tuple(len(tp) for tp in positions)
+    columns = [np.asarray(tp, dtype=float).reshape(len(tp), -1) for tp in positions]
+    axes_flat = []
+    for tax, tcol in zip(axes, columns):
+        tax = list(tax) if np.iterable(tax) else [tax]
+        if not len(tax) == tcol.shape[1]:
+            raise Exception("Number of axes and positions per dimension differ.")
+        axes_flat.extend(tax)
+
+    def to_points(ixs):
+        return np.hstack(
+            [tcol[ixs[:, n]] for n, tcol in enumerate(columns)]
+            + [np.empty((len(ixs), 0))]
+        )
+
+    if indices is None:
+        best = None
+        for nesting in permutations(range(len(shape))):
+            ixs = _serpentine_indices(shape, list(nesting))
+            t = predict_motion_time(to_points(ixs), axes_flat, start=start)
+            if best is None or t < best[1]:
+                best = (ixs, t)
+        indices = best[0]
+        initial_order = np.arange(len(indices))
+    else:
+        indices = np.asarray(indices, dtype=int).reshape(-1, len(shape))
+        initial_order = None
+    order, t = plan_step_order(
+        to_points(indices),
+        axes_flat,
+        start=start,
+        initial_order=initial_order,
+        time_limit=time_limit,
+    )
+    return [tuple(int(ti) for ti in ix) for ix in indices[order]], t
+
+
+def grid_index_plan(
+    scanning_order, positions, adjustables, axis_motions=None, time_limit=5
+):
+    """index_plan of a grid scan and its predicted motion time (None unless
+    scanning_order is "optimized"). adjustables has one adjustable or list of
+    adjustables per dimension, their motion is estimated with
+    AxisMotion.from_adjustable unless axis_motions is given."""
+    shape = [len(tp) for tp in positions]
+    if scanning_order == "last_fastest":
+        return list(product(*[range(n) for n in shape])), None
+    elif scanning_order in ["first_fastest", "fist_fastst"]:
+        return [tc[::-1] for tc in product(*[range(n) for n in shape][::-1])], None
+    elif scanning_order == "optimized":
+        adjustables_flat = []
+        for ta in adjustables:
+            adjustables_flat.extend(ta if isinstance(ta, (list, tuple)) else [ta])
+        if axis_motions is None:
+            axis_motions = [
+                (
+                    [AxisMotion.from_adjustable(tta) for tta in ta]
+                    if isinstance(ta, (list, tuple))
+                    else AxisMotion.from_adjustable(ta)
+                )
+                for ta in adjustables
+            ]
+        index_plan, predicted_time = plan_grid_order(
+            positions,
+            axis_motions,
+            start=[ta.get_current_value() for ta in adjustables_flat],
+            time_limit=time_limit,
+        )
+        print(f"Predicted motion time of the scan: {predicted_time:.1f} s")
+        return index_plan, predicted_time
+    raise Exception(f"Unknown scanning_order {scanning_order}")
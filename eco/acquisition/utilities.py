@@ -1,3 +1,4 @@
+from threading import Event
 from ..utilities import PropagatingThread
 from epics import PV
 from asyncio import Future
@@ -18,15 +19,31 @@ class Acquisition:
             self.__dict__[key] = val
         self._stopper = stopper
         self._get_result = get_result
+        self._window_closed = Event()
         if acquire:
             self.set_acquire_foo(acquire, hold=hold)
 
     def set_acquire_foo(self, acquire, hold=True):
         self._acquire = acquire
-        self._thread = PropagatingThread(target=self._acquire)
+
+        def run():
+            try:
+                return self._acquire()
+            finally:
+                self._window_closed.set()
+
+        self._thread = PropagatingThread(target=run)
         if not hold:
             self._thread.start()
 
+    def set_window_closed(self):
+        """Signal that no more data is recorded, only retrieval is left."""
+        self._window_closed.set()
+
+    def wait_window_closed(self, timeout=None):
+        """Wait until the acquisition window is closed (or the acquisition done)."""
+        return self._window_closed.wait(timeout=timeout)
+
     def wait(self):
         self._thread.join()
         return self._get_result()
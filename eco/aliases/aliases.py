@@ -2,17 +2,59 @@ import os
 from pathlib import Path
 import json
 import logging
+from threading import RLock
 
 logger = logging.getLogger(__name__)
 
 
 class Alias:
+    """Node of the hierarchical alias tree.
+
+    Full names are memoized per base and the flattened (alias, channel,
+    channeltype) view of the subtree is cached; both are invalidated when
+    nodes are appended or popped."""
+
+    __slots__ = [
+        "alias",
+        "channel",
+        "channeltype",
+        "children",
+        "_parent",
+        "_full_names",
+        "_flat",
+        "__weakref__",
+    ]
+
     def __init__(self, alias, channel=None, channeltype=None, parent=None):
         self.alias = alias
         self.channel = channel
         self.channeltype = channeltype
         self.children = []
-        self.parent = parent
+        self._full_names = {}
+        self._flat = {}
+        self._parent = parent
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        self._invalidate_flat()
+        self._parent = parent
+        self._invalidate_flat()
+        self._invalidate_full_names()
+
+    def _invalidate_full_names(self):
+        self._full_names.clear()
+        for tc in self.children:
+            tc._invalidate_full_names()
+
+    def _invalidate_flat(self):
+        node = self
+        while isinstance(node, Alias):
+            node._flat.clear()
+            node = node._parent
 
     def append(self, subalias):
         assert type(subalias) is Alias, "You can only append aliases to aliases!"
@@ -20,6 +62,7 @@ class Alias:
             subalias.alias in [tc.alias for tc in self.children]
         ), f"Alias {subalias.alias} exists already!"
         self.children.append(subalias)
+        self._invalidate_flat()
         if subalias.parent is None:
             subalias.parent = self
         else:
@@ -31,50 +74,67 @@ class Alias:
     def pop_object(self, obj):
         i = self.children.index(obj)
         o = self.children.pop(i)
+        self._invalidate_flat()
         o.parent = None
 
-    def get_all(self, joiner=".", channeltypes=None):
-        aa = []
-        if self.channel:
-            ta = {}
-            ta["alias"] = self.alias
-            ta["channel"] = self.channel
-            if self.channeltype:
-                ta["channeltype"] = self.channeltype
-            if (not channeltypes) or (ta["channeltype"] in channeltypes):
-                aa.append(ta)
-        if self.children:
+    def _get_flat(self, joiner="."):
+        flat = self._flat.get(joiner)
+        if flat is None:
+            flat = []
+            if self.channel:
+                flat.append((self.alias, self.channel, self.channeltype))
             for tc in self.children:
-                taa = tc.get_all()
-                for ta in taa:
-                    if (not channeltypes) or (ta["channeltype"] in channeltypes):
-                        aa.append(
-                            {
-                                "alias": joiner.join([self.alias, ta["alias"]]),
-                                "channel": ta["channel"],
-                                "channeltype": ta["channeltype"],
-                            }
-                        )
-        return aa
+                flat.extend(
+                    (joiner.join([self.alias, ta]), tch, tct)
+                    for ta, tch, tct in tc._get_flat(joiner=joiner)
+                )
+            self._flat[joiner] = flat
+        return flat
 
-    def get_full_name(self, base=None, joiner="."):
-        """allembles full name with parent names down to base (is supplied). Joiner is the separator between the hirarchical names."""
-        if (not (base is None)) and (self is base.alias):
-            name = []
-            return ""
-        else:
+    def iter_all(self, joiner=".", channeltypes=None):
+        """Yields alias dictionaries of all channels in the tree below (and
+        including) this alias."""
+        for ta, tch, tct in self._get_flat(joiner=joiner):
+            if (not channeltypes) or (tct in channeltypes):
+                yield {"alias": ta, "channel": tch, "channeltype": tct}
+
+    def get_all(self, joiner=".", channeltypes=None):
+        """List of alias dictionaries of all channels in the tree below (and
+        including) this alias."""
+        return list(self.iter_all(joiner=joiner, channeltypes=channeltypes))
+
+    def get_name_below(self, base_alias, joiner="."):
+        """Full name relative to the alias base_alias (None for the root) and
+        whether base_alias was found among the parents; if not, the name goes
+        up to the root."""
+        if (base_alias is not None) and (self is base_alias):
+            return ("" if joiner else []), True
+        name = self._full_names.get(base_alias)
+        found = name is not None
+        if name is None:
             name = [self.alias]
-        parent = self.parent
-        while not parent == None:
-            if (not (base is None) and (parent is base.alias)) or (parent is None):
-                break
-            name.append(parent.alias)
-            parent = parent.__dict__.get("parent", None)
+            found = base_alias is None
+            parent = self.parent
+            while not parent is None:
+                if parent is base_alias:
+                    found = True
+                    break
+                name.append(parent.alias)
+                parent = getattr(parent, "parent", None)
+            # only names relative to an ancestor are kept, not to keep other
+            # bases alive.
+            if found:
+                self._full_names[base_alias] = name
 
         if joiner:
-            return joiner.join(reversed(name))
+            return joiner.join(reversed(name)), found
         else:
-            return name
+            return list(name), found
+
+    def get_full_name(self, base=None, joiner="."):
+        """allembles full name with parent names down to base (is supplied). Joiner is the separator between the hirarchical names."""
+        base_alias = None if base is None else base.alias
+        return self.get_name_below(base_alias, joiner=joiner)[0]
 
 
 #    def add_children(self, *args):
@@ -100,60 +160,154 @@ def append_object_to_object(obj_target, obj_init, *args, name=None, **kwargs):
 
 
 class Namespace:
+    """Alias namespace stored as a json list of alias dictionaries.
+
+    The entries are indexed by alias and by channel (first occurrence) and
+    bucketed by channeltype. store() only writes when entries were added, and
+    appends the new entries to the file if all previous ones are stored.
+    Changes of the entries and indexes and store() hold a lock, as objects
+    are initialised in parallel threads."""
+
     def __init__(self, namespace_file=None):
         path = Path(namespace_file)
         assert path.suffix == ".json", "file has no json extension"
         self._path = path
         self.name = path.stem
-        self.data = None
+        self._data = None
         self._modified = False
+        self._n_stored = None
+        self._by_alias = {}
+        self._by_channel = {}
+        self._by_channeltype = {}
+        self._lock = RLock()
 
     def read_file(self):
-        with self._path.open("r") as fp:
-            self.data = json.load(fp)
+        with self._lock:
+            with self._path.open("r") as fp:
+                self.data = json.load(fp)
             self._modified = False
+            self._n_stored = len(self._data)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        with self._lock:
+            self._data = data
+            self._n_stored = None
+            self._by_alias = {}
+            self._by_channel = {}
+            self._by_channeltype = {}
+            for td in data or []:
+                self._index_entry(td)
+
+    def _index_entry(self, entry):
+        self._by_alias[entry["alias"]] = entry
+        self._by_channel.setdefault(entry["channel"], entry)
+        self._by_channeltype.setdefault(entry["channeltype"], []).append(entry)
+
+    def _get_data(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self.read_file()
+        return self._data
 
     @property
     def aliases(self):
-        if self.data is None:
-            self.read_file()
-        return [td["alias"] for td in self.data]
+        self._get_data()
+        with self._lock:
+            return list(self._by_alias.keys())
 
     @property
     def channels(self):
-        if self.data is None:
-            self.read_file()
-        return [td["channel"] for td in self.data]
+        self._get_data()
+        with self._lock:
+            return [td["channel"] for td in self._data]
+
+    def __contains__(self, alias):
+        self._get_data()
+        return alias in self._by_alias
 
     def update(self, alias, channel, channeltype):
-        assert not alias in self.aliases, f"Duplicate alias {alias} found!"
-        # assert not channel in self.channels, f"Duplicate channel {channel} found!"
-        self.data.append(
-            {"alias": alias, "channel": channel, "channeltype": channeltype}
-        )
-        self._modified = True
+        self._get_data()
+        with self._lock:
+            assert not alias in self._by_alias, f"Duplicate alias {alias} found!"
+            # assert not channel in self.channels, f"Duplicate channel {channel} found!"
+            entry = {"alias": alias, "channel": channel, "channeltype": channeltype}
+            self._data.append(entry)
+            self._index_entry(entry)
+            self._modified = True
+
+    def update_many(self, entries):
+        """Add several alias dictionaries (as returned by Alias.get_all) at once.
+
+        Duplicates, within entries or with the namespace, raise before anything
+        is added."""
+        self._get_data()
+        entries = [
+            {
+                "alias": te["alias"],
+                "channel": te["channel"],
+                "channeltype": te["channeltype"],
+            }
+            for te in entries
+        ]
+        with self._lock:
+            new_aliases = set()
+            for te in entries:
+                assert not (
+                    te["alias"] in self._by_alias or te["alias"] in new_aliases
+                ), f"Duplicate alias {te['alias']} found!"
+                new_aliases.add(te["alias"])
+            for te in entries:
+                self._data.append(te)
+                self._index_entry(te)
+            if entries:
+                self._modified = True
+
+    def get_channeltype(self, channeltype):
+        """All entries of a channeltype, e.g. "CA" or "BS"."""
+        self._get_data()
+        with self._lock:
+            return list(self._by_channeltype.get(channeltype, []))
 
     def store(self):
-        if self._modified:
-            with self._path.open("w") as fp:
-                json.dump(self.data, fp)
-                self._modified = False
+        with self._lock:
+            if not self._modified:
+                return
+            if self._n_stored and self._path.exists():
+                with self._path.open("rb+") as fp:
+                    fp.seek(0, os.SEEK_END)
+                    pos = fp.tell()
+                    while pos > 0:
+                        pos -= 1
+                        fp.seek(pos)
+                        if fp.read(1) == b"]":
+                            break
+                    fp.seek(pos)
+                    fp.truncate()
+                    for td in self._data[self._n_stored :]:
+                        fp.write(b", " + json.dumps(td).encode())
+                    fp.write(b"]")
+            else:
+                with self._path.open("w") as fp:
+                    json.dump(self._data, fp)
+            self._n_stored = len(self._data)
+            self._modified = False
 
     def get_info(self, alias=None, channel=None):
         assert alias or channel, "Either search alias or channel needs to be defined!"
         assert not (
             alias and channel
         ), "Only either search alias or channel can be defined"
+        self._get_data()
         if alias:
-            if alias in self.aliases:
-                return self.data[self.aliases.index(alias)]
-            else:
-                return None
+            return self._by_alias.get(alias, None)
         if channel:
-            if channel in self.channels:
-                return self.data[self.channels.index(channel)]
-            else:
-                return None
+            return self._by_channel.get(channel, None)
 
 
 class NamespaceCollection:
@@ -44,6 +44,8 @@ namespace = Namespace(
     root_module=__name__,
     alias_namespace=NamespaceCollection().bernina,
     required_names_directory="/sf/bernina/config/eco/required_bernina_names.json",
+    initialisation_times_file="/sf/bernina/config/eco/initialisation_times_bernina.json",
+    startup_profile_file="/sf/bernina/config/eco/startup_profile_bernina.json",
 )
 namespace.alias_namespace.data = []
 
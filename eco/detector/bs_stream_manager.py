@@ -0,0 +1,340 @@
+"""Process wide bsread streams for DetectorBsStream.
+
+The manager reads subscribed channels with bsread sources in background
+threads and records every message into pulse id tagged ring buffers per
+channel (see eco.epics.monitor.RingBuffer). Values, sample collections and
+accumulations are served from these buffers. New channels get an additional
+source, so running sources (and their subscribers) are never interrupted,
+and released channels linger before their source stops. StandInBsSender
+sends a synthetic stream on a local port, a manager created with
+source_kwargs={"host": "localhost", "port": port} reads from it instead of
+the dispatcher."""
+
+from threading import Condition, Event, RLock, Thread
+from time import sleep, time
+
+import numpy as np
+from bsread import source
+
+from ..epics.monitor import RingBuffer, _buffer_type
+
+
+class _ChannelBuffer:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.pulse_ids = RingBuffer(np.int64, (), 256, max_size)
+        self.timestamps = RingBuffer(float, (), 256, max_size)
+        self.values = None
+        self.refcount = 0
+        self.released = 0.0
+
+    @property
+    def count(self):
+        """Number of values appended so far, including overwritten ones."""
+        return self.timestamps._count
+
+    def append(self, pulse_id, value):
+        if self.values is None:
+            dtype, shape = _buffer_type(value)
+            self.values = RingBuffer(dtype, shape, 256, self.max_size)
+        try:
+            self.values.append(value)
+        except (ValueError, TypeError):
+            self.values.to_object()
+            self.values.append(value)
+        self.pulse_ids.append(pulse_id)
+        # appended last, its count is the number of complete entries
+        self.timestamps.append(time())
+
+    def get_range(self, start, stop=None):
+        """Copies of (pulse_ids, values) of the entries with index start to
+        stop (default all complete ones), counted as count."""
+        if stop is None:
+            stop = self.count
+        if self.values is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        pulse_ids = self.pulse_ids.view_range(start, stop)
+        values = self.values.view_range(start, stop)
+        # both end at stop, at the wrap one of them may be clamped further
+        n = min(len(pulse_ids), len(values))
+        return (
+            np.array(pulse_ids[len(pulse_ids) - n :]),
+            np.array(values[len(values) - n :]),
+        )
+
+    def get_last(self, n=None):
+        stop = self.count
+        start = 0 if n is None else stop - n
+        return self.get_range(start, stop)
+
+
+class _Stream:
+    def __init__(self, channels):
+        self.channels = tuple(channels)
+        self.stop = Event()
+        self.thread = None
+
+
+class BsStreamManager:
+    """Channels are read by bsread sources running in background threads.
+    Subscribing channels that are not yet streamed starts an additional
+    source for them, running sources are never restarted. A source stops
+    once all its channels were unsubscribed for longer than linger seconds.
+
+    Sources are deliberately not merged into one: a merged source would have
+    to be reconnected on every change of the channel set, interrupting the
+    data of all running subscribers. The cost is one dispatcher stream per
+    subscription that added new channels."""
+
+    def __init__(
+        self, buffer_size=10000, receive_timeout=500, linger=300, source_kwargs={}
+    ):
+        self.buffer_size = buffer_size
+        self.receive_timeout = receive_timeout
+        self.linger = linger
+        self.source_kwargs = source_kwargs
+        self._buffers = {}
+        self._callbacks = {}
+        self._n_callback = 0
+        self._lock = RLock()
+        self._condition = Condition()
+        self._streams = []
+        self._streamed = {}
+        self._kept = set()
+        self.n_messages = 0
+
+    @property
+    def channels(self):
+        """Channels currently streamed."""
+        return tuple(sorted(self._streamed))
+
+    def subscribe(self, *channels):
+        """Add channels, those not yet streamed get an additional source."""
+        with self._lock:
+            new = []
+            for channel in channels:
+                if channel not in self._buffers:
+                    self._buffers[channel] = _ChannelBuffer(self.buffer_size)
+                self._buffers[channel].refcount += 1
+                if channel not in self._streamed and channel not in new:
+                    new.append(channel)
+            if new:
+                self._start_stream(new)
+
+    def unsubscribe(self, *channels):
+        """Release channels, they stay streamed for linger seconds."""
+        with self._lock:
+            for channel in channels:
+                buf = self._buffers.get(channel)
+                if buf is None or buf.refcount <= 0:
+                    continue
+                buf.refcount -= 1
+                if buf.refcount == 0:
+                    buf.released = time()
+
+    def _start_stream(self, channels):
+        stream = _Stream(channels)
+        for channel in channels:
+            self._streamed[channel] = stream
+        self._streams.append(stream)
+        stream.thread = Thread(target=self._run, args=(stream,), daemon=True)
+        stream.thread.start()
+
+    def _remove_stream(self, stream):
+        stream.stop.set()
+        for channel in stream.channels:
+            if self._streamed.get(channel) is stream:
+                del self._streamed[channel]
+        if stream in self._streams:
+            self._streams.remove(stream)
+
+    def _stop_if_idle(self, stream):
+        """Remove the stream if all its channels lingered long enough."""
+        with self._lock:
+            now = time()
+            for channel in stream.channels:
+                buf = self._buffers[channel]
+                if buf.refcount > 0 or now - buf.released < self.linger:
+                    return False
+            self._remove_stream(stream)
+            return True
+
+    def stop(self):
+        """Stop all sources, e.g. before changing source_kwargs."""
+        with self._lock:
+            streams = list(self._streams)
+            for stream in streams:
+                self._remove_stream(stream)
+        for stream in streams:
+            stream.thread.join(timeout=2 * self.receive_timeout / 1000 + 1)
+
+    def _run(self, stream):
+        kwargs = dict(receive_timeout=self.receive_timeout)
+        kwargs.update(self.source_kwargs)
+        if "host" not in kwargs:
+            kwargs["channels"] = list(stream.channels)
+        t_idle_check = time()
+        while not stream.stop.is_set():
+            try:
+                with source(**kwargs) as s:
+                    while not stream.stop.is_set():
+                        message = s.receive()
+                        if message is not None:
+                            self._handle(message, stream.channels)
+                        if time() - t_idle_check > 1:
+                            t_idle_check = time()
+                            if self._stop_if_idle(stream):
+                                return
+            except Exception as e:
+                print(f"bs stream of {len(stream.channels)} channels failed: {e}")
+                sleep(1)
+
+    def _handle(self, message, channels):
+        pulse_id = message.data.pulse_id
+        data = message.data.data
+        for channel in channels:
+            if channel in data:
+                value = data[channel].value
+                if value is not None:
+                    self._buffers[channel].append(pulse_id, value)
+        self.n_messages += 1
+        for n, (callback, cb_channels) in list(self._callbacks.items()):
+            # a callback gets the messages of the sources of its channels
+            if cb_channels and not any(ch in channels for ch in cb_channels):
+                continue
+            try:
+                if callback(message):
+                    self._callbacks.pop(n, None)
+            except Exception as e:
+                print(f"bs stream callback failed: {e}")
+                self._callbacks.pop(n, None)
+        with self._condition:
+            self._condition.notify_all()
+
+    def _wait_for(self, predicate, timeout):
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout)
+
+    def get_count(self, channel):
+        return self._buffers[channel].count
+
+    def get_current_value(self, channel, timeout=5):
+        """Latest value of a channel, waiting for the first one after subscribing.
+        The channel then stays subscribed for fast subsequent calls."""
+        if channel not in self._kept:
+            self._kept.add(channel)
+            self.subscribe(channel)
+        buf = self._buffers[channel]
+        if not self._wait_for(lambda: buf.count > 0, timeout):
+            raise TimeoutError(f"No bs data received for {channel} in {timeout} s")
+        return buf.get_last(1)[1][-1]
+
+    def wait_for_pulse_id(self, channel, pulse_id, timeout=1):
+        """Wait until a value of pulse_id or later arrived, returns success."""
+        buf = self._buffers[channel]
+
+        def arrived():
+            pulse_ids = buf.pulse_ids.view(1)
+            return len(pulse_ids) > 0 and pulse_ids[-1] >= pulse_id
+
+        return self._wait_for(arrived, timeout)
+
+    def get_since(self, channel, count):
+        """(pulse_ids, values) appended after the channel count was count."""
+        return self._buffers[channel].get_range(count)
+
+    def collect(self, channel, samples=None, seconds=None, timeout=None):
+        """(pulse_ids, values) of the next samples values or of the next
+        seconds. With samples, timeout limits the wait (default none). The
+        channel lingers in the stream afterwards, repeated calls do not
+        reconnect."""
+        self.subscribe(channel)
+        try:
+            buf = self._buffers[channel]
+            start = buf.count
+            if samples:
+                self._wait_for(lambda: buf.count - start >= samples, timeout)
+                pulse_ids, values = self.get_since(channel, start)
+                return pulse_ids[:samples], values[:samples]
+            sleep(seconds)
+            return self.get_since(channel, start)
+        finally:
+            self.unsubscribe(channel)
+
+    def get_aligned(self, *channels, n=None):
+        """(pulse_ids, {channel: values}) for the pulse ids present in the
+        buffers of all channels, optionally only the last n of those."""
+        data = {channel: self._buffers[channel].get_last() for channel in channels}
+        pulse_ids = None
+        for pids, _ in data.values():
+            pulse_ids = pids if pulse_ids is None else np.intersect1d(pulse_ids, pids)
+        if pulse_ids is None:
+            pulse_ids = np.empty(0, dtype=np.int64)
+        if n is not None:
+            pulse_ids = pulse_ids[-n:]
+        out = {}
+        for channel, (pids, values) in data.items():
+            # pulse ids are increasing in each buffer
+            out[channel] = values[np.searchsorted(pids, pulse_ids)]
+        return pulse_ids, out
+
+    def add_callback(self, callback, *channels):
+        """Call callback(message) for every message until it returns True."""
+        self.subscribe(*channels)
+        with self._lock:
+            self._n_callback += 1
+            n = self._n_callback
+            self._callbacks[n] = (callback, channels)
+        return n
+
+    def remove_callback(self, n, *channels):
+        self._callbacks.pop(n, None)
+        self.unsubscribe(*channels)
+
+    def has_callback(self, n):
+        return n in self._callbacks
+
+
+class StandInBsSender:
+    """Local bsread sender of synthetic channels, for tests of the manager.
+
+    channels maps channel names to functions of the pulse id giving the
+    value; messages are sent with rate Hz from a background thread."""
+
+    def __init__(self, channels, port=9999, rate=100, start_pulse_id=0):
+        self.channels = channels
+        self.port = port
+        self.rate = rate
+        self.pulse_id = start_pulse_id
+        self._stop = Event()
+        self._thread = None
+
+    def _run(self):
+        from bsread.sender import sender
+
+        with sender(port=self.port) as s:
+            while not self._stop.is_set():
+                s.send(
+                    data={k: foo(self.pulse_id) for k, foo in self.channels.items()},
+                    pulse_id=self.pulse_id,
+                )
+                self.pulse_id += 1
+                sleep(1 / self.rate)
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+bs_stream_manager = BsStreamManager()
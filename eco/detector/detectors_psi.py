@@ -10,6 +10,7 @@ from time import time, sleep
 from eco.acquisition.utilities import Acquisition
 from eco.acquisition.decorators import scannable
 from eco.epics.detector import CallbackEpics
+from .bs_stream_manager import bs_stream_manager
 
 
 @get_from_archive
@@ -35,30 +36,49 @@ class DetectorBsStream:
             tmp["name"] for tmp in dispatcher.get_current_channels()
         ]
 
-    def get_current_value(self, force_bsstream=False):
+    def _use_bsstream(self, force_bsstream):
+        if force_bsstream is None:
+            return not hasattr(self, "_pv")
+        return force_bsstream
+
+    def get_current_value(self, force_bsstream=False, timeout=5):
         if not force_bsstream:
             if not hasattr(self, "_pv"):
                 return None
             return self._pv.get()
         else:
-            raise NotImplementedError(
-                "setup of stream for bs channel not implemented yet"
+            return bs_stream_manager.get_current_value(
+                self.bs_channel, timeout=timeout
             )
 
     def get_stream_state(self, timeout=1):
         return pollStream(self.bs_channel, timeout=1)
 
     def create_stream_callback(self, foo):
-        with source(channels=[self.bs_channel]) as s:
-            done = False
-            while not done:
-                done = foo(s.receive())
-
-    def collect(self, seconds=None, samples=None):
+        """Call foo(message) for the messages of the shared bs stream until it
+        returns True."""
+        n = bs_stream_manager.add_callback(foo, self.bs_channel)
+        try:
+            while bs_stream_manager.has_callback(n):
+                sleep(0.01)
+        finally:
+            bs_stream_manager.remove_callback(n, self.bs_channel)
+
+    def collect(self, seconds=None, samples=None, force_bsstream=None):
+        """Values of the next samples updates or of the next seconds, from
+        the CA channel or (force_bsstream, default without CA channel) from
+        the shared bs stream, then self.pulse_ids_collected is set too."""
         if (not seconds) and (not samples):
             raise Exception(
                 "Either a time interval or number of samples need to be defined."
             )
+        if self._use_bsstream(force_bsstream):
+            pulse_ids, values = bs_stream_manager.collect(
+                self.bs_channel, samples=samples, seconds=seconds
+            )
+            self.pulse_ids_collected = list(pulse_ids)
+            self.data_collected = list(values)
+            return self.data_collected
         try:
             self._pv.callbacks.pop(self._collection["ix_cb"])
         except:
@@ -139,11 +159,21 @@ class DetectorBsStream:
 
         self._accumulate["n_cb"] = self._pv.add_callback(addData)
 
-    def accumulate_start(self):
+    def accumulate_start(self, force_bsstream=None):
         if not hasattr(self, "_accumulate_inf"):
             self._accumulate_inf = {"n_cb": -1}
-        self._pv.callbacks.pop(self._accumulate_inf["n_cb"], None)
+        if hasattr(self, "_pv"):
+            self._pv.callbacks.pop(self._accumulate_inf["n_cb"], None)
+        if self._accumulate_inf.get("bs_start") is not None:
+            bs_stream_manager.unsubscribe(self.bs_channel)
         self._data_inf = []
+        if self._use_bsstream(force_bsstream):
+            bs_stream_manager.subscribe(self.bs_channel)
+            self._accumulate_inf["bs_start"] = bs_stream_manager.get_count(
+                self.bs_channel
+            )
+            return
+        self._accumulate_inf["bs_start"] = None
 
         def addData(**kw):
             self._data_inf.append(kw["value"])
@@ -151,6 +181,15 @@ class DetectorBsStream:
         self._accumulate_inf["n_cb"] = self._pv.add_callback(addData)
 
     def accumulate_stop(self):
+        if self._accumulate_inf.get("bs_start") is not None:
+            pulse_ids, values = bs_stream_manager.get_since(
+                self.bs_channel, self._accumulate_inf["bs_start"]
+            )
+            bs_stream_manager.unsubscribe(self.bs_channel)
+            self._accumulate_inf["bs_start"] = None
+            self.pulse_ids_accumulated = list(pulse_ids)
+            self._data_inf = list(values)
+            return self._data_inf
         self._pv.callbacks.pop(self._accumulate_inf["n_cb"], None)
         return self._data_inf
 
@@ -13,7 +13,7 @@ from ..aliases import Alias
 from pathlib import Path
 from ..elements import memory
 from datetime import datetime
-import requests
+from ..utilities.http_transport import get_transport
 
 
 class JungfrauChannel(Assembly):
@@ -232,12 +232,20 @@ class Jungfrau(Assembly):
         else:
             return f"aux/{dest.name}"
 
+    @property
+    def _broker(self):
+        return get_transport(self.broker_address)
+
+    @property
+    def _broker_aux(self):
+        return get_transport(self.broker_address_aux)
+
     def get_dap_settings(self, force=False):
 
         if force:
             if 5 < (time.time() - self._last_dap_req_time):
-                self._last_dap_message = requests.get(
-                    f"{self.broker_address_aux}/get_dap_settings",
+                self._last_dap_message = self._broker_aux.get(
+                    "get_dap_settings",
                     json={"detector_name": self.jf_id},
                 ).json()
                 self._last_dap_req_time = time.time()
@@ -254,8 +262,8 @@ class Jungfrau(Assembly):
     def set_dap_settings(self, dap_setting_dict):
         # print("Setting not implmented yet!")
         # return
-        m = requests.post(
-            f"{self.broker_address_aux}/set_dap_settings",
+        m = self._broker_aux.post(
+            "set_dap_settings",
             json={"detector_name": self.jf_id, "parameters": dap_setting_dict},
         ).json()
         if m["status"] == "ok":
@@ -270,21 +278,21 @@ class Jungfrau(Assembly):
     def get_availability(self):
         is_available = (
             self.jf_id
-            in requests.get(f"{self.broker_address}/get_allowed_detectors").json()[
+            in self._broker.get("get_allowed_detectors").json()[
                 "detectors"
             ]
         )
         return is_available
 
     def get_vis_url(self):
-        tmp = requests.get(f"{self.broker_address}/get_allowed_detectors").json()
+        tmp = self._broker.get("get_allowed_detectors").json()
         ix = tmp["detectors"].index(self.jf_id)
         return tmp["visualisation_address"][ix]
 
     def get_isrunning(self):
         is_running = (
             self.jf_id
-            in requests.get(f"{self.broker_address}/get_running_detectors").json()[
+            in self._broker.get("get_running_detectors").json()[
                 "detectors"
             ]
         )
@@ -293,8 +301,8 @@ class Jungfrau(Assembly):
     def power_on(self):
         JF_channel = self.jf_id
         par = {"detector_name": JF_channel}
-        return requests.post(
-            f"{self.broker_address}/power_on_detector", json=par
+        return self._broker.post(
+            "power_on_detector", json=par
         ).json()
 
     # def take_pedestal(self, JF_list=None, pgroup=None):
@@ -1,34 +1,99 @@
+from contextlib import contextmanager
+from copy import deepcopy
+from threading import Lock
+
 from eco.elements.detector import DetectorGet
-from .assembly import Assembly
+from .assembly import Assembly, get_status_snapshot_id
 
 from .adjustable import AdjustableGetSet
 from functools import partial
 
 
-class AdjustableObject(Assembly):
-    def __init__(self, adjustable_dict, is_setting_children=False, name=None):
+class _BaseDictSnapshot:
+    """Reads the base dictionary once per status snapshot (see
+    eco.elements.assembly.status_snapshot) and serves all fields from it."""
+
+    def _init_snapshot(self):
+        self._snapshot = (None, None)
+        self._snapshot_lock = Lock()
+
+    def _get_base_dict(self):
+        snapshot_id = get_status_snapshot_id()
+        if snapshot_id is None:
+            return self._base_dict.get_current_value()
+        with self._snapshot_lock:
+            if not self._snapshot[0] == snapshot_id:
+                self._snapshot = (snapshot_id, self._base_dict.get_current_value())
+            return self._snapshot[1]
+
+    def get_field(self, fieldname):
+        d = self._get_base_dict()
+        if fieldname not in d.keys():
+            raise Exception(f"{fieldname} is not in dictionary")
+        return d[fieldname]
+
+
+class AdjustableObject(_BaseDictSnapshot, Assembly):
+    def __init__(
+        self, adjustable_dict, is_setting_children=False, name=None, _parent_field=None
+    ):
         super().__init__(name=name)
+        self._init_snapshot()
+        self._batch = None
+        self._parent_field = _parent_field
         self._append(adjustable_dict, name="_base_dict", is_setting=False)
         self.init_object(is_setting_children=is_setting_children)
 
+    def _get_base_dict(self):
+        if self._batch is not None:
+            return self._batch
+        return super()._get_base_dict()
+
+    def _set_base_dict(self, d):
+        if self._parent_field:
+            parent, fieldname = self._parent_field
+            return parent.set_field(fieldname, d)
+        return self._base_dict.set_target_value(d)
+
     def set_field(self, fieldname, value):
-        d = self._base_dict.get_current_value()
+        d = self._get_base_dict()
         if fieldname not in d.keys():
             raise Exception(f"{fieldname} is not in dictionary")
         d[fieldname] = value
-        self._base_dict.set_target_value(d)
+        if self._batch is None:
+            return self._set_base_dict(d)
 
-    def get_field(self, fieldname):
-        d = self._base_dict.get_current_value()
-        if fieldname not in d.keys():
-            raise Exception(f"{fieldname} is not in dictionary")
-        return d[fieldname]
+    def set_fields(self, fields):
+        """Set several fields with one write of the base dictionary."""
+        with self.batch_set():
+            for fieldname, value in fields.items():
+                self.set_field(fieldname, value)
+
+    @contextmanager
+    def batch_set(self):
+        """Collect set_field calls, also of child objects, and write them in
+        one base dictionary write (e.g. one camera config request) at exit."""
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = deepcopy(self._base_dict.get_current_value())
+        try:
+            yield self
+            d = self._batch
+            self._batch = None
+            changer = self._set_base_dict(d)
+            if changer is not None:
+                changer.wait()
+        finally:
+            self._batch = None
 
     def update_base_dict(self, updatedict):
         tmp = self._base_dict.get_current_value()
         tmp.update(updatedict)
         self._base_dict.set_target_value(tmp)
-        self.__init__(self._base_dict, name=self.name)
+        self.__init__(
+            self._base_dict, name=self.name, _parent_field=self._parent_field
+        )
 
     def init_object(self, is_setting_children=False):
         # super().__init__(name=self.name)
@@ -43,7 +108,7 @@ class AdjustableObject(Assembly):
             if type(v) is dict:
 
                 self._append(
-                    AdjustableObject(tadj, name=k),
+                    AdjustableObject(tadj, name=k, _parent_field=(self, k)),
                     call_obj=False,
                     is_setting=is_setting_children,
                     name=ln,
@@ -59,18 +124,13 @@ class AdjustableObject(Assembly):
                 )
 
 
-class DetectorObject(Assembly):
+class DetectorObject(_BaseDictSnapshot, Assembly):
     def __init__(self, detector_dict, name=None):
         super().__init__(name=name)
+        self._init_snapshot()
         self._base_dict = detector_dict
         self.init_object()
 
-    def get_field(self, fieldname):
-        d = self._base_dict.get_current_value()
-        if fieldname not in d.keys():
-            raise Exception(f"{fieldname} is not in dictionary")
-        return d[fieldname]
-
     def init_object(self):
         # super().__init__(name=self.name)
         for k, v in self._base_dict.get_current_value().items():
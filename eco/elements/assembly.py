@@ -1,9 +1,12 @@
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import copy
 from datetime import datetime
 from inspect import isclass
 import json
 from pathlib import Path
+import itertools
+import threading
 from tkinter import W
 import weakref
 from markdown import markdown
@@ -13,7 +16,11 @@ import numpy as np
 
 
 from eco.acquisition.scan_data import run_status_convenience
-from eco.elements.protocols import Detector, InitialisationWaitable
+from eco.elements.protocols import (
+    CaSnapshotReadable,
+    Detector,
+    InitialisationWaitable,
+)
 from eco.epics import get_from_archive
 
 from ..aliases import Alias
@@ -31,6 +38,56 @@ import eco
 
 _initializing_assemblies = []
 
+_status_snapshot = threading.local()
+_status_snapshot_ids = itertools.count(1)
+
+
+@contextmanager
+def status_snapshot(snapshot_id=None):
+    """Scope in which objects may serve values from one shared fetch.
+
+    get_status reads all items within one scope; nested scopes (e.g. the
+    status of several assemblies) belong to the outermost one. The scope is
+    per thread, so other threads keep reading live values; worker threads
+    join a scope by passing its id as snapshot_id. See
+    get_status_snapshot_id."""
+    outer = getattr(_status_snapshot, "id", None)
+    if outer is None:
+        if snapshot_id is None:
+            snapshot_id = next(_status_snapshot_ids)
+        _status_snapshot.id = snapshot_id
+    try:
+        yield _status_snapshot.id
+    finally:
+        if outer is None:
+            _status_snapshot.id = None
+
+
+def get_status_snapshot_id():
+    """Id of the status snapshot scope of this thread, None outside of one."""
+    return getattr(_status_snapshot, "id", None)
+
+
+class StatusIndexEntry:
+    """Flattened record of one item listed by a StatusCollection."""
+
+    __slots__ = ("_item", "name", "based", "channel", "channeltype", "selections")
+
+    def __init__(self, item, name, based):
+        self._item = weakref.ref(item)
+        self.name = name
+        self.based = based
+        self.channel = getattr(item.alias, "channel", None)
+        self.channeltype = getattr(item.alias, "channeltype", None)
+        self.selections = frozenset()
+
+    @property
+    def item(self):
+        return self._item()
+
+    def __repr__(self):
+        return f"StatusIndexEntry({self.name!r}, channel={self.channel!r})"
+
 
 class StatusCollection:
     def __init__(self, parent, name="status_collection"):
@@ -41,70 +98,123 @@ class StatusCollection:
             raise Exception("A name of collection is required")
         self.name = name
         self._list = []
-
-    def get_list(self, selection=None, **kwargs):
-        rec_list_items = kwargs.get("rec_list_items", [])
-        ls = []
-        for witem in self._list:
+        # flattened index per selection (None is the full list), built on
+        # demand and dropped by invalidate() whenever this collection or one
+        # of the collections it recursed into changes.
+        self._index = {}
+        self._index_version = 0
+        self._dependents = weakref.WeakSet()
+
+    def invalidate(self, _visited=None):
+        """Drop the cached index of this collection and of all collections
+        which included it when building their own index."""
+        if _visited is None:
+            _visited = set()
+        if id(self) in _visited:
+            return
+        _visited.add(id(self))
+        self._index_version += 1
+        self._index = {}
+        for dependent in list(self._dependents):
+            dependent.invalidate(_visited=_visited)
+
+    def _get_index(self, selection=None):
+        try:
+            return self._index[selection]
+        except KeyError:
+            pass
+        version = self._index_version
+        entries = self._build_index(selection)
+        if selection is None:
+            for selection_name in list(self.selections.keys()):
+                ids = set(
+                    id(tentry.item) for tentry in self._get_index(selection_name)
+                )
+                for tentry in entries:
+                    if id(tentry.item) in ids:
+                        tentry.selections = tentry.selections | {selection_name}
+        if version == self._index_version:
+            self._index[selection] = entries
+        return entries
+
+    def _build_index(self, selection):
+        parent = self.parent()
+        if parent is None:
+            return []
+        base_alias = parent.alias
+        entries = []
+        seen = set()
+
+        def add(item, name, based):
+            seen.add(id(item))
+            entries.append(StatusIndexEntry(item, name, based))
+
+        for witem in list(self._list):
             item = witem()
             if item is None:
                 continue
 
-            if item is self.parent:
-                continue
-
-            if item in ls:
+            if id(item) in seen:
                 continue
 
+            item_name, item_based = item.alias.get_name_below(base_alias)
             if selection is not None:
                 if selection not in self.selections.keys():
                     continue
-                item_name = item.alias.get_full_name(base=self.parent())
                 if item_name not in self.selections[selection].keys():
                     continue
                 recurse = self.selections[selection][item_name]["recurse"]
             else:
-                recurse = True
-
-                ls.append(item)
-
+                add(item, item_name, item_based)
                 # important to get field in case no recursion is defined.
-                if item is self.parent():
-                    recurse = False
+                recurse = not (item is parent)
 
             if hasattr(item, f"{self.name}") and isinstance(
                 item.__dict__[self.name], self.__class__
             ):
-                if recurse:
-                    # if hasattr(item, "recursing") and item.recursing:
-                    #     print(
-                    #         f"recursing detected loop at {item.alias.get_full_name()}"
-                    #     )
-                    # item.recursing = True
-
-                    for titem in item.__dict__[self.name].get_list(
-                        selection=selection, ls=[]
-                    ):
-
-                        if titem not in ls:
-                            ls.append(titem)
-
-                else:
-
-                    if item not in ls:
-                        ls.append(item)
-
-            else:
-                if item not in ls:
-                    ls.append(item)
+                sub_collection = item.__dict__[self.name]
+                if recurse and not (sub_collection is self):
+                    sub_collection._dependents.add(self)
+                    for tentry in sub_collection._get_index(selection):
+                        titem = tentry.item
+                        if titem is None or id(titem) in seen:
+                            continue
+                        if tentry.based and item_based:
+                            add(
+                                titem,
+                                ".".join(
+                                    [tn for tn in [item_name, tentry.name] if tn]
+                                ),
+                                True,
+                            )
+                        else:
+                            add(titem, *titem.alias.get_name_below(base_alias))
+                elif id(item) not in seen:
+                    add(item, item_name, item_based)
+            elif id(item) not in seen:
+                add(item, item_name, item_based)
+
+        return entries
+
+    def get_index(self, selection=None):
+        """List of StatusIndexEntry records (item, name relative to the
+        collection parent, selection membership, channel and channeltype)."""
+        return [
+            tentry
+            for tentry in self._get_index(selection)
+            if tentry.item is not None
+        ]
 
+    def get_list(self, selection=None, **kwargs):
+        ls = []
+        for tentry in self._get_index(selection):
+            item = tentry.item
+            if item is not None:
+                ls.append(item)
         return ls
 
     def get_names(self, selection=None):
-        return [
-            item.alias.get_full_name(base=self.parent())
-            for item in self.get_list(selection=selection)
-        ]
+        return [tentry.name for tentry in self.get_index(selection=selection)]
 
     def get_selections_names(self):
         return self.selections.keys()
@@ -118,6 +228,7 @@ class StatusCollection:
             self.selections[selection][obj_name] = {"recurse": recursive}
         if obj not in [tl() for tl in self._list]:
             self._list.append(weakref.ref(obj))
+        self.invalidate()
 
     def remove(self, obj, selection=None):
         """Remove an object from the collection. If selection is given, only remove from that selection."""
@@ -135,6 +246,7 @@ class StatusCollection:
         for selection in selections:
             if obj_name in self.selections[selection]:
                 del self.selections[selection][obj_name]
+        self.invalidate()
 
     def __call__(self):
         return self.get_list()
@@ -246,8 +358,16 @@ class Assembly:
         selections=[],
         threads=False,
         max_workers=10,
+        ca_snapshot=False,
+        ca_timeout=2.0,
         # print_name=False,
     ):
+        """Collect the current values of all status items.
+
+        With ca_snapshot=True all channel access leaves are read in one
+        batched request (see eco.epics.snapshot.caget_snapshot) with a
+        common deadline of ca_timeout seconds; leaves which are not CA
+        backed or did not answer in time are read via get_current_value."""
         if base == "self":
             base = self
         # settings = {}
@@ -278,61 +398,67 @@ class Assembly:
         #             )
         #         )
 
-        def get_stat_one_detector(ts):
+        def get_name(tentry):
+            if base is self:
+                return tentry.name
+            return tentry.item.alias.get_full_name(base=base)
+
+        def get_stat_one_detector(tentry):
+            ts = tentry.item
+            tname = get_name(tentry)
             tstart = time.time()
             try:
-                if (not channeltypes) or (ts.alias.channeltype in channeltypes):
-                    status[ts.alias.get_full_name(base=base)] = ts.get_current_value()
-                    try:
-                        status_channels[ts.alias.get_full_name(base=base)] = (
-                            ts.alias.channel
-                        )
-                    except:
-                        pass
+                if (not channeltypes) or (tentry.channeltype in channeltypes):
+                    status[tname] = ts.get_current_value()
+                    status_channels[tname] = tentry.channel
             except:
-                geterror.append(ts.alias.get_full_name(base=base))
-                status_times[ts.alias.get_full_name(base=base)] = time.time() - tstart
-
-        ts_t = []
-        for ts in track(
-            self.status_collection.get_list(),
-            transient=True,
-            description="Reading status indicators ...",
-        ):
-
-            if isinstance(ts, Detector):
-                if threads:
-                    ts_t.append(ts)
+                geterror.append(tname)
+            status_times[tname] = time.time() - tstart
+
+        with status_snapshot() as snapshot_id:
+
+            def get_stat_one_detector_in_snapshot(tentry):
+                with status_snapshot(snapshot_id):
+                    get_stat_one_detector(tentry)
+
+            index = self.status_collection.get_index()
+            if ca_snapshot:
+                index = self._read_ca_snapshot(
+                    index,
+                    get_name,
+                    status,
+                    status_channels,
+                    status_times,
+                    channeltypes=channeltypes,
+                    timeout=ca_timeout,
+                )
+
+            ts_t = []
+            for tentry in track(
+                index,
+                transient=True,
+                description="Reading status indicators ...",
+            ):
+                ts = tentry.item
+                if ts is None:
+                    continue
+                if isinstance(ts, Detector):
+                    if threads:
+                        ts_t.append(tentry)
+                    else:
+                        get_stat_one_detector(tentry)
                 else:
-                    tstart = time.time()
-                    try:
-                        if (not channeltypes) or (ts.alias.channeltype in channeltypes):
-                            status[ts.alias.get_full_name(base=base)] = (
-                                ts.get_current_value()
-                            )
-                            try:
-                                status_channels[ts.alias.get_full_name(base=base)] = (
-                                    ts.alias.channel
-                                )
-                            except:
-                                pass
-                    except:
-                        geterror.append(ts.alias.get_full_name(base=base))
-                    status_times[ts.alias.get_full_name(base=base)] = (
-                        time.time() - tstart
-                    )
-            else:
-                nodet.append(ts.alias.get_full_name(base=base))
-        if threads:
-
-            with ThreadPoolExecutor(max_workers=max_workers) as exc:
-                list(
-                    track(
-                        exc.map(get_stat_one_detector, ts_t),
-                        description="Getting status...",
-                        total=len(ts_t),
+                    nodet.append(get_name(tentry))
+            if threads:
+
+                with ThreadPoolExecutor(max_workers=max_workers) as exc:
+                    list(
+                        track(
+                            exc.map(get_stat_one_detector_in_snapshot, ts_t),
+                            description="Getting status...",
+                            total=len(ts_t),
+                        )
                     )
-                )
 
         if verbose:
             if nodet:
@@ -370,6 +496,55 @@ class Assembly:
             "selections": sel_dict,
         }
 
+    def _read_ca_snapshot(
+        self,
+        index,
+        get_name,
+        status,
+        status_channels,
+        status_times,
+        channeltypes=None,
+        timeout=2.0,
+    ):
+        """Fill status from one bulk CA read, returns the index entries still to be read."""
+        from eco.epics.snapshot import caget_snapshot
+
+        if channeltypes and ("CA" not in channeltypes):
+            return index
+        ca_entries = []
+        rest = []
+        for tentry in index:
+            if (
+                tentry.channeltype == "CA"
+                and tentry.channel
+                and isinstance(tentry.item, CaSnapshotReadable)
+            ):
+                ca_entries.append(tentry)
+            else:
+                rest.append(tentry)
+        if not ca_entries:
+            return index
+
+        tstart = time.time()
+        values, missing = caget_snapshot(
+            [tentry.channel for tentry in ca_entries], timeout=timeout
+        )
+        tsnapshot = time.time() - tstart
+        for tentry in ca_entries:
+            if tentry.channel not in values:
+                rest.append(tentry)
+                continue
+            tname = get_name(tentry)
+            try:
+                status[tname] = tentry.item._get_current_value_from_ca(
+                    values[tentry.channel]
+                )
+                status_channels[tname] = tentry.channel
+                status_times[tname] = tsnapshot / len(ca_entries)
+            except:
+                rest.append(tentry)
+        return rest
+
     def status(self, get_string=False):
         stat = self.get_status()
         s = tabulate([[name, value] for name, value in stat["status"].items()])
@@ -563,20 +738,24 @@ class Monitor:
         self.pvs = {}
 
     def start_monitoring(self):
+        from eco.epics.subscription_hub import hub
+
         o = self.assembly.get_status(channeltypes=["CA"])
         # self.data = {k: [v] for k, v in o["status"].items()}
         self.channelkeys = {v: k for k, v in o["status_channels"].items()}
-        self.pvs = {k: epics.pv.PV(v) for k, v in o["status_channels"].items()}
+        self.pvs = {k: hub.get_pv(v) for k, v in o["status_channels"].items()}
         # for cik, civ in epics.pv._PVcache_.items():
         #     if cik[0] in o["status_channels"].keys():
         #         tname = self.channelkeys[cik[0]]
         #         tpv = civ
         for tname, tpv in self.pvs.items():
-            self.callbacks[tname] = tpv.add_callback(self.append)
+            self.callbacks[tname] = hub.add_callback(tpv.pvname, self.append)
 
     def stop_monitoring(self):
+        from eco.epics.subscription_hub import hub
+
         for tname in self.pvs:
-            self.pvs[tname].remove_callback(index=self.callbacks[tname])
+            hub.remove_callback(self.pvs[tname].pvname, self.callbacks[tname])
 
     def append(self, pvname=None, value=None, timestamp=None, **kwargs):
         if not (self.channelkeys[pvname] in self.data):
@@ -1,4 +1,8 @@
+import fcntl
+import hashlib
 import itertools
+import json
+import tempfile
 from pathlib import Path
 from datetime import datetime
 import weakref
@@ -30,6 +34,177 @@ def get_memory(name):
         return Memory(name)
 
 
+class MemoryStore:
+    """Content addressed storage of the memories in a memory directory.
+
+    The value groups of a memory (status, settings, display ...) are split
+    per top level item and every part is stored once as blobs/<sha1>.json,
+    so parts which did not change between memories share one file. A memory
+    is a small manifest manifests/<key>.json referencing its blobs.
+    parameters.jsonl gets one line per memory with the parameter values which
+    changed with respect to the previous line, so the history of parameters
+    is read from a single file. Lines are appended under a lock of the file,
+    which is shared by all processes writing memories."""
+
+    def __init__(self, directory):
+        self.dir = Path(directory)
+        self._blob_cache = {}
+        self._index_state = (None, {})
+
+    @property
+    def _index_file(self):
+        return self.dir / "parameters.jsonl"
+
+    def _mkdir(self, path):
+        if not path.exists():
+            path.mkdir(parents=True)
+            try:
+                path.chmod(0o775)
+            except:
+                pass
+
+    def _write_json(self, path, obj):
+        with open(path.as_posix() + "tmp", "w") as f:
+            json.dump(obj, f)
+        Path(path.as_posix() + "tmp").replace(path)
+
+    def _write_blob(self, obj):
+        data = json.dumps(obj, sort_keys=True)
+        blob_hash = hashlib.sha1(data.encode()).hexdigest()
+        blob_file = self.dir / "blobs" / f"{blob_hash}.json"
+        if not blob_file.exists():
+            self._mkdir(blob_file.parent)
+            with open(blob_file.as_posix() + "tmp", "w") as f:
+                f.write(data)
+            Path(blob_file.as_posix() + "tmp").replace(blob_file)
+        return blob_hash
+
+    def _read_blob(self, blob_hash):
+        # blobs never change, so they are cached for good
+        if blob_hash not in self._blob_cache:
+            with open(self.dir / "blobs" / f"{blob_hash}.json", "r") as f:
+                self._blob_cache[blob_hash] = json.load(f)
+        return self._blob_cache[blob_hash]
+
+    def _manifest_file(self, key):
+        return self.dir / "manifests" / f"{key}.json"
+
+    def has(self, key):
+        return self._manifest_file(key).exists()
+
+    def write(self, key, memory):
+        """Store a memory dictionary under key."""
+        manifest = {"blobs": {}, "values": {}}
+        for group, values in memory.items():
+            if _is_value_group(values):
+                parts = {}
+                for name, value in values.items():
+                    parts.setdefault(name.split(".")[0], {})[name] = value
+                manifest["blobs"][group] = {
+                    part: self._write_blob(part_values)
+                    for part, part_values in parts.items()
+                }
+            else:
+                manifest["values"][group] = values
+        self._mkdir(self._manifest_file(key).parent)
+        self._write_json(self._manifest_file(key), manifest)
+        self._append_index(key, memory)
+
+    def read(self, key):
+        """Memory dictionary stored under key."""
+        with open(self._manifest_file(key), "r") as f:
+            manifest = json.load(f)
+        memory = dict(manifest["values"])
+        for group, parts in manifest["blobs"].items():
+            memory[group] = {}
+            for blob_hash in parts.values():
+                memory[group].update(self._read_blob(blob_hash))
+        return memory
+
+    def _read_index(self):
+        lines = []
+        if not self._index_file.exists():
+            return lines
+        with open(self._index_file, "r") as f:
+            for line in f:
+                try:
+                    lines.append(json.loads(line))
+                except ValueError:
+                    # incompletely written line
+                    pass
+        return lines
+
+    def _get_index_state(self):
+        size = self._index_file.stat().st_size if self._index_file.exists() else 0
+        if not self._index_state[0] == size:
+            self._index_state = (
+                size,
+                self._reconstruct(self._read_index(), keep_values=False)[1],
+            )
+        return self._index_state[1]
+
+    def _reconstruct(self, lines, search_key=None, keep_values=True, state=None):
+        values = {}
+        if state is None:
+            state = {}
+        for line in lines:
+            for group, changed in line["changed"].items():
+                state.setdefault(group, {}).update(
+                    {
+                        k: v
+                        for k, v in changed.items()
+                        if search_key is None or search_key in k
+                    }
+                )
+            for group, removed in line["removed"].items():
+                for k in removed:
+                    state.get(group, {}).pop(k, None)
+            if keep_values:
+                values[line["key"]] = {g: dict(v) for g, v in state.items()}
+        return values, state
+
+    def _append_index(self, key, memory):
+        self._mkdir(self.dir)
+        with open(self._index_file, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # read under the lock, lines of other writers are included
+                state = self._get_index_state()
+                line = {"key": key, "changed": {}, "removed": {}}
+                for group, values in memory.items():
+                    if not _is_value_group(values):
+                        continue
+                    previous = state.get(group, {})
+                    line["changed"][group] = {
+                        k: v
+                        for k, v in values.items()
+                        if not (k in previous and previous[k] == v)
+                    }
+                    line["removed"][group] = [k for k in previous if k not in values]
+                for group in state:
+                    if group not in line["changed"]:
+                        line["removed"][group] = list(state[group].keys())
+                f.write(json.dumps(line) + "\n")
+                f.flush()
+                # json round trip, as the values of lines read from the file
+                line = json.loads(json.dumps(line))
+                self._index_state = (
+                    self._index_file.stat().st_size,
+                    self._reconstruct([line], keep_values=False, state=state)[1],
+                )
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_parameter_values(self, search_key=None):
+        """{memory key: {group: {parameter: value}}} for all memories in the
+        parameter index, optionally only parameters containing search_key."""
+        return self._reconstruct(self._read_index(), search_key=search_key)[0]
+
+
+def _is_value_group(values):
+    return type(values) is dict
+
+
 class Memory:
     def __init__(
         self,
@@ -59,6 +234,8 @@ class Memory:
             self.dir / Path("memories.json"), default_value={}
         )
         self._presets = AdjustableFS(self.dir / Path("presets.json"), default_value={})
+        if not (hasattr(self, "_store") and self._store.dir == self.dir):
+            self._store = MemoryStore(self.dir)
 
     def memories(self, indices=None, search_key=None):
         self.setup_path()
@@ -66,12 +243,19 @@ class Memory:
         memkeys = list(mem.keys())
         if indices is None:
             indices = range(len(mem))
+        if search_key is not None:
+            indexed = self._store.get_parameter_values(search_key=search_key)
+        else:
+            indexed = {}
         mems = []
         for index in indices:
             tkey = memkeys[index]
             tmem = mem[tkey]
             cats = list(itertools.chain.from_iterable(tmem["categories"].values()))
-            tmem_all = self.get_memory(key=tkey)
+            if tkey in indexed:
+                tmem_all = self._filter_existing(indexed[tkey])
+            else:
+                tmem_all = self.get_memory(key=tkey)
             if search_key is not None:
                 tmem_sel = {
                     tk: {ttk: ttv for ttk, ttv in tv.items() if search_key in ttk}
@@ -182,18 +366,20 @@ class Memory:
         }
         if preset_varname:
             mem[key].update({"presetname": preset_varname})
-        tmp = AdjustableFS(self.dir / Path(key + ".json"))
-        tmp(stat_now)
+        self._store.write(key, stat_now)
         self._memories(mem)
         print(f"Saved memory for {self.obj_parent().alias.get_full_name()}: {message}")
-        print(f"memory file:  {tmp.file_path.as_posix()}")
+        print(f"memory file:  {self._store._manifest_file(key).as_posix()}")
         if to_elog:
             elog = self._get_elog()
-            elog.post(
-                f"Saved memory for {self.obj_parent().alias.get_full_name()}: {message}",
-                tmp.file_path,
-                text_encoding="markdown",
-            )
+            with tempfile.TemporaryDirectory() as tmpdir:
+                tmp = AdjustableFS(Path(tmpdir) / Path(key + ".json"))
+                tmp(stat_now)
+                elog.post(
+                    f"Saved memory for {self.obj_parent().alias.get_full_name()}: {message}",
+                    tmp.file_path,
+                    text_encoding="markdown",
+                )
 
     def get_memory(self, input_obj=None, index=None, key=None, filter_existing=True):
         if not input_obj is None:
@@ -206,26 +392,43 @@ class Memory:
             self.setup_path()
             if not (index is None):
                 key = list(self._memories().keys())[index]
-            tmp = AdjustableFS(self.dir / Path(key + ".json"))
-            mem_full = tmp()
+            if self._store.has(key):
+                mem_full = self._store.read(key)
+            else:
+                tmp = AdjustableFS(self.dir / Path(key + ".json"))
+                mem_full = tmp()
         if filter_existing:
-            mem_filt = {}
-            for tkey, tval in mem_full.items():
-                if tkey in ["settings", "status_indicators"]:
-                    mem_filt[tkey] = {}
-                    for ttkey, ttval in tval.items():
-                        try:
-                            name2obj(self.obj_parent(), ttkey)
-                            mem_filt[tkey][ttkey] = ttval
-                        except KeyError:
-                            ...
-                else:
-                    mem_filt[tkey] = tval
-
-            return mem_filt
+            return self._filter_existing(mem_full)
         else:
             return mem_full
 
+    def _filter_existing(self, mem_full):
+        mem_filt = {}
+        for tkey, tval in mem_full.items():
+            if tkey in ["settings", "status_indicators"]:
+                mem_filt[tkey] = {}
+                for ttkey, ttval in tval.items():
+                    try:
+                        name2obj(self.obj_parent(), ttkey)
+                        mem_filt[tkey][ttkey] = ttval
+                    except KeyError:
+                        ...
+            else:
+                mem_filt[tkey] = tval
+        return mem_filt
+
+    def migrate_memories(self):
+        """Copy memories stored as single json files into the memory store."""
+        self.setup_path()
+        for key in self._memories().keys():
+            if not self._store.has(key):
+                try:
+                    self._store.write(
+                        key, self.get_memory(key=key, filter_existing=False)
+                    )
+                except Exception as e:
+                    print(f"Could not migrate memory {key}: {e}")
+
     def clear_memory(self, index=None, key=None):
         if not (index is None):
             key = list(self._memories().keys())[index]
@@ -29,6 +29,14 @@ class InitialisationWaitable(Protocol):
     def _wait_for_initialisation(self):
         ...
 
+
+@runtime_checkable
+class CaSnapshotReadable(Protocol):
+    """Leaf whose current value can be derived from a bulk read of its alias channel."""
+
+    def _get_current_value_from_ca(self, value):
+        ...
+
 @runtime_checkable
 class Counter(Protocol):
     def acquire(self):
@@ -194,6 +194,9 @@ class AdjustablePv:
             currval = self._pv.get()
         return currval
 
+    def _get_current_value_from_ca(self, value):
+        return value
+
     def get_change_done(self):
         """Adjustable convention"""
         """ 0: moving 1: move done"""
@@ -320,6 +323,9 @@ class AdjustablePvEnum:
     def get_current_value(self):
         return self.validate(self._pv.get())
 
+    def _get_current_value_from_ca(self, value):
+        return self.validate(value)
+
     def set_target_value(self, value, hold=False):
         """Adjustable convention"""
         value = self.validate(value)
@@ -363,6 +369,9 @@ class AdjustablePvString:
     def get_current_value(self):
         return self._pv.get()
 
+    def _get_current_value_from_ca(self, value):
+        return value
+
     def set_target_value(self, value, hold=False):
         changer = lambda value: self._pv.put(bytes(value, "utf8"), wait=True)
         return Changer(
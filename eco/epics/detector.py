@@ -14,6 +14,7 @@ from eco.elements.assembly import Assembly
 from eco.elements.detector import call_convenience, value_property
 from eco.epics.adjustable import AdjustablePvString, AdjustablePv
 from eco.epics import get_from_archive
+from eco.epics.subscription_hub import hub
 
 from eco.acquisition.decorators import scannable
 
@@ -58,6 +59,9 @@ class DetectorPvData(Assembly):
         else:
             return self.readback.get_current_value()
 
+    def _get_current_value_from_ca(self, value):
+        return value
+
     def set_current_value_callback(
         self, func="accumulate", run_once=True, print_output=False, **kwargs
     ):
@@ -99,6 +103,9 @@ class DetectorPvEnum(Assembly):
     def get_current_value(self):
         return self.validate(self._pv.get())
 
+    def _get_current_value_from_ca(self, value):
+        return self.validate(value)
+
     def __repr__(self):
         if not self.name:
             name = self.Id
@@ -136,6 +143,9 @@ class DetectorPvString:
     def get_current_value(self):
         return self._pv.get()
 
+    def _get_current_value_from_ca(self, value):
+        return value
+
     def __repr__(self):
         return self.get_current_value()
 
@@ -155,7 +165,7 @@ class DetectorPvDataStream(Assembly):
         super().__init__(name=name)
         self.Id = pvname
         self.pvname = pvname
-        self._pv = PV(pvname)
+        self._pv = hub.get_pv(pvname)
         self.alias = Alias(self.name, channel=self.pvname, channeltype="CA")
         if has_fields:
             self._append(
@@ -171,7 +181,7 @@ class DetectorPvDataStream(Assembly):
                 "Either a time interval or number of samples need to be defined."
             )
         try:
-            self._pv.callbacks.pop(self._collection["ix_cb"])
+            hub.remove_callback(self.pvname, self._collection["ix_cb"])
         except:
             pass
         self._collection = {"done": False}
@@ -188,7 +198,7 @@ class DetectorPvDataStream(Assembly):
                 if not stopcond():
                     self.data_collected.append(kw["value"])
                 else:
-                    self._pv.callbacks.pop(self._collection["ix_cb"])
+                    hub.remove_callback(self.pvname, self._collection["ix_cb"])
                     self._collection["done"] = True
 
         elif samples:
@@ -198,10 +208,10 @@ class DetectorPvDataStream(Assembly):
             def addData(**kw):
                 self.data_collected.append(kw["value"])
                 if stopcond():
-                    self._pv.callbacks.pop(self._collection["ix_cb"])
+                    hub.remove_callback(self.pvname, self._collection["ix_cb"])
                     self._collection["done"] = True
 
-        self._collection["ix_cb"] = self._pv.add_callback(addData)
+        self._collection["ix_cb"] = hub.add_callback(self.pvname, addData)
         time_wait_start = time()
         while not self._collection["done"]:
             sleep(0.005)
@@ -211,7 +221,7 @@ class DetectorPvDataStream(Assembly):
                         print(
                             f"No {self.name}({self.Id}) data update in time interval, reporting last value"
                         )
-                        self._pv.callbacks.pop(self._collection["ix_cb"])
+                        hub.remove_callback(self.pvname, self._collection["ix_cb"])
                         self.data_collected.append(self.get_current_value())
                         break
 
@@ -231,7 +241,7 @@ class DetectorPvDataStream(Assembly):
         else:
             self._accumulate["n_buffer"] = n_buffer
             self._accumulate["ix"] = 0
-        self._pv.callbacks.pop(self._accumulate["n_cb"], None)
+        hub.remove_callback(self.pvname, self._accumulate["n_cb"])
         self._data = np.squeeze(np.zeros([n_buffer * 2, self._pv.count])) * np.nan
 
         def addData(**kw):
@@ -242,21 +252,21 @@ class DetectorPvDataStream(Assembly):
                 "value"
             ]
 
-        self._accumulate["n_cb"] = self._pv.add_callback(addData)
+        self._accumulate["n_cb"] = hub.add_callback(self.pvname, addData)
 
     def accumulate_start(self):
         if not hasattr(self, "_accumulate_inf"):
             self._accumulate_inf = {"n_cb": -1}
-        self._pv.callbacks.pop(self._accumulate_inf["n_cb"], None)
+        hub.remove_callback(self.pvname, self._accumulate_inf["n_cb"])
         self._data_inf = []
 
         def addData(**kw):
             self._data_inf.append(kw["value"])
 
-        self._accumulate_inf["n_cb"] = self._pv.add_callback(addData)
+        self._accumulate_inf["n_cb"] = hub.add_callback(self.pvname, addData)
 
     def accumulate_stop(self):
-        self._pv.callbacks.pop(self._accumulate_inf["n_cb"], None)
+        hub.remove_callback(self.pvname, self._accumulate_inf["n_cb"])
         return self._data_inf
 
     def get_data(self):
@@ -286,6 +296,9 @@ class DetectorPvDataStream(Assembly):
     def get_current_value(self, **kwargs):
         return self._pv.get(**kwargs)
 
+    def _get_current_value_from_ca(self, value):
+        return value
+
 
 class CallbackEpics:
     def __init__(
@@ -315,17 +328,20 @@ class CallbackEpics:
             self.data["timestamps"].append(ts_local)
             self.data["values"].append(self.pv.get())
             self.data["timestamps_ioc"].append(self.pv.timestamp)
-        self.cb_index = self.pv.add_callback(
+        self.cb_index = hub.add_callback(
+            self.pv.pvname,
             self.foo,
             run_once=True,
         )
 
     def is_running(self):
-        return hasattr(self, "cb_index") and self.cb_index in self.pv.callbacks.keys()
+        return hasattr(self, "cb_index") and hub.has_callback(
+            self.pv.pvname, self.cb_index
+        )
 
     def stop(self):
         if self.is_running():
-            self.pv.remove_callback(self.cb_index)
+            hub.remove_callback(self.pv.pvname, self.cb_index)
 
     def __enter__(self):
         self.start()
@@ -1,9 +1,92 @@
-from epics import PV
 import numpy as np
-from scipy.interpolate import interp1d
 import time
 from concurrent.futures import ThreadPoolExecutor
 
+from .subscription_hub import hub
+
+
+class RingBuffer:
+    """Growable numpy ring buffer written by a single producer thread.
+
+    The buffer doubles its capacity until max_size is reached and then
+    overwrites the oldest entries. The producer writes the slot before it
+    advances the counter and a grown array is swapped in before that, so
+    readers need no lock: view() returns the valid entries, without copy as
+    long as the buffer did not wrap around. Buffers appended together (one
+    entry per buffer and update) are read consistently with view_range over
+    the index range of the counter of the buffer appended last, view() of
+    each buffer alone may return an entry more for a buffer appended
+    earlier."""
+
+    def __init__(self, dtype=float, shape=(), initial_size=1024, max_size=2**20):
+        self.max_size = max_size
+        self.shape = tuple(shape)
+        self._data = np.empty((min(initial_size, max_size),) + self.shape, dtype)
+        self._count = 0
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def __len__(self):
+        return min(self._count, self.max_size)
+
+    def append(self, value):
+        count = self._count
+        data = self._data
+        if count >= len(data) and len(data) < self.max_size:
+            data = np.empty(
+                (min(2 * len(data), self.max_size),) + self.shape, data.dtype
+            )
+            data[:count] = self._data[:count]
+            self._data = data
+        data[count % len(data)] = value
+        self._count = count + 1
+
+    def to_object(self):
+        """Change to dtype object, e.g. when the value shape changed."""
+        data = np.empty(len(self._data), dtype=object)
+        for n in range(min(self._count, len(data))):
+            data[n] = self._data[n]
+        self.shape = ()
+        self._data = data
+
+    def view(self, n=None):
+        """The last n (default all) entries, oldest first."""
+        count = self._count
+        if n is None or n > count:
+            n = count
+        return self.view_range(count - n, count)
+
+    def view_range(self, start, stop):
+        """Entries with the absolute indices start to stop (exclusive), counted
+        over all appended entries; indices already overwritten are left out."""
+        data = self._data
+        size = len(data)
+        start = max(start, stop - size, self._count - size, 0)
+        if start >= stop:
+            return data[:0]
+        istart = start % size
+        istop = stop % size or size
+        if istart < istop:
+            return data[istart:istop]
+        return np.concatenate([data[istart:], data[:istop]])
+
+    def clear(self, keep_last=False):
+        if keep_last and self._count:
+            last = self.view(1).copy()
+            self._count = 0
+            self.append(last[0])
+        else:
+            self._count = 0
+
+
+def _buffer_type(value):
+    arr = np.asarray(value)
+    if arr.dtype.kind in "USOV":
+        return object, ()
+    return arr.dtype, arr.shape
+
 
 class MultiMonitor:
     def __init__(self, *args, max_workers=100):
@@ -23,35 +106,67 @@ class MultiMonitor:
             tmon.clear()
 
     def merge_data(self, *args, merge_timestamps_local=True):
+        """Values of all monitors linearly interpolated to the merged local
+        timestamps of all monitors (nan before the first value of a monitor,
+        555555555555 after its last one)."""
         if len(args) == 0:
             args = list(self.monitors.keys())
-        ts = []
-        for targ in args:
-            ts += self.monitors[targ].data["timestamp_local"]
-        ts = sorted(ts)
+        data = [self.monitors[targ].data for targ in args]
+        ts_all = [tdata["timestamp_local"] for tdata in data]
+        labels = np.concatenate(
+            [np.full(len(tts), n, dtype=int) for n, tts in enumerate(ts_all)]
+            + [np.empty(0, dtype=int)]
+        )
+        ts = np.concatenate([np.asarray(tts, dtype=float) for tts in ts_all] + [[]])
+        order = np.argsort(ts, kind="stable")
+        ts = ts[order]
+        labels = labels[order]
         out = {}
-        for targ in args:
-            if len(self.monitors[targ].data["timestamp_local"]) > 1:
-                f = interp1d(
-                    self.monitors[targ].data["timestamp_local"],
-                    self.monitors[targ].data["value"],
-                    bounds_error=False,
-                    fill_value=(np.nan, 555555555555),
+        for n, (targ, tdata) in enumerate(zip(args, data)):
+            tx = np.asarray(tdata["timestamp_local"], dtype=float)
+            ty = tdata["value"]
+            if len(tx) > 1 and ty.ndim == 1 and ty.dtype.kind in "biuf":
+                ty = np.asarray(ty, dtype=float)
+                # index of the last sample of this monitor at every merged time
+                i0 = np.cumsum(labels == n) - 1
+                i1 = np.minimum(i0 + 1, len(tx) - 1)
+                i0c = np.maximum(i0, 0)
+                dt = tx[i1] - tx[i0c]
+                frac = np.divide(
+                    ts - tx[i0c], dt, out=np.zeros_like(ts), where=dt > 0
                 )
-                out[targ] = f(ts)
+                res = ty[i0c] + frac * (ty[i1] - ty[i0c])
+                res[ts == tx[i0c]] = ty[i0c][ts == tx[i0c]]
+                res[i0 < 0] = np.nan
+                res[ts > tx[-1]] = 555555555555
+                out[targ] = res
             else:
-                out[targ] = [np.nan] * len(ts)
-        # except ValueError:
-        #     print("issue")
-        #     out[targ] = []
+                out[targ] = np.full(len(ts), np.nan)
         return ts, out
 
 
 class Monitor:
-    def __init__(self, pvname, start_immediately=True, active_get=True):
-        self.data = {"value": [], "timestamp": [], "timestamp_local": []}
+    """Channel access monitor recording value, timestamp and local timestamp
+    of every update into RingBuffers, typed by the first value received.
+    data gives views of the recorded entries. The CA monitor is shared with
+    other consumers of the PV through the subscription hub."""
+
+    def __init__(
+        self,
+        pvname,
+        start_immediately=True,
+        active_get=True,
+        initial_size=1024,
+        max_size=2**20,
+    ):
+        self.initial_size = initial_size
+        self.max_size = max_size
+        self._values = None
+        self._timestamps = RingBuffer(float, (), initial_size, max_size)
+        self._timestamps_local = RingBuffer(float, (), initial_size, max_size)
         self.print = False
-        self.pv = PV(pvname)
+        self.pvname = pvname
+        self.pv = hub.get_pv(pvname)
         self.cb_index = None
         self.clear_before_next = False
         if start_immediately:
@@ -59,26 +174,53 @@ class Monitor:
         if active_get:
             self.pv.get()
 
+    @property
+    def data(self):
+        # _timestamps_local is appended last, its count covers complete entries
+        stop = self._timestamps_local._count
+        start = stop - len(self._timestamps_local)
+        if self._values is None:
+            values = np.empty(0)
+        else:
+            values = self._values.view_range(start, stop)
+        return {
+            "value": values,
+            "timestamp": self._timestamps.view_range(start, stop),
+            "timestamp_local": self._timestamps_local.view_range(start, stop),
+        }
+
+    def __len__(self):
+        return len(self._timestamps_local)
+
     def start_callback(self):
-        self.cb_index = self.pv.add_callback(self.append)
+        self.cb_index = hub.add_callback(self.pvname, self.append)
 
     def stop_callback(self):
-        self.pv.remove_callback(self.cb_index)
+        hub.remove_callback(self.pvname, self.cb_index)
 
     def clear(self):
         self.clear_before_next = True
 
+    def _append_value(self, value):
+        if self._values is None:
+            dtype, shape = _buffer_type(value)
+            self._values = RingBuffer(dtype, shape, self.initial_size, self.max_size)
+        try:
+            self._values.append(value)
+        except (ValueError, TypeError):
+            self._values.to_object()
+            self._values.append(value)
+
     def append(self, pvname=None, value=None, timestamp=None, **kwargs):
         if self.clear_before_next:
-            self.data = {
-                "value": [self.data["value"][-1]],
-                "timestamp": [self.data["timestamp"][-1]],
-                "timestamp_local": [self.data["timestamp_local"][-1]],
-            }
+            for buf in [self._values, self._timestamps, self._timestamps_local]:
+                if buf is not None:
+                    buf.clear(keep_last=True)
         ts_local = time.time()
-        self.data["value"].append(value)
-        self.data["timestamp"].append(timestamp)
-        self.data["timestamp_local"].append(ts_local)
+        self._append_value(value)
+        self._timestamps.append(np.nan if timestamp is None else timestamp)
+        # appended last, its length is the number of complete entries
+        self._timestamps_local.append(ts_local)
         if self.clear_before_next:
             self.clear_before_next = False
 
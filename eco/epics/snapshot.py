@@ -0,0 +1,45 @@
+import time
+
+from epics import ca
+
+
+def caget_snapshot(channels, timeout=2.0, as_numpy=True):
+    """Read many channel access channels in one pipelined request.
+
+    All channels are searched in parallel, all get requests are queued and
+    sent with a single flush, and replies are collected until one common
+    deadline. Channels already known to pyepics (e.g. through existing PV
+    objects) reuse their connection.
+
+    Returns a tuple (values, missing): values is a dict channel -> value,
+    missing a list of channels which did not connect or answer in time."""
+    deadline = time.time() + timeout
+    channels = list(dict.fromkeys(channels))
+
+    chids = {}
+    for channel in channels:
+        try:
+            chids[channel] = ca.create_channel(channel, connect=False)
+        except Exception:
+            pass
+    ca.flush_io()
+
+    connected = {}
+    for channel, chid in chids.items():
+        remaining = max(deadline - time.time(), 0.001)
+        if ca.connect_channel(chid, timeout=remaining):
+            connected[channel] = chid
+
+    for chid in connected.values():
+        ca.get(chid, wait=False, as_numpy=as_numpy)
+    ca.flush_io()
+
+    values = {}
+    for channel, chid in connected.items():
+        remaining = max(deadline - time.time(), 0.001)
+        value = ca.get_complete(chid, timeout=remaining, as_numpy=as_numpy)
+        if value is not None:
+            values[channel] = value
+
+    missing = [channel for channel in channels if channel not in values]
+    return values, missing
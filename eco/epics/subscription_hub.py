@@ -0,0 +1,136 @@
+"""Process wide channel access subscriptions.
+
+Components monitoring the same PV share one PV object and one CA monitor
+through the hub, each consumer callback keeping its own buffer. The hub
+counts updates and times the callbacks per channel (print_stats)."""
+
+import itertools
+from threading import Lock
+from time import time
+
+from epics import PV
+from tabulate import tabulate
+
+
+class _Channel:
+    def __init__(self, pvname):
+        self.pvname = pvname
+        self.pv = PV(pvname, auto_monitor=True)
+        self.consumers = {}
+        self.cb_index = None
+        self.n_updates = 0
+        self.time_first = None
+        self.time_last = None
+        self.delay_sum = 0.0
+        self.callback_time_sum = 0.0
+        self.callback_time_max = 0.0
+
+    def dispatch(self, **kwargs):
+        tstart = time()
+        for index, (callback, kw) in list(self.consumers.items()):
+            try:
+                callback(**kwargs, **kw)
+            except Exception as e:
+                print(f"Callback {index} of {self.pvname} failed: {e}")
+        tend = time()
+        if self.time_first is None:
+            self.time_first = tstart
+        self.time_last = tstart
+        self.n_updates += 1
+        timestamp = kwargs.get("timestamp")
+        if timestamp:
+            self.delay_sum += tstart - timestamp
+        self.callback_time_sum += tend - tstart
+        self.callback_time_max = max(self.callback_time_max, tend - tstart)
+
+    def get_stats(self):
+        n = max(self.n_updates, 1)
+        duration = (self.time_last or 0) - (self.time_first or 0)
+        return {
+            "consumers": len(self.consumers),
+            "updates": self.n_updates,
+            "rate": (self.n_updates - 1) / duration if duration > 0 else 0.0,
+            "delay_mean": self.delay_sum / n,
+            "callback_time_mean": self.callback_time_sum / n,
+            "callback_time_max": self.callback_time_max,
+        }
+
+
+class SubscriptionHub:
+    def __init__(self):
+        self._channels = {}
+        self._lock = Lock()
+        self._indices = itertools.count(1)
+
+    def _get_channel(self, pvname):
+        with self._lock:
+            if pvname not in self._channels:
+                self._channels[pvname] = _Channel(pvname)
+            return self._channels[pvname]
+
+    def get_pv(self, pvname):
+        """The shared PV object of a channel."""
+        return self._get_channel(pvname).pv
+
+    def add_callback(self, pvname, callback, **kw):
+        """Add a consumer callback, called like a pyepics PV callback (with
+        kw as additional keyword arguments). Returns its index."""
+        channel = self._get_channel(pvname)
+        index = next(self._indices)
+        with self._lock:
+            channel.consumers[index] = (callback, kw)
+            if channel.cb_index is None:
+                channel.cb_index = channel.pv.add_callback(channel.dispatch)
+        return index
+
+    def remove_callback(self, pvname, index):
+        """Remove a consumer; the CA monitor of the channel stays subscribed."""
+        channel = self._channels.get(pvname)
+        if channel is None:
+            return
+        with self._lock:
+            channel.consumers.pop(index, None)
+
+    def has_callback(self, pvname, index):
+        channel = self._channels.get(pvname)
+        return channel is not None and index in channel.consumers
+
+    def get_stats(self):
+        """Per channel number of consumers, updates, update rate (Hz), mean
+        delay after the IOC timestamp and mean/max callback time (s)."""
+        return {
+            pvname: channel.get_stats()
+            for pvname, channel in list(self._channels.items())
+        }
+
+    def print_stats(self, active_only=True):
+        stats = self.get_stats()
+        print(
+            tabulate(
+                [
+                    [
+                        pvname,
+                        s["consumers"],
+                        s["updates"],
+                        f"{s['rate']:.2f}",
+                        f"{1000*s['delay_mean']:.1f}",
+                        f"{1000*s['callback_time_mean']:.2f}",
+                        f"{1000*s['callback_time_max']:.2f}",
+                    ]
+                    for pvname, s in sorted(stats.items())
+                    if s["consumers"] or not active_only
+                ],
+                headers=[
+                    "channel",
+                    "consumers",
+                    "updates",
+                    "rate / Hz",
+                    "delay / ms",
+                    "callback / ms",
+                    "callback max / ms",
+                ],
+            )
+        )
+
+
+hub = SubscriptionHub()
@@ -1,6 +1,7 @@
 from epics import PV
 from copy import copy
 from time import sleep, time
+from .monitor import Monitor as BufferedMonitor
 
 
 class EnumWrapper:
@@ -57,32 +58,36 @@ class MonitorAccumulator:
         return d
 
 
-class Monitor:
-    def __init__(self, pvname, start_immediately=True):
-        self.data = {}
-        self.print = False
-        self.pv = PV(pvname)
-        self.cb_index = None
-        if start_immediately:
-            self.start_callback()
+class Monitor(BufferedMonitor):
+    """Monitor keeping the records per PV name, as used for the scan monitor
+    files. Recording goes to the numpy buffers of eco.epics.monitor.Monitor,
+    the record dictionaries are only built when data is read."""
 
-    def start_callback(self):
-        self.cb_index = self.pv.add_callback(self.append)
+    def __init__(self, pvname, start_immediately=True, **kwargs):
+        super().__init__(
+            pvname, start_immediately=start_immediately, active_get=False, **kwargs
+        )
 
-    def stop_callback(self):
-        self.pv.remove_callback(self.cb_index)
+    def get_arrays(self):
+        return super().data
 
-    def append(self, pvname=None, value=None, timestamp=None, **kwargs):
-        if not (pvname in self.data):
-            self.data[pvname] = []
-        ts_local = time()
-        self.data[pvname].append(
-            {"value": value, "timestamp": timestamp, "timestamp_local": ts_local}
-        )
-        if self.print:
-            print(
-                f"{pvname}:  {value};  time: {timestamp}; time_local: {ts_local}; diff: {ts_local-timestamp}"
-            )
+    @property
+    def data(self):
+        arrays = self.get_arrays()
+        if not len(arrays["timestamp_local"]):
+            return {}
+        values = arrays["value"]
+        values = list(values) if values.ndim > 1 else values.tolist()
+        return {
+            self.pvname: [
+                {"value": value, "timestamp": timestamp, "timestamp_local": ts_local}
+                for value, timestamp, ts_local in zip(
+                    values,
+                    arrays["timestamp"].tolist(),
+                    arrays["timestamp_local"].tolist(),
+                )
+            ]
+        }
 
 
 class Positioner:
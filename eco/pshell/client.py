@@ -4,6 +4,8 @@ import sys
 import requests
 import json
 
+from eco.utilities.http_transport import get_transport
+
 try:
     from urllib import quote  # Python 2
 except ImportError:
@@ -23,6 +25,7 @@ class PShellClient:
         if not url.endswith('/'):
             url=url+"/"
         self.url = url
+        self._transport = get_transport(url)
         self.sse_event_loop_thread = None
         self.subscribed_events = None
         self.event_callback = None
@@ -33,19 +36,19 @@ class PShellClient:
         url=self.url+url
         if self.debug:
             print ("GET " + url)
-        return requests.get(url=url, stream=stream)
+        return self._transport.session.get(url=url, stream=stream)
         
     def _put(self, url, json_data=None):
         url=self.url+url
         if self.debug:
             print ("PUT " + url + " -> " + json.dumps(json_data))
-        return requests.put(url=url, json=json_data)           
+        return self._transport.session.put(url=url, json=json_data)           
     
     def _del(self, url):
         url=self.url+url
         if self.debug:
             print ("DEL " + url)
-        return requests.delete(url=url)
+        return self._transport.session.delete(url=url)
     
     def _get_response(self, response, is_json=True):
         if self.debug==True or  self.debug=="rx":
@@ -12,14 +12,24 @@ from functools import partial
 # from .lazy_proxy import Proxy
 from ..aliases import Alias
 from ..elements.assembly import Assembly
+from .startup_profile import StartupProfile
 import getpass
 import colorama
 import socket
 from importlib import import_module
 from lazy_object_proxy import Proxy as Proxy_orig
 from tabulate import tabulate
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Thread
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    TimeoutError as FutureTimeoutError,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+import heapq
+from threading import Lock, Thread
 from tqdm import tqdm
 from rich import progress
 from inspect import signature
@@ -90,7 +100,15 @@ def init_name_obj(obj, args, kwargs, name=None):
         return obj(*args, **kwargs)
 
 
-def init_device(type_string, name, args=[], kwargs={}, verbose=True, lazy=True):
+def init_device(
+    type_string,
+    name,
+    args=[],
+    kwargs={},
+    verbose=True,
+    lazy=True,
+    startup_profile=None,
+):
     if verbose:
         print(("Configuring %s " % (name)).ljust(25), end="")
         sys.stdout.flush()
@@ -100,7 +118,10 @@ def init_device(type_string, name, args=[], kwargs={}, verbose=True, lazy=True):
         print(("(%s)" % (type_name)).ljust(25), end="")
         sys.stdout.flush()
     try:
-        tg = importlib.import_module(".".join(imp_p)).__dict__[type_name]
+        if startup_profile:
+            tg = startup_profile.get_factory(type_name, module_name=".".join(imp_p))
+        else:
+            tg = importlib.import_module(".".join(imp_p)).__dict__[type_name]
 
         if lazy:
             tdev = Proxy(partial(init_name_obj, tg, args, kwargs, name=name))
@@ -108,7 +129,12 @@ def init_device(type_string, name, args=[], kwargs={}, verbose=True, lazy=True):
                 print((_color.YELLOW + "LAZY" + _color.RESET).rjust(5))
                 sys.stdout.flush()
         else:
+            starttime = time()
             tdev = init_name_obj(tg, args, kwargs, name=name)
+            if startup_profile:
+                startup_profile.record_object(
+                    name, time() - starttime, tdev, module_name=".".join(imp_p)
+                )
             if verbose:
                 print((_color.GREEN + "OK" + _color.RESET).rjust(5))
                 sys.stdout.flush()
@@ -324,6 +350,23 @@ class IsInitialisingError(Exception):
     pass
 
 
+class _InitialisationState:
+    """Initialisation state of a lazy namespace item.
+
+    Transitions (under Namespace._init_lock) are
+    "lazy" -> "initialising" -> "initialised" or "failed", and "failed" ->
+    "lazy" through move_failed_to_lazy. The future is resolved with the
+    initialised object or the exception, waking up all waiters at once."""
+
+    __slots__ = ["state", "future", "start_time", "priority"]
+
+    def __init__(self):
+        self.state = "lazy"
+        self.future = Future()
+        self.start_time = None
+        self.priority = 0
+
+
 class Namespace(Assembly):
     def __init__(
         self,
@@ -332,6 +375,8 @@ class Namespace(Assembly):
         alias_namespace=None,
         required_names=[],
         required_names_directory=None,
+        initialisation_times_file=None,
+        startup_profile_file=None,
     ):
         super().__init__(name)
         # self.name = name
@@ -339,15 +384,17 @@ class Namespace(Assembly):
         self.initialized_items = {}
         self.failed_items = {}
         self.failed_items_excpetion = {}
+        self._names_by_id = {}
         self.initialisation_times_lazy = {}
         self.initialisation_times = {}
-        self._initialisation_start_time = {}
-        self._init_priority = {}
+        self._init_states = {}
+        self._init_lock = Lock()
 
         self.names_without_alias = []
-        self._initializing = []
+        self._dependencies = {}
         self.root_module = root_module
         self.alias_namespace = alias_namespace
+        self.startup_profile = StartupProfile(startup_profile_file)
         if required_names_directory:
             self._append(
                 AdjustableFS,
@@ -364,6 +411,23 @@ class Namespace(Assembly):
                 is_setting=True,
                 is_display=True,
             )
+        if initialisation_times_file:
+            self._append(
+                AdjustableFS,
+                initialisation_times_file,
+                default_value={},
+                name="initialisation_times_profile",
+                is_setting=False,
+                is_display=False,
+            )
+        else:
+            self._append(
+                AdjustableMemory,
+                {},
+                name="initialisation_times_profile",
+                is_setting=False,
+                is_display=False,
+            )
 
     @property
     def initialisation_times_sorted(self):
@@ -398,16 +462,38 @@ class Namespace(Assembly):
             names = self.failed_names
         for name in names:
             self.lazy_items[name] = self.failed_items.pop(name)
+            self._names_by_id[id(self.lazy_items[name])] = name
             try:
                 self.failed_items_excpetion.pop(name)
             except KeyError:
                 pass
-            try:
-                self._initializing.pop(self._initializing.index(name))
-            except KeyError:
-                pass
-            except ValueError:
-                pass
+            with self._init_lock:
+                self._init_states[name] = _InitialisationState()
+
+    def _give_up_lazy(self, name):
+        """Move a lazy item which could not be initialised to the failed items."""
+        with self._init_lock:
+            self.failed_items[name] = self.lazy_items.pop(name)
+            self._names_by_id.pop(id(self.failed_items[name]), None)
+            tstate = self._init_states.get(name)
+            if tstate and not tstate.future.done():
+                tstate.state = "failed"
+                tstate.future.set_exception(
+                    IsInitialisingError(f"{name} could not be initialized.")
+                )
+
+    def get_init_state(self, name):
+        """One of "lazy", "initialising", "initialised" or "failed"."""
+        return self._init_states[name].state
+
+    def wait_for_names(self, *names, timeout=None, return_when=ALL_COMPLETED):
+        """Wait until namespace items are initialised or failed.
+
+        Waiting does not start the initialisation. Returns the sets of
+        finished and of not finished names, like concurrent.futures.wait."""
+        futures = {self._init_states[name].future: name for name in names}
+        done, not_done = wait(list(futures), timeout=timeout, return_when=return_when)
+        return set(futures[f] for f in done), set(futures[f] for f in not_done)
 
     def select_required_names(self):
 
@@ -478,12 +564,17 @@ class Namespace(Assembly):
         raise_errors=False,
         print_summary=True,
         print_times=True,
-        max_workers=1,
+        max_workers=8,
         N_cycles=4,
         silent=True,
         giveup_failed=True,
         exclude_names=[],
     ):
+        """Initialise lazy items, by default only the required names.
+
+        Items are initialised in dependency order (see init_names_ordered)
+        with up to max_workers threads, slowest items of previous sessions
+        first. Items that failed are retried once in a single thread."""
         starttime = time()
 
         if self.failed_names:
@@ -501,6 +592,7 @@ class Namespace(Assembly):
                 ) & set(self.required_names())
         else:
             names_to_init = self.all_names - self.initialized_names - set(exclude_names)
+        self.startup_profile.prefetch_pvs(names_to_init)
 
         if silent:
             self.silently_initializing = True
@@ -509,27 +601,27 @@ class Namespace(Assembly):
             )
 
             def init():
-                self.exc_init = ThreadPoolExecutor(max_workers=max_workers)
-                jobs = [
-                    self.exc_init.submit(
-                        self.init_name, name, verbose=verbose, raise_errors=raise_errors
-                    )
-                    for name in names_to_init
-                ]
-                self.exc_init.shutdown(wait=True)
+                self.init_names_ordered(
+                    names_to_init,
+                    max_workers=max_workers,
+                    verbose=verbose,
+                    raise_errors=raise_errors,
+                )
                 self.exc_init = ThreadPoolExecutor(max_workers=1)
                 jobs = [
                     self.exc_init.submit(
                         self.init_name, name, verbose=verbose, raise_errors=raise_errors
                     )
-                    for name in (names_to_init)
+                    for name in (names_to_init - self.initialized_names)
                 ]
                 self.exc_init.shutdown(wait=True)
+                self.store_initialisation_times_profile()
+                self.startup_profile.store()
                 self.silently_initializing = False
                 if giveup_failed:
                     failed_names = names_to_init.intersection(self.lazy_names)
                     for k in failed_names:
-                        self.failed_items[k] = self.lazy_items.pop(k)
+                        self._give_up_lazy(k)
                 if print_summary:
                     print(
                         f"Initialized {len(self.initialized_names & names_to_init)} of {len(names_to_init)}."
@@ -558,36 +650,33 @@ class Namespace(Assembly):
             # stdout = sys.stdout
             # sys.stdout = TeeTextIO(sys.stdout)
 
-            with ThreadPoolExecutor(max_workers=max_workers) as exc:
-                list(
-                    progress.track(
-                        exc.map(
-                            lambda name: self.init_name(
-                                name, verbose=verbose, raise_errors=raise_errors
-                            ),
-                            names_to_init,
-                        ),
-                        description="Initializing ...",
-                        total=len(names_to_init),
-                        transient=True,
-                    )
-                )
-            print("Initializing in single thread...")
+            self.init_names_ordered(
+                names_to_init,
+                max_workers=max_workers,
+                verbose=verbose,
+                raise_errors=raise_errors,
+                show_progress=True,
+            )
             self.move_failed_to_lazy()
-            with ThreadPoolExecutor(max_workers=1) as exc:
-                list(
-                    progress.track(
-                        exc.map(
-                            lambda name: self.init_name(
-                                name, verbose=verbose, raise_errors=raise_errors
+            names_retry = names_to_init - self.initialized_names
+            if names_retry:
+                print("Initializing in single thread...")
+                with ThreadPoolExecutor(max_workers=1) as exc:
+                    list(
+                        progress.track(
+                            exc.map(
+                                lambda name: self.init_name(
+                                    name, verbose=verbose, raise_errors=raise_errors
+                                ),
+                                names_retry,
                             ),
-                            names_to_init,
-                        ),
-                        description="Initializing ...",
-                        total=len(names_to_init),
-                        transient=True,
+                            description="Initializing ...",
+                            total=len(names_retry),
+                            transient=True,
+                        )
                     )
-                )
+            self.store_initialisation_times_profile()
+            self.startup_profile.store()
                 # )
                 #     # )
 
@@ -597,7 +686,7 @@ class Namespace(Assembly):
             if giveup_failed:
                 failed_names = names_to_init.intersection(self.lazy_names)
                 for k in failed_names:
-                    self.failed_items[k] = self.lazy_items.pop(k)
+                    self._give_up_lazy(k)
             if print_summary:
                 print(
                     f"Initialized {len(self.initialized_names & names_to_init)} of {len(names_to_init)}."
@@ -620,6 +709,7 @@ class Namespace(Assembly):
                     [(tk, tv) for tk, tv in self.initialisation_times_sorted.items()],
                 ):
                     print(line)
+                self.startup_profile.print_report()
 
             # if verbose:
             #     print(("Configuring %s " % (name)).ljust(25), end="")
@@ -642,6 +732,116 @@ class Namespace(Assembly):
             #     if raise_errors:
             #         raise expt
 
+    def _get_dependency_names(self, *args, **kwargs):
+        """Names of namespace items an item depends on, found as
+        NamespaceComponent arguments or as namespace items passed directly.
+        Only type() is used on arguments to not initialise lazy proxies."""
+        names_by_id = self._names_by_id
+        deps = set()
+
+        def collect(value):
+            if id(value) in names_by_id:
+                deps.add(names_by_id[id(value)])
+            elif type(value) is NamespaceComponent:
+                if hasattr(value, "obj_name"):
+                    deps.add(value.obj_name)
+            elif type(value) in (list, tuple):
+                for tv in value:
+                    collect(tv)
+            elif type(value) is dict:
+                for tv in value.values():
+                    collect(tv)
+
+        collect(args)
+        collect(kwargs)
+        return deps
+
+    @property
+    def dependencies(self):
+        return self._dependencies
+
+    def init_names_ordered(
+        self,
+        names,
+        max_workers=8,
+        verbose=False,
+        raise_errors=False,
+        show_progress=False,
+        default_time=1.0,
+    ):
+        """Initialise names in topological order of their dependencies.
+
+        An item is started as soon as all items it depends on are done,
+        with at most max_workers items in parallel. Among the items ready to
+        start, the ones which took longest in previous sessions (see
+        initialisation_times_profile) are started first. Dependency cycles
+        are broken by starting the remaining items anyway."""
+        names = set(names)
+        deps = {
+            name: (self._dependencies.get(name, set()) & names) - {name}
+            for name in names
+        }
+        dependents = {name: set() for name in names}
+        for name, tdeps in deps.items():
+            for dep in tdeps:
+                dependents[dep].add(name)
+        n_open = {name: len(tdeps) for name, tdeps in deps.items()}
+        profile = self.initialisation_times_profile.get_current_value() or {}
+
+        def priority(name):
+            return (-profile.get(name, default_time), name)
+
+        ready = [priority(name) for name in names if n_open[name] == 0]
+        heapq.heapify(ready)
+        queued = set(name for _, name in ready)
+        running = {}
+        done = set()
+
+        if show_progress:
+            prog = progress.Progress(transient=True)
+            prog.start()
+            task = prog.add_task("Initializing ...", total=len(names))
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as exc:
+                while len(done) < len(names):
+                    if not ready and not running:
+                        # dependency cycle, start what is left.
+                        for name in names - done - queued:
+                            heapq.heappush(ready, priority(name))
+                            queued.add(name)
+                    while ready and len(running) < max_workers:
+                        _, name = heapq.heappop(ready)
+                        running[
+                            exc.submit(
+                                self.init_name,
+                                name,
+                                verbose=verbose,
+                                raise_errors=raise_errors,
+                            )
+                        ] = name
+                    finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        name = running.pop(fut)
+                        done.add(name)
+                        if show_progress:
+                            prog.advance(task)
+                        fut.result()
+                        for dependent in dependents[name]:
+                            n_open[dependent] -= 1
+                            if n_open[dependent] == 0 and dependent not in queued:
+                                heapq.heappush(ready, priority(dependent))
+                                queued.add(dependent)
+        finally:
+            if show_progress:
+                prog.stop()
+
+    def store_initialisation_times_profile(self):
+        """Merge the initialisation times of this session into the profile used to schedule init_all."""
+        profile = self.initialisation_times_profile.get_current_value() or {}
+        profile.update(self.initialisation_times)
+        profile.update(self.initialisation_times_lazy)
+        self.initialisation_times_profile.set_target_value(profile).wait()
+
     def init_all_new(
         self,
         verbose=False,
@@ -689,7 +889,7 @@ class Namespace(Assembly):
                 if giveup_failed:
                     failed_names = self.lazy_names
                     for k in failed_names:
-                        self.failed_items[k] = self.lazy_items.pop(k)
+                        self._give_up_lazy(k)
                 if print_summary:
                     print(
                         f"Initialized {len(self.initialized_names)} of {len(self.all_names)}."
@@ -751,7 +951,7 @@ class Namespace(Assembly):
             if giveup_failed:
                 failed_names = self.lazy_names
                 for k in failed_names:
-                    self.failed_items[k] = self.lazy_items.pop(k)
+                    self._give_up_lazy(k)
             if print_summary:
                 print(
                     f"Initialized {len(self.initialized_names)} of {len(self.all_names)}."
@@ -799,48 +999,46 @@ class Namespace(Assembly):
         init_timeout=30,
         **kwargs,
     ):
+        self._dependencies[name] = self._get_dependency_names(*args, **kwargs)
         if lazy:
 
             def init_local():
 
-                if name in self.failed_names:
-                    tmpexc = self.failed_items_excpetion
-                    if isinstance(tmpexc[name], BaseException):
-                        raise tmpexc[name]
-                    else:
-                        raise IsInitialisingError(
-                            f"{name} failed previously to initialize."
-                        )
-
-                if name in self._initializing:
-                    self._init_priority[name] += 1
-                    while name in self._initializing:
-                        if (
-                            time() - self._initialisation_start_time[name]
-                        ) <= init_timeout:
-                            sleep(5)
+                with self._init_lock:
+                    if name in self.failed_names:
+                        tmpexc = self.failed_items_excpetion
+                        if isinstance(tmpexc.get(name), BaseException):
+                            raise tmpexc[name]
                         else:
-                            #     print(f'{name} waiting init since {time()-self._initialisation_start_time[name]} s')
-                            #     sleep(5)
-                            # # passfailed_items_excpetion
-                            self._initializing.pop(self._initializing.index(name))
                             raise IsInitialisingError(
-                                f"NB: {name} initialization timed out!"
+                                f"{name} failed previously to initialize."
                             )
+                    tstate = self._init_states[name]
+                    is_owner = tstate.state == "lazy"
+                    if is_owner:
+                        tstate.state = "initialising"
+                        tstate.start_time = time()
+                        tstate.future.set_running_or_notify_cancel()
+                    else:
+                        tstate.priority += 1
 
-                else:
-                    self._initializing.append(name)
-                    self._init_priority[name] = 0
-                    self._initialisation_start_time[name] = time()
+                if not is_owner:
+                    try:
+                        return tstate.future.result(
+                            timeout=max(0, init_timeout - (time() - tstate.start_time))
+                        )
+                    except FutureTimeoutError:
+                        raise IsInitialisingError(
+                            f"NB: {name} initialization timed out!"
+                        )
 
                 # args, kwargs = replace_NamespaceComponents(*args, **kwargs)
 
-                if module_name:
-                    obj_maker = getattr(import_module(module_name), obj_factory)
-                else:
-                    obj_maker = obj_factory
-
                 try:
+                    obj_maker = self.startup_profile.get_factory(
+                        obj_factory, module_name=module_name
+                    )
+                    constructiontime = time()
                     if "name" in signature(obj_maker).parameters:
                         obj_initialized = obj_maker(
                             *replace_NamespaceComponents(*args)[0],
@@ -853,21 +1051,32 @@ class Namespace(Assembly):
                             **replace_NamespaceComponents(**kwargs)[1],
                         )
                 except Exception as e:
-                    self.failed_items[name] = self.lazy_items.pop(name)
-                    self.failed_items_excpetion[name] = e
-                    self._initializing.pop(self._initializing.index(name))
+                    with self._init_lock:
+                        self.failed_items[name] = self.lazy_items.pop(name)
+                        self._names_by_id.pop(id(self.failed_items[name]), None)
+                        self.failed_items_excpetion[name] = e
+                        tstate.state = "failed"
+                    tstate.future.set_exception(e)
                     raise Exception
 
-                try:
-                    self.initialized_items[name] = self.lazy_items.pop(name)
-                except KeyError:
-                    self.initialized_items[name] = self.failed_items.pop(name)
-                self._initializing.pop(self._initializing.index(name))
+                with self._init_lock:
+                    try:
+                        self.initialized_items[name] = self.lazy_items.pop(name)
+                    except KeyError:
+                        self.initialized_items[name] = self.failed_items.pop(name)
+                    self._names_by_id[id(self.initialized_items[name])] = name
+                    self._names_by_id[id(obj_initialized)] = name
+                    tstate.state = "initialised"
+                tstate.future.set_result(obj_initialized)
                 # if name in self.initialisation_times_lazy.keys():
                 #     self.initialisation_times_lazy[name] += time() - starttime
                 # else:
-                self.initialisation_times_lazy[name] = (
-                    time() - self._initialisation_start_time[name]
+                self.initialisation_times_lazy[name] = time() - tstate.start_time
+                self.startup_profile.record_object(
+                    name,
+                    time() - constructiontime,
+                    obj_initialized,
+                    module_name=module_name,
                 )
                 if hasattr(obj_initialized, "alias"):
                     self._append(
@@ -878,21 +1087,15 @@ class Namespace(Assembly):
                         call_obj=False,
                     )
                 if self.alias_namespace and hasattr(obj_initialized, "alias"):
-                    for ta in obj_initialized.alias.get_all():
-                        try:
-                            self.alias_namespace.update(
-                                ta["alias"], ta["channel"], ta["channeltype"]
-                            )
-                        except Exception as e:
-                            print(f'could not init alias {ta["alias"]}')
-                            print("error message", e)
-                            # traceback.print_tb(e)
+                    self._update_alias_namespace(obj_initialized)
                 else:
                     self.names_without_alias.append(name)
                 return obj_initialized
 
             obj_lazy = Proxy(init_local)
+            self._init_states[name] = _InitialisationState()
             self.lazy_items[name] = obj_lazy
+            self._names_by_id[id(obj_lazy)] = name
             if self.root_module:
                 sys.modules[self.root_module].__dict__[name] = obj_lazy
             return obj_lazy
@@ -900,16 +1103,25 @@ class Namespace(Assembly):
         else:
             starttime = time()
             args, kwargs = replace_NamespaceComponents(*args, **kwargs)
-            if module_name:
-                obj_maker = getattr(import_module(module_name), obj_factory)
-            else:
-                obj_maker = obj_factory
+            obj_maker = self.startup_profile.get_factory(
+                obj_factory, module_name=module_name
+            )
+            constructiontime = time()
             try:
                 obj = obj_maker(*args, name=name, **kwargs)
             except TypeError:
                 obj = obj_maker(*args, **kwargs)
             self.initialized_items[name] = obj
+            self._names_by_id[id(obj)] = name
             self.initialisation_times_lazy[name] = time() - starttime
+            self.startup_profile.record_object(
+                name, time() - constructiontime, obj, module_name=module_name
+            )
+            tstate = _InitialisationState()
+            tstate.state = "initialised"
+            tstate.start_time = starttime
+            tstate.future.set_result(obj)
+            self._init_states[name] = tstate
             if self.root_module:
                 sys.modules[self.root_module].__dict__[name] = obj
             if hasattr(obj, "alias"):
@@ -921,18 +1133,25 @@ class Namespace(Assembly):
                     call_obj=False,
                 )
             if self.alias_namespace and hasattr(obj, "alias"):
-                for ta in obj.alias.get_all():
-                    try:
-                        self.alias_namespace.update(
-                            ta["alias"], ta["channel"], ta["channeltype"]
-                        )
-                    except Exception as e:
-                        print(f'could not init alias {ta["alias"]}')
-                        print("error message", e)
+                self._update_alias_namespace(obj)
             else:
                 self.names_without_alias.append(name)
             return obj
 
+    def _update_alias_namespace(self, obj):
+        taa = obj.alias.get_all()
+        try:
+            self.alias_namespace.update_many(taa)
+        except Exception:
+            for ta in taa:
+                try:
+                    self.alias_namespace.update(
+                        ta["alias"], ta["channel"], ta["channeltype"]
+                    )
+                except Exception as e:
+                    print(f'could not init alias {ta["alias"]}')
+                    print("error message", e)
+
     def get_obj(self, name):
         if name in self.lazy_names:
             return self.lazy_items[name]
@@ -0,0 +1,186 @@
+"""Shared HTTP transport with keep-alive connection pools per base URL.
+
+get_transport(base_url) returns one HttpTransport per base URL and settings,
+holding a requests.Session with a bounded connection pool and retries, and a
+thread pool for the futures based submit(). StandInServer is a local HTTP server
+answering every request with a small json document after an optional delay,
+to benchmark clients without the real services."""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_transports = {}
+_transports_lock = Lock()
+# request timeout argument not given, the transport default applies
+_DEFAULT = object()
+
+
+class HttpTransport:
+    """Pooled HTTP client for one base URL.
+
+    Connection errors are retried for all methods; read errors and the
+    status codes in status_forcelist only for GET, HEAD and OPTIONS, so that
+    e.g. a POST advancing a run number or a PUT starting a script is never
+    sent twice. timeout is the default for calls which do not give their
+    own, None (no timeout) unless set."""
+
+    def __init__(
+        self,
+        base_url,
+        timeout=None,
+        retries=3,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        pool_maxsize=10,
+        max_workers=8,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=status_forcelist,
+                allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="http_transport"
+        )
+
+    def _url(self, path):
+        if not path:
+            return self.base_url
+        return self.base_url + "/" + path.lstrip("/")
+
+    def request(self, method, path="", timeout=_DEFAULT, **kwargs):
+        if timeout is _DEFAULT:
+            timeout = self.timeout
+        return self.session.request(method, self._url(path), timeout=timeout, **kwargs)
+
+    def get(self, path="", **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path="", **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path="", **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path="", **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def submit(self, method, path="", **kwargs):
+        """Send a request in the transport thread pool, returns a Future of the response."""
+        return self._executor.submit(self.request, method, path, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+def get_transport(base_url, **kwargs):
+    """Shared HttpTransport for base_url, one per set of kwargs (timeout,
+    retry and pool settings), so callers never get the settings of another."""
+    url = base_url.rstrip("/")
+    key = (url, tuple(sorted(kwargs.items())))
+    with _transports_lock:
+        if key not in _transports:
+            _transports[key] = HttpTransport(url, **kwargs)
+        return _transports[key]
+
+
+class StandInServer:
+    """Local HTTP server answering all requests with {"status": "ok", ...}.
+
+    Usable as context manager, base_url is set while it is running. The
+    handler sleeps delay seconds per request to mimic a service."""
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, response=None):
+        self.delay = delay
+        self.response = {"status": "ok", "message": "stand-in", "run_number": 0}
+        if response:
+            self.response.update(response)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _answer(self):
+                length = int(self.headers.get("Content-Length", 0))
+                if length:
+                    self.rfile.read(length)
+                if server.delay:
+                    time.sleep(server.delay)
+                body = json.dumps(server.response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self.base_url = "http://%s:%d" % self._httpd.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def benchmark_transport(base_url=None, n_requests=100, delay=0.0, parallel=True):
+    """Time n_requests POSTs with module level requests and with the pooled
+    transport (in parallel through submit() if parallel). Without base_url a
+    StandInServer with the given delay is used."""
+    if base_url is None:
+        with StandInServer(delay=delay) as srv:
+            return benchmark_transport(
+                srv.base_url, n_requests=n_requests, parallel=parallel
+            )
+    t0 = time.time()
+    for n in range(n_requests):
+        requests.post(base_url + "/bench", json={"n": n}, timeout=10)
+    t_plain = time.time() - t0
+
+    transport = HttpTransport(base_url)
+    t0 = time.time()
+    if parallel:
+        futs = [
+            transport.submit("POST", "bench", json={"n": n}) for n in range(n_requests)
+        ]
+        [f.result() for f in futs]
+    else:
+        for n in range(n_requests):
+            transport.post("bench", json={"n": n})
+    t_pooled = time.time() - t0
+    transport.close()
+    return {"requests": t_plain, "pooled": t_pooled}
@@ -7,6 +7,7 @@ from matplotlib import pyplot as plt
 import pandas as pd
 import numpy as np
 from datetime import datetime
+import json
 import os
 from PIL import Image
 from scipy.spatial.transform import Rotation
@@ -23,6 +24,7 @@ from eco.elements.detector import DetectorVirtual
 
 from eco.elements.adj_obj import AdjustableObject
 from epics import PV
+from eco.epics.subscription_hub import hub
 
 
 class Diffractometer_Dummy(Assembly):
@@ -500,6 +502,11 @@ class DiffGeometryYou(Assembly):
             self._calc_angles_unique_diffractometer,
             name="hkl",
         )
+        self._hklcalc = None
+        self._hklcalc_key = None
+        self._ubcalc_state = None
+        self._solutions = {}
+        self._solutions_max = 100000
         self.to_diffcalc()
 
     def convert_from_you(self, **kwargs):
@@ -624,6 +631,50 @@ class DiffGeometryYou(Assembly):
         ).wait()
         self.to_diffcalc()
 
+    def _get_constraints_dict(self, constraints_update={}):
+        constraints_dict = {
+            "nu" if k == "gamma" else k: v
+            for k, v in self.constraints._base_dict().items()
+        }
+        constraints_dict.update(constraints_update)
+        return constraints_dict
+
+    def _get_hklcalc(self, constraints_update={}):
+        """HklCalculation for the current UB state and constraints, rebuilt
+        only if lattice, orientations, reflections, UB or constraints changed.
+        Changes also clear the cached solutions."""
+        state = json.dumps(
+            [
+                self.unit_cell(),
+                self.orientations(),
+                self.reflections(),
+                self.ub_matrix(),
+                self.u_matrix(),
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        constraints_dict = self._get_constraints_dict(constraints_update)
+        key = (state, json.dumps(constraints_dict, sort_keys=True, default=str))
+        if not key == self._hklcalc_key:
+            if not state == self._ubcalc_state:
+                self.to_diffcalc()
+                self._ubcalc_state = state
+            self._hklcalc = HklCalculation(self.ubcalc, Constraints(constraints_dict))
+            self._hklcalc_key = key
+            self._solutions = {}
+        return self._hklcalc
+
+    def _get_solutions(self, hklcalc, h, k, l, energy):
+        """diffcalc solutions (position, virtual angles) of (h,k,l) at energy
+        in eV, cached for the state of the last _get_hklcalc call."""
+        key = (float(h), float(k), float(l), float(energy))
+        if key not in self._solutions:
+            if len(self._solutions) >= self._solutions_max:
+                self._solutions = {}
+            self._solutions[key] = hklcalc.get_position(h, k, l, self.en2lam(energy))
+        return self._solutions[key]
+
     def to_diffcalc(self):
         self.ubcalc = dccalc.UBCalculation("you")
         uc = self.unit_cell()
@@ -905,19 +956,10 @@ class DiffGeometryYou(Assembly):
             curval() if setval == None else setval
             for setval, curval in zip(setvals, curvals)
         ]
-        self.to_diffcalc()
-        constraints_dict = {
-            "nu" if k == "gamma" else k: v
-            for k, v in self.constraints._base_dict().items()
-        }
-        constraints_dict.update(constraints_update)
-        cons = Constraints(constraints_dict)
-
-        hklcalc = HklCalculation(self.ubcalc, cons)
+        hklcalc = self._get_hklcalc(constraints_update)
         if energy is None:
             energy = self.get_energy()
-        lam = self.en2lam(energy)
-        result = hklcalc.get_position(h, k, l, lam)
+        result = self._get_solutions(hklcalc, h, k, l, energy)
         result = pd.concat(
             [
                 pd.DataFrame.from_dict(
@@ -937,6 +979,73 @@ class DiffGeometryYou(Assembly):
         )
         return result.T
 
+    def _get_limits(self):
+        limits = {}
+        for axname, adj in self._diff_adjs.items():
+            if hasattr(adj, "get_limits"):
+                limits[axname] = adj.get_limits()
+            else:
+                raise Exception(f"Failed to get limits of adjustable {adj.name}")
+        return limits
+
+    def calc_angles_batch(
+        self, hkls, energies=None, constraints_update={}, check_limits=True
+    ):
+        """calculate all diffractometer angle solutions for an array of
+        (h, k, l) and energies in eV (scalar or one per hkl, default is the
+        current energy).
+        Returns a numpy structured array with one row per solution, fields
+        "index" (of the hkl), "h", "k", "l", "energy", the you angles, the
+        virtual angles and "in_limits" (all diffractometer motors within their
+        soft limits, if check_limits). Unreachable hkls have no rows, e.g.
+        np.bincount(result["index"], minlength=len(hkls)) counts the solutions."""
+        hkls = np.atleast_2d(np.asarray(hkls, dtype=float))
+        if energies is None:
+            energies = self.get_energy()
+        energies = np.broadcast_to(np.asarray(energies, dtype=float), len(hkls))
+        hklcalc = self._get_hklcalc(constraints_update)
+        rows = []
+        names_virtual = []
+        for index, ((h, k, l), energy) in enumerate(zip(hkls, energies)):
+            try:
+                solutions = self._get_solutions(hklcalc, h, k, l, energy)
+            except Exception:
+                continue
+            for pos, virtual in solutions:
+                angles = {
+                    "gamma" if tk == "nu" else tk: tv for tk, tv in pos.asdict.items()
+                }
+                for tk in virtual:
+                    if tk not in names_virtual:
+                        names_virtual.append(tk)
+                rows.append((index, h, k, l, energy, angles, virtual))
+
+        names_you = ["gamma", "mu", "delta", "eta", "chi", "phi"]
+        dtype = (
+            [("index", int)]
+            + [(tn, float) for tn in ["h", "k", "l", "energy"] + names_you]
+            + [(tn, float) for tn in names_virtual]
+            + [("in_limits", bool)]
+        )
+        result = np.zeros(len(rows), dtype=dtype)
+        for n, (index, h, k, l, energy, angles, virtual) in enumerate(rows):
+            result[n] = (
+                (index, h, k, l, energy)
+                + tuple(angles[tn] for tn in names_you)
+                + tuple(virtual.get(tn, np.nan) for tn in names_virtual)
+                + (True,)
+            )
+        if check_limits and len(rows):
+            limits = self._get_limits()
+            targets = [
+                self.convert_from_you(**{tn: row[tn] for tn in names_you})
+                for row in result
+            ]
+            for axname, (lim_low, lim_high) in limits.items():
+                values = np.array([target[axname] for target in targets])
+                result["in_limits"] &= (lim_low < values) & (values < lim_high)
+        return result
+
     def calc_angles_plot(
         self,
         h=None,
@@ -982,12 +1091,17 @@ class DiffGeometryYou(Assembly):
         If any of the h, k, l are not given, their current value is used instead.
         If the energy is not given, the monochromator energy is used."""
         df = self.calc_angles(h, k, l, energy)
-        in_lims = np.array(
-            [
-                self.check_target_value_within_limits(**df.loc[idx].to_dict())
-                for idx in df.index
-            ]
-        )
+        limits = self._get_limits()
+        in_lims = []
+        for idx in df.index:
+            target_dict = self.convert_from_you(**df.loc[idx].to_dict())
+            in_lims.append(
+                all(
+                    (lim_low < target_dict[axname]) and (target_dict[axname] < lim_high)
+                    for axname, (lim_low, lim_high) in limits.items()
+                )
+            )
+        in_lims = np.array(in_lims, dtype=bool)
         idx_in = df.index[in_lims]
         idx_out = df.index[~in_lims]
 
@@ -1026,16 +1140,10 @@ class DiffGeometryYou(Assembly):
             for setval, curval in zip(setvals, curvals)
         ]
         pos = Position(*angs)
-        self.to_diffcalc()
         if energy is None:
             energy = self.get_energy()
         lam = self.en2lam(energy)
-        constraints_dict = {
-            "nu" if k == "gamma" else k: v
-            for k, v in self.constraints._base_dict().items()
-        }
-        cons = Constraints(constraints_dict)
-        hklcalc = HklCalculation(self.ubcalc, cons)
+        hklcalc = self._get_hklcalc()
         try:
             hkl = hklcalc.get_hkl(pos=pos, wavelength=lam)
         except Exception as e:
@@ -1044,7 +1152,7 @@ class DiffGeometryYou(Assembly):
         return hkl
 
     def get_energy(self):
-        energy = PV("SAROP21-ARAMIS:ENERGY").value
+        energy = hub.get_pv("SAROP21-ARAMIS:ENERGY").value
         if energy is None:
             raise ("Getting energy from monochromator / machine returned None")
         return energy
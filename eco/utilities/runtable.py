@@ -4,6 +4,8 @@ import pandas as pd
 import warnings
 from ..elements.adjustable import AdjustableFS
 from ..elements.memory import Memory
+from .runtable_store import StoreBackedTable
+from .runtable_parse import StatusIndexParse
 from subprocess import call
 from eco.utilities.config import Proxy
 from eco.bernina import namespace
@@ -152,13 +154,12 @@ class Gsheet_API:
 
 class Container:
     def __init__(self, df, name=""):
-        self._cols = df.columns
+        self._cols = df.get_column_names()
         self._top_level_name = name
         self._df = df
         self.__dir__()
 
     def _slice_df(self):
-        self._df.load()
         next_level_names = self._get_next_level_names()
         try:
             if len(next_level_names) == 0:
@@ -169,7 +170,7 @@ class Container:
                     for n in next_level_names
                     if f"{self._top_level_name}{n}" in self._cols
                 ]
-            sdf = self._df[columns_to_keep]
+            sdf = self._df.read_columns(columns_to_keep)
         except:
             sdf = pd.DataFrame(columns=next_level_names)
         return sdf
@@ -357,6 +358,7 @@ class Run_Table2:
             self._google_sheet_api._upload_all(df=df)
 
     def to_dataframe(self):
+        self._data.load()
         return DataFrame(self._data)
 
     ###### diagnostic and convencience functions ######
@@ -412,7 +414,9 @@ class Run_Table2:
 
     def __dir__(self):
         lazy = True
-        devs = np.unique(np.array([n.split(".")[0] for n in self._data.columns]))
+        devs = np.unique(
+            np.array([n.split(".")[0] for n in self._data.get_column_names()])
+        )
         for dev in devs:
             if dev not in self.__dict__.keys():
                 if lazy:
@@ -423,7 +427,9 @@ class Run_Table2:
         return directory
 
     def __str__(self):
-        devs = np.unique(np.array([n.split(".")[0] for n in self._data.columns]))
+        devs = np.unique(
+            np.array([n.split(".")[0] for n in self._data.get_column_names()])
+        )
         devs_abc = np.array([dev[0] for dev in devs])
         devs_dict = {abc: devs[devs_abc == abc] for abc in np.unique(devs_abc)}
         devs_str = ""
@@ -443,7 +449,7 @@ class Run_Table2:
         )
 
 
-class Run_Table_DataFrame(DataFrame):
+class Run_Table_DataFrame(StoreBackedTable, DataFrame):
     def __init__(
         self,
         data=None,
@@ -463,7 +469,7 @@ class Run_Table_DataFrame(DataFrame):
             devices = importlib.import_module(devices)
         self.devices = devices
         self.name = name
-        self.fname = exp_path + f"{exp_id}_runtable.pkl"
+        self._init_store(exp_path + f"{exp_id}_runtable.pkl")
         self.load()
         self.parse = parse
 
@@ -485,6 +491,12 @@ class Run_Table_DataFrame(DataFrame):
         self._adj_exclude_class_types = (
             "__ alias namespace scan MasterEventSystem _motor Alias".split(" ")
         )
+        self._status_index_parse = StatusIndexParse(
+            cache_file=self.fname[: -len(".pkl")] + "_parse_cache.json",
+            exclude_keys=self._parse_exclude_keys,
+            parse_exclude_class_types=self._parse_exclude_class_types,
+            exclude_class_types=self._adj_exclude_class_types,
+        )
         self.key_order = "metadata gps xrd midir env_thc temperature1_rbk temperature2_rbk  time name gps gps_hex thc ocb eos las lxt phase_shifter mono att att_fe slit_und slit_switch slit_att slit_kb slit_cleanup pulse_id mono_energy_rbk att_transmission att_fe_transmission"
         pd.options.display.max_rows = 100
         pd.options.display.max_columns = 50
@@ -510,23 +522,6 @@ class Run_Table_DataFrame(DataFrame):
     def _remove_duplicates(self):
         self.df = self[~self.index.duplicated(keep="last")]
 
-    def save(self):
-        data_dir = Path(os.path.dirname(self.fname))
-        if not data_dir.exists():
-            print(
-                f"Path {data_dir.absolute().as_posix()} does not exist, will create it..."
-            )
-            data_dir.mkdir(parents=True)
-            print(f"Tried to create {data_dir.absolute().as_posix()}")
-            data_dir.chmod(0o775)
-            print(f"Tried to change permissions to 775")
-        pd.DataFrame(self).to_pickle(self.fname + "tmp")
-        call(["mv", self.fname + "tmp", self.fname])
-
-    def load(self):
-        if os.path.exists(self.fname):
-            self.df = pd.read_pickle(self.fname)
-
     def _append_run(self, runno, metadata={}, d={}, wait=False):
         if wait:
             self.append_run(runno, metadata=metadata, d=d)
@@ -553,55 +548,33 @@ class Run_Table_DataFrame(DataFrame):
         },
         d={},
     ):
-        self.load()
-        if np.all([len(self.ids_parsed) == 0, self.parse]):
-            self._parse_parent()
-        dat = self._get_adjustable_values(d=d)
+        if self.parse:
+            self._update_parse()
+        values_by_id = {}
+        dat = self._get_adjustable_values(d=d, values_by_id=values_by_id)
         dat["metadata.time"] = datetime.now()
         dat.update({"metadata."+k:v for k, v in metadata.items()})
-        values = np.array(
-            list(dat.values()), dtype=object
-        )
-        index = np.array(
-            list(dat.keys())
-        )
-        run_df = DataFrame([values], columns=index, index=[runno])
-        # deprecated: self.df = self.append(run_df)
-        self.df = pd.concat([self.df, run_df])
-
-        self._remove_duplicates()
-        # self.order_df()
-        self.save()
+        self._store_row(runno, dat, values_by_id=values_by_id)
 
     def append_pos(self, name="", d={}):
-        self.load()
-        if np.all([len(self.ids_parsed) == 0, self.parse]):
-            self._parse_parent()
+        if self.parse:
+            self._update_parse()
         try:
-            posno = (
-                int(self[self["metadata.type"] == "pos"].index[-1].split("p")[1]) + 1
-            )
+            md = self.read_columns(["metadata.type"])
+            posno = int(md[md["metadata.type"] == "pos"].index[-1].split("p")[1]) + 1
         except:
             posno = 0
-        dat = self._get_adjustable_values(d=d)
+        values_by_id = {}
+        dat = self._get_adjustable_values(d=d, values_by_id=values_by_id)
         dat.update({"metadata.time": datetime.now(), "metadata.name": name, "metadata.type": "pos"})
-        values = np.array(
-            list(dat.values()), dtype=object
-        )
-        index = np.array(
-            list(dat.keys())
-        )
-        pos_df = DataFrame([values], columns=index, index=[f"p{posno}"])
-
-        # deprecated: self.df = self.append(pos_df)
-        self.df = pd.concat([self.df, pos_df])
-        self._remove_duplicates()
-        # self.order_df()
-        self.save()
+        self._store_row(f"p{posno}", dat, values_by_id=values_by_id)
 
-    def _get_adjustable_values(self, silent=False, d={}, by_id=True, multiindex=False):
+    def _get_adjustable_values(
+        self, silent=False, d={}, by_id=True, multiindex=False, values_by_id=None
+    ):
         """
-        This function gets the values of all adjustables in good adjustables and raises an error, when an adjustable is not connected anymore
+        This function gets the values of all adjustables in good adjustables and raises an error, when an adjustable is not connected anymore.
+        If given, values_by_id is filled with the values by ids_parsed key.
         """
         dat = {}
         if self.parse:
@@ -625,6 +598,8 @@ class Run_Table_DataFrame(DataFrame):
                         )
                         self.ids_bad.append(aid)
                         continue
+                if values_by_id is not None:
+                    values_by_id[aid] = v
                 if multiindex:
                     for name in adict["names"]:
                         devname = name.split(".")[0]
@@ -792,6 +767,8 @@ class Run_Table_DataFrame(DataFrame):
         if len(adjustable_exclude_class_types) == 0:
             adjustable_exclude_class_types = self._adj_exclude_class_types
         self.ids_parsed = {}
+        self._stored_values_by_id = {}
+        self._status_index_parse.parsed_names = set()
         if parent == None:
             parent = self.devices
         self.ids_parsed[id(parent)] = {"ids": []}
@@ -830,9 +807,27 @@ class Run_Table_DataFrame(DataFrame):
                 print(key)
         self._check_adjustables()
 
-    def _check_adjustables(self, check_for_current_none_values=True, by_id=True):
-        self.ids_bad = []
-        for aid, adict in self.ids_parsed.items():
+    def _update_parse(self):
+        """Parse the adjustables of namespace items initialised since the last
+        parse, with the column names of _parse_parent. Without namespace the
+        device tree is walked once by _parse_parent."""
+        ns = getattr(self.devices, "namespace", None)
+        if ns is None or not hasattr(ns, "initialized_items"):
+            if len(self.ids_parsed) == 0:
+                self._parse_parent()
+            return
+        new_ids = self._status_index_parse.update(ns, self.ids_parsed)
+        if new_ids:
+            self._check_adjustables(ids=new_ids)
+
+    def _check_adjustables(
+        self, check_for_current_none_values=True, by_id=True, ids=None
+    ):
+        if ids is None:
+            self.ids_bad = []
+            ids = list(self.ids_parsed.keys())
+        for aid in ids:
+            adict = self.ids_parsed[aid]
             if "value" in adict.keys():
                 try:
                     v = adict["value"].get_current_value()
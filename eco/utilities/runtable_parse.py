@@ -0,0 +1,203 @@
+import hashlib
+import json
+from pathlib import Path
+
+
+def namespace_fingerprint(namespace, *extra):
+    """Hash of the namespace configuration: item names and their dependencies."""
+    deps = getattr(namespace, "dependencies", {})
+    data = json.dumps(
+        [
+            sorted(namespace.all_names),
+            sorted([str(k), sorted(str(v) for v in vs)] for k, vs in deps.items()),
+            list(extra),
+        ],
+        default=str,
+    )
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def _path2obj(obj, path):
+    for tn in path.split("."):
+        if tn:
+            obj = obj.__dict__[tn]
+    return obj
+
+
+class StatusIndexParse:
+    """Run table adjustables of namespace items.
+
+    The adjustables of every initialised namespace item are found by the
+    attribute walk of Run_Table_DataFrame._parse_parent (same exclusion lists
+    and the same column names, built from the name attributes along the
+    path), only started at the item, so lazy items are never initialised by
+    the parse. Adjustables listed in the status index of an item but not
+    reached by the walk are added under their status index name. The column
+    names and attribute paths per item are stored in cache_file for a given
+    configuration fingerprint and resolved directly in the next session.
+    update() only parses the items initialised since its last call."""
+
+    def __init__(
+        self,
+        cache_file=None,
+        exclude_keys=[],
+        parse_exclude_class_types=[],
+        exclude_class_types=[],
+        is_eco=True,
+    ):
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.exclude_keys = exclude_keys
+        self.parse_exclude_class_types = parse_exclude_class_types
+        self.exclude_class_types = exclude_class_types
+        self.is_eco = is_eco
+        self.parsed_names = set()
+        self._fingerprint = None
+        self._paths = {}
+        self._cache_changed = False
+
+    def _load_cache(self, fingerprint):
+        self._fingerprint = fingerprint
+        self._paths = {}
+        if not (self.cache_file and self.cache_file.exists()):
+            return
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+            if cache["fingerprint"] == fingerprint:
+                self._paths = cache["items"]
+        except Exception as e:
+            print(f"run_table: could not read parse cache {self.cache_file}: {e}")
+
+    def store_cache(self):
+        if not (self.cache_file and self._cache_changed):
+            return
+        try:
+            with open(self.cache_file.as_posix() + "tmp", "w") as f:
+                json.dump({"fingerprint": self._fingerprint, "items": self._paths}, f)
+            Path(self.cache_file.as_posix() + "tmp").replace(self.cache_file)
+            self._cache_changed = False
+        except Exception as e:
+            print(f"run_table: could not write parse cache {self.cache_file}: {e}")
+
+    def _is_excluded(self, adj):
+        return any(s in str(type(adj)) for s in self.exclude_class_types)
+
+    def _is_excluded_key(self, key):
+        return any(s in key for s in self.exclude_keys)
+
+    def _is_sub_device(self, obj):
+        return (
+            (not self.is_eco or "eco" in str(obj.__class__))
+            and hasattr(obj, "__dict__")
+            and obj.__hash__ is not None
+            and not any(s in str(obj.__class__) for s in self.parse_exclude_class_types)
+        )
+
+    def _walk(self, device, adj_prefix, parent_name, path, out):
+        """Append (column name, attribute path, adjustable) of device and its
+        sub devices to out, following _parse_child_instances."""
+        if adj_prefix is not None and device.name in adj_prefix:
+            return
+        name = device.name if adj_prefix is None else ".".join([adj_prefix, device.name])
+        items = [
+            (key, value)
+            for key, value in list(device.__dict__.items())
+            if not self._is_excluded_key(key)
+        ]
+        for key, value in items:
+            if hasattr(value, "get_current_value") and not self._is_excluded(value):
+                out.append((".".join([name, key]), path + [key], value))
+        skip_keys = ".".join([parent_name, name]).split(".")
+        for key, value in items:
+            if not self._is_sub_device(value) or key in skip_keys:
+                continue
+            if getattr(value, "name", None) is None:
+                value.name = key
+            self._walk(value, name, parent_name, path + [key], out)
+
+    def get_adjustables(self, name, obj):
+        """(column name, attribute path, adjustable) of a namespace item,
+        path relative to it (None if it is only known from the status
+        index)."""
+        paths = self._paths.get(name)
+        if paths is not None:
+            try:
+                return [(key, path, _path2obj(obj, path)) for key, path in paths]
+            except Exception:
+                pass
+        if getattr(obj, "name", None) is None:
+            obj.name = name
+        out = []
+        self._walk(obj, None, name, [], out)
+        adjs = [(key, ".".join(path), adj) for key, path, adj in out]
+        ids = set(id(adj) for _, _, adj in adjs)
+        missing = []
+        if hasattr(obj, "status_collection"):
+            for tentry in obj.status_collection.get_index():
+                adj = tentry.item
+                if id(adj) in ids or not hasattr(adj, "get_current_value"):
+                    continue
+                if self._is_excluded(adj) or not tentry.name:
+                    continue
+                ids.add(id(adj))
+                try:
+                    path = tentry.name if _path2obj(obj, tentry.name) is adj else None
+                except Exception:
+                    path = None
+                missing.append((".".join([obj.name, tentry.name]), path, adj))
+        if missing:
+            print(
+                f"run_table: {len(missing)} adjustables of {name} are not reached "
+                f"by the attribute parse, recorded under their status index names "
+                f"{[key for key, _, _ in missing]}"
+            )
+        adjs += missing
+        if all(path is not None for _, path, _ in adjs):
+            self._paths[name] = [[key, path] for key, path, _ in adjs]
+            self._cache_changed = True
+        return adjs
+
+    def update(self, namespace, ids_parsed):
+        """Add the adjustables of newly initialised items of namespace to
+        ids_parsed, returns the ids of the added adjustables."""
+        fingerprint = namespace_fingerprint(
+            namespace,
+            "attribute_paths",
+            self.exclude_keys,
+            self.parse_exclude_class_types,
+            self.exclude_class_types,
+            self.is_eco,
+        )
+        if not fingerprint == self._fingerprint:
+            self._load_cache(fingerprint)
+        new_ids = []
+        for name, obj in list(namespace.initialized_items.items()):
+            if name in self.parsed_names:
+                continue
+            self.parsed_names.add(name)
+            obj = getattr(obj, "__wrapped__", obj)
+            try:
+                adjs = self.get_adjustables(name, obj)
+            except Exception as e:
+                print(f"run_table: parsing {name} failed with {e}")
+                continue
+            ids_parsed.setdefault(id(obj), {}).setdefault("ids", [])
+            for key, _, adj in adjs:
+                parent_name = key.rsplit(".", 1)[0]
+                if id(adj) in ids_parsed and "value" in ids_parsed[id(adj)]:
+                    if key not in ids_parsed[id(adj)]["names"]:
+                        ids_parsed[id(adj)]["names_parent"].append(parent_name)
+                        ids_parsed[id(adj)]["names"].append(key)
+                    continue
+                ids_parsed[id(obj)]["ids"].append(id(adj))
+                ids_parsed.setdefault(id(adj), {}).update(
+                    {
+                        "names_parent": [parent_name],
+                        "name": key.split(".")[-1],
+                        "names": [key],
+                        "value": adj,
+                    }
+                )
+                new_ids.append(id(adj))
+        self.store_cache()
+        return new_ids
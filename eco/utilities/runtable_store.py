@@ -0,0 +1,462 @@
+from contextlib import contextmanager
+import fcntl
+import io
+import json
+import os
+import pickle
+from pathlib import Path
+import struct
+from subprocess import call
+from threading import RLock
+import uuid
+import zlib
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+_PROTOCOL = 4
+# every record is framed as magic, payload length, crc32 of the payload
+_MAGIC = b"RTS\x01"
+_HEADER = struct.Struct("<4sII")
+
+
+def column_group(column):
+    """Column group of a run table column, the top level device name."""
+    return column.split(".")[0]
+
+
+def _same_value(a, b):
+    if a is b:
+        return True
+    if not type(a) is type(b):
+        return False
+    if isinstance(a, float) and a != a and b != b:
+        return True
+    try:
+        if isinstance(a, np.ndarray):
+            return a.shape == b.shape and bool(np.all(a == b))
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+class RunTableStore:
+    """Append optimised storage of a run table.
+
+    Rows are appended as pickled records to rows.log, each behind a header
+    of magic number, length and checksum, so a damaged record is detected
+    and skipped without losing the records behind it. A keyframe record
+    ("key", index, {column: value}, writer, seq) holds the full row, the
+    following delta records ("delta", index, {column: value}, [removed
+    columns], writer, seq) only the values which changed with respect to the
+    previous row, usually a handful out of thousands of adjustables. writer
+    identifies the appending store instance and seq numbers its records, a
+    delta is only written directly behind the own previous record (checked
+    by the size of the log under a file lock, which also serialises
+    compaction) and only applied behind it when reading. A keyframe is written every keyframe_every rows,
+    as first record of a log and whenever another writer appended in between.
+    compact() folds the log into one pickled DataFrame per column group
+    (groups/<device>.pkl) and can also write the classic single pickle file.
+    read() reconstructs the full rows and only loads the column groups asked
+    for, e.g. by a Container. A row appended again under the same index
+    replaces the earlier one, as in the pickle based run table."""
+
+    def __init__(self, path, compact_every=500, keyframe_every=100):
+        self.path = Path(path)
+        self.compact_every = compact_every
+        self.keyframe_every = keyframe_every
+        self._lock = RLock()
+        self._group_cache = {}
+        self._last_row = None
+        # (log size and inode after the last own record, deltas since
+        # keyframe, rows)
+        self._log_state = None
+        self._writer_id = uuid.uuid4().hex
+        self._seq = 0
+        self._file_lock_depth = 0
+
+    @property
+    def _log_file(self):
+        return self.path / "rows.log"
+
+    @property
+    def _groups_dir(self):
+        return self.path / "groups"
+
+    @property
+    def _columns_file(self):
+        return self.path / "columns.json"
+
+    def exists(self):
+        return self._columns_file.exists() or self._log_file.exists()
+
+    def _mkdir(self):
+        if not self._groups_dir.exists():
+            self._groups_dir.mkdir(parents=True)
+            try:
+                self.path.chmod(0o775)
+                self._groups_dir.chmod(0o775)
+            except Exception:
+                pass
+
+    def get_version(self):
+        """Changes whenever rows are appended or the store is compacted."""
+        version = []
+        for f in [self._columns_file, self._log_file]:
+            try:
+                st = f.stat()
+                version.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock of the store between processes, reentrant within
+        this instance (hold self._lock around it)."""
+        if self._file_lock_depth:
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+            return
+        self._mkdir()
+        with open(self.path / "rows.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self._file_lock_depth = 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth = 0
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _own_record_is_last(self):
+        """Whether the last record of the log is the last own record, i.e.
+        the log did not change since it was written."""
+        if self._log_state is None:
+            return False
+        try:
+            st = self._log_file.stat()
+        except FileNotFoundError:
+            return False
+        return (st.st_size, st.st_ino) == self._log_state[0]
+
+    def append(self, index, row, unchanged=()):
+        """Append one row ({column: value}) under index, as delta to the
+        previously appended row where possible. Columns in unchanged are
+        known to hold the previous value and are not compared."""
+        with self._lock, self._file_lock():
+            last = self._last_row
+            state = self._log_state
+            own_last = self._own_record_is_last()
+            n_rows = state[2] + 1 if own_last else self._count_log_rows() + 1
+            self._seq += 1
+            if last is None or not own_last or state[1] >= self.keyframe_every:
+                record = ("key", index, row, self._writer_id, self._seq)
+                n_deltas = 0
+            else:
+                unchanged = set(unchanged)
+                changed = {
+                    k: v
+                    for k, v in row.items()
+                    if not (
+                        k in last and (k in unchanged or _same_value(last[k], v))
+                    )
+                }
+                removed = [k for k in last.keys() if k not in row]
+                record = ("delta", index, changed, removed, self._writer_id, self._seq)
+                n_deltas = state[1] + 1
+            payload = pickle.dumps(record, protocol=_PROTOCOL)
+            header = _HEADER.pack(_MAGIC, len(payload), zlib.crc32(payload))
+            with open(self._log_file, "ab") as f:
+                f.write(header + payload)
+                f.flush()
+                st = os.fstat(f.fileno())
+            self._last_row = dict(row)
+            self._log_state = ((st.st_size, st.st_ino), n_deltas, n_rows)
+
+    @staticmethod
+    def _decode_record(data, pos):
+        """(record, end position) of the record at pos, legacy logs hold
+        pickles without header."""
+        if data.startswith(_MAGIC, pos):
+            _, length, crc = _HEADER.unpack_from(data, pos)
+            start = pos + _HEADER.size
+            end = start + length
+            if end > len(data):
+                raise EOFError("incomplete record")
+            payload = data[start:end]
+            if not zlib.crc32(payload) == crc:
+                raise ValueError("checksum mismatch")
+            record = pickle.loads(payload)
+        else:
+            f = io.BytesIO(data)
+            f.seek(pos)
+            record = pickle.load(f)
+            end = f.tell()
+        if not (isinstance(record, tuple) and len(record) in [2, 3, 5, 6]):
+            raise ValueError(f"unexpected record type {type(record)}")
+        return record, end
+
+    def _read_records(self):
+        """Records of the log. A corrupt record is skipped, reading continues
+        at the next valid record behind it; None marks the gap."""
+        records = []
+        if not self._log_file.exists():
+            return records
+        with open(self._log_file, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos < len(data):
+            try:
+                record, pos = self._decode_record(data, pos)
+                records.append(record)
+                continue
+            except Exception as e:
+                error = e
+            # the magic number may also occur inside a payload, resync at the
+            # next one starting a valid record
+            next_pos = data.find(_MAGIC, pos + 1)
+            while next_pos >= 0:
+                try:
+                    self._decode_record(data, next_pos)
+                    break
+                except Exception:
+                    next_pos = data.find(_MAGIC, next_pos + 1)
+            if next_pos < 0:
+                # incompletely written last record
+                print(f"run_table store: skipping corrupt end of {self._log_file}: {error}")
+                break
+            print(
+                f"run_table store: skipping {next_pos - pos} corrupt bytes at "
+                f"{pos} of {self._log_file}: {error}"
+            )
+            if records and records[-1] is not None:
+                records.append(None)
+            pos = next_pos
+        return records
+
+    def _read_log(self):
+        """Full (index, row) pairs reconstructed from keyframes and deltas."""
+        rows = []
+        row = None
+        previous = None
+        for record in self._read_records():
+            if record is None:
+                # deltas behind a corrupt record need the next keyframe
+                row = None
+                continue
+            writer = None
+            if record[0] == "key":
+                _, index, row, writer, seq = record
+                record = (index, row)
+            elif record[0] == "delta":
+                _, index, changed, removed, writer, seq = record
+                if not previous == (writer, seq - 1):
+                    row = None
+                record = (index, changed, removed)
+            previous = (writer, seq) if writer is not None else None
+            if len(record) == 2:
+                index, row = record
+                row = dict(row)
+            else:
+                index, changed, removed = record
+                if row is None:
+                    print(
+                        f"run_table store: skipping delta record {index} without keyframe"
+                    )
+                    previous = None
+                    continue
+                row = {**row, **changed}
+                for k in removed:
+                    row.pop(k, None)
+            rows.append((index, row))
+        return rows
+
+    def _count_log_rows(self):
+        return len([r for r in self._read_records() if r is not None])
+
+    def n_log_rows(self):
+        if self._own_record_is_last():
+            return self._log_state[2]
+        return self._count_log_rows()
+
+    def _read_columns(self):
+        if not self._columns_file.exists():
+            return {}
+        with open(self._columns_file, "r") as f:
+            return json.load(f)
+
+    def get_columns(self):
+        """All column names, without loading any data."""
+        groups = self._read_columns()
+        columns = [c for cols in groups.values() for c in cols]
+        known = set(columns)
+        for _, row in self._read_log():
+            for c in row.keys():
+                if c not in known:
+                    known.add(c)
+                    columns.append(c)
+        return columns
+
+    def _read_group(self, group):
+        f = self._groups_dir / f"{group}.pkl"
+        try:
+            mtime = f.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._group_cache.get(group)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        df = pd.read_pickle(f)
+        self._group_cache[group] = (mtime, df)
+        return df
+
+    def read(self, columns=None):
+        """DataFrame with the given columns (all if None), reading only the
+        column groups they belong to."""
+        groups_columns = self._read_columns()
+        if columns is None:
+            groups = list(groups_columns.keys())
+        else:
+            columns = list(columns)
+            groups = []
+            for c in columns:
+                g = column_group(c)
+                if g in groups_columns and g not in groups:
+                    groups.append(g)
+        dfs = [self._read_group(g) for g in groups]
+        dfs = [df for df in dfs if df is not None]
+        if dfs:
+            df = pd.concat(dfs, axis=1)
+        else:
+            df = DataFrame()
+        rows = self._read_log()
+        if rows:
+            if columns is None:
+                records = [row for _, row in rows]
+            else:
+                wanted = set(columns)
+                records = [
+                    {k: v for k, v in row.items() if k in wanted} for _, row in rows
+                ]
+            log_df = DataFrame(records, index=[i for i, _ in rows], dtype=object)
+            df = pd.concat([df, log_df])
+            df = df[~df.index.duplicated(keep="last")]
+        if columns is not None:
+            df = df.reindex(columns=[c for c in columns if c in df.columns])
+        return df
+
+    def write(self, df, pickle_file=None):
+        """Replace the store content by df and empty the log. If pickle_file
+        is given, df is written there as single pickle as well."""
+        with self._lock, self._file_lock():
+            groups = {}
+            for c in df.columns:
+                groups.setdefault(column_group(c), []).append(c)
+            for g, cols in groups.items():
+                f = self._groups_dir / f"{g}.pkl"
+                pd.DataFrame(df[cols]).to_pickle(f.as_posix() + "tmp")
+                call(["mv", f.as_posix() + "tmp", f.as_posix()])
+            for f in self._groups_dir.glob("*.pkl"):
+                if f.stem not in groups:
+                    f.unlink()
+            with open(self._columns_file.as_posix() + "tmp", "w") as f:
+                json.dump(groups, f)
+            call(["mv", self._columns_file.as_posix() + "tmp", self._columns_file])
+            if self._log_file.exists():
+                self._log_file.unlink()
+            self._log_state = None
+            self._group_cache = {}
+            if pickle_file:
+                pd.DataFrame(df).to_pickle(pickle_file + "tmp")
+                call(["mv", pickle_file + "tmp", pickle_file])
+
+    def compact(self, pickle_file=None):
+        """Fold the appended rows into the column group files."""
+        with self._lock, self._file_lock():
+            self.write(self.read(), pickle_file=pickle_file)
+
+    def compact_if_needed(self, pickle_file=None):
+        """Compact once compact_every rows were appended, returns whether it
+        compacted."""
+        if self.compact_every and self.n_log_rows() >= self.compact_every:
+            self.compact(pickle_file=pickle_file)
+            return True
+        return False
+
+
+class StoreBackedTable:
+    """Persistence of a run table DataFrame subclass in a RunTableStore.
+
+    Rows are only appended to the store; the frame in memory is then stale
+    and read from the store by the next load(). The single pickle file is
+    written by save() and, while keep_legacy_pickle is set, when the store
+    is compacted."""
+
+    def _init_store(self, fname, keep_legacy_pickle=False):
+        self.fname = fname
+        self.store = RunTableStore(fname[: -len(".pkl")] + "_store")
+        self._store_version = None
+        self.keep_legacy_pickle = keep_legacy_pickle
+        self._stored_values_by_id = {}
+
+    def save(self):
+        data_dir = Path(os.path.dirname(self.fname))
+        if not data_dir.exists():
+            print(
+                f"Path {data_dir.absolute().as_posix()} does not exist, will create it..."
+            )
+            data_dir.mkdir(parents=True)
+            print(f"Tried to create {data_dir.absolute().as_posix()}")
+            data_dir.chmod(0o775)
+            print(f"Tried to change permissions to 775")
+        self.store.write(self, pickle_file=self.fname)
+        self._store_version = self.store.get_version()
+
+    def load(self):
+        """Read the run table, only if the store changed since the last load.
+        A run table only existing as pickle is converted to the store."""
+        if self.store.exists():
+            version = self.store.get_version()
+            if not version == self._store_version:
+                self.df = self.store.read()
+                self._store_version = version
+        elif os.path.exists(self.fname):
+            self.df = pd.read_pickle(self.fname)
+            try:
+                self.store.write(self)
+                self._store_version = self.store.get_version()
+            except Exception as e:
+                print(f"run_table: could not create store {self.store.path}: {e}")
+
+    def get_column_names(self):
+        if self.store.exists():
+            return pd.Index(self.store.get_columns())
+        return self.columns
+
+    def read_columns(self, columns):
+        """DataFrame of some columns, only loading the needed column groups."""
+        if self.store.exists():
+            return self.store.read(columns)
+        return self[[c for c in columns if c in self.columns]]
+
+    def _store_row(self, index, dat, values_by_id=None):
+        """Append a row to the store, the frame in memory is read on the next
+        load(). values_by_id holds the values of the row by ids_parsed key,
+        the columns of adjustables with the value of the previous row are
+        then stored without comparing them again."""
+        unchanged = []
+        if values_by_id:
+            last = self._stored_values_by_id
+            for aid, v in values_by_id.items():
+                if aid in last and _same_value(last[aid], v):
+                    unchanged.extend(self.ids_parsed[aid]["names"])
+        self.store.append(index, dat, unchanged=unchanged)
+        self._stored_values_by_id = values_by_id or {}
+        self.store.compact_if_needed(
+            pickle_file=self.fname if self.keep_legacy_pickle else None
+        )
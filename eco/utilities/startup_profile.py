@@ -0,0 +1,146 @@
+import json
+import sys
+from importlib import import_module
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from tabulate import tabulate
+
+
+class StartupProfile:
+    """Import and construction metadata of namespace items, kept between sessions.
+
+    Records per module the import time and per namespace item the construction
+    time, the module it comes from and the channel access PV names found in
+    its aliases. The data of the previous session is used to prefetch PV
+    connections (prefetch_pvs)."""
+
+    def __init__(self, file_path=None):
+        self.file_path = Path(file_path) if file_path else None
+        self._lock = Lock()
+        self.previous = {"imports": {}, "objects": {}}
+        if self.file_path and self.file_path.exists():
+            try:
+                with open(self.file_path, "r") as f:
+                    self.previous.update(json.load(f))
+            except Exception as e:
+                print(f"Could not read startup profile {self.file_path}: {e}")
+        self.imports = {}
+        self.objects = {}
+
+    def import_module(self, module_name):
+        """Import a module, recording the import time if it was not loaded
+        yet. Always goes through importlib, whose module lock makes parallel
+        callers wait for a module another thread is still initialising."""
+        loaded = module_name in sys.modules
+        starttime = time()
+        module = import_module(module_name)
+        if not loaded:
+            with self._lock:
+                self.imports.setdefault(module_name, time() - starttime)
+        return module
+
+    def get_factory(self, obj_factory, module_name=None):
+        if module_name:
+            return getattr(self.import_module(module_name), obj_factory)
+        return obj_factory
+
+    def record_object(self, name, construction_time, obj=None, module_name=None):
+        pvnames = []
+        if obj is not None and hasattr(obj, "alias"):
+            try:
+                pvnames = sorted(
+                    set(
+                        ta["channel"]
+                        for ta in obj.alias.get_all()
+                        if ta["channeltype"] == "CA" and ta["channel"]
+                    )
+                )
+            except Exception:
+                pass
+        with self._lock:
+            self.objects[name] = {
+                "time": construction_time,
+                "module": module_name,
+                "pv_count": len(pvnames),
+                "pvnames": pvnames,
+            }
+
+    def get_pvnames(self, names):
+        """PV names recorded for the given namespace items."""
+        pvnames = set()
+        for name in names:
+            record = self.objects.get(name, self.previous["objects"].get(name))
+            if record:
+                pvnames.update(record["pvnames"])
+        return sorted(pvnames)
+
+    def prefetch_pvs(self, names):
+        """Start the connection of all PVs of the given items in one batch.
+
+        Channels are created without waiting; PV objects created later get
+        the already (or soon) connected channels from the pyepics cache."""
+        pvnames = self.get_pvnames(names)
+        if not pvnames:
+            return 0
+        from epics import ca
+
+        for pvname in pvnames:
+            try:
+                ca.create_channel(pvname, connect=False)
+            except Exception:
+                pass
+        ca.flush_io()
+        return len(pvnames)
+
+    def store(self):
+        """Merge the records of this session into the profile file."""
+        if not self.file_path:
+            return
+        with self._lock:
+            data = {
+                "imports": {**self.previous["imports"], **self.imports},
+                "objects": {**self.previous["objects"], **self.objects},
+            }
+        try:
+            with open(self.file_path, "w") as f:
+                json.dump(data, f, indent=1)
+        except Exception as e:
+            print(f"Could not write startup profile {self.file_path}: {e}")
+
+    def get_report(self, n_items=30):
+        objects = {**self.previous["objects"], **self.objects}
+        imports = {**self.previous["imports"], **self.imports}
+        objs = sorted(objects.items(), key=lambda w: w[1]["time"], reverse=True)
+        mods = sorted(imports.items(), key=lambda w: w[1], reverse=True)
+        s = "Slowest constructions\n"
+        s += tabulate(
+            [
+                [
+                    name,
+                    f"{1000*rec['time']:.0f}",
+                    rec["pv_count"],
+                    rec["module"],
+                    f"{1000*imports.get(rec['module'], 0):.0f}"
+                    if rec["module"]
+                    else "",
+                ]
+                for name, rec in objs[:n_items]
+            ],
+            headers=["name", "time / ms", "PVs", "module", "import / ms"],
+        )
+        s += "\n\nSlowest imports\n"
+        s += tabulate(
+            [[mod, f"{1000*t:.0f}"] for mod, t in mods[:n_items]],
+            headers=["module", "time / ms"],
+        )
+        s += (
+            f"\n\nTotal: {len(objects)} objects in {sum(r['time'] for r in objects.values()):.1f} s, "
+            f"{sum(r['pv_count'] for r in objects.values())} PVs, "
+            f"{len(imports)} modules in {sum(imports.values()):.1f} s"
+        )
+        return s
+
+    def print_report(self, n_items=30):
+        print(self.get_report(n_items=n_items))
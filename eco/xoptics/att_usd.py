@@ -20,6 +20,8 @@ from ..elements.adjustable import (
 )
 from ..elements.detector import DetectorGet
 from eco.devices_general.utilities import Changer
+from ..epics.subscription_hub import hub
+from .transmission import TransmissionEngine
 import pylab as plt
 
 
@@ -181,13 +183,16 @@ class Att_usd(Assembly):
                 [-37.7, -32.6, -27.3, -23, -18, -13, -7.8, -3, 1.7, 7.4, 12.6, 17.6, 25]
             ),
         }
+        self._transmission_engine = TransmissionEngine(self.targets_1, self.targets_2)
+        self._pv_energy = hub.get_pv("SAROP21-ARAMIS:ENERGY")
+        self._pv_energy_backup = hub.get_pv("SARUN:FELPHOTENE")
 
     def _updateE(self, energy=None, check_times=2):
         n = 0
         while not energy:
-            energy = PV("SAROP21-ARAMIS:ENERGY").value
-            if np.isnan(energy):
-                energy = PV("SARUN:FELPHOTENE").value * 1000
+            energy = self._pv_energy.value
+            if energy is None or np.isnan(energy):
+                energy = self._pv_energy_backup.value * 1000
             if energy < self.E_min:
                 n = n + 1
                 if n > check_times:
@@ -203,27 +208,9 @@ class Att_usd(Assembly):
         return
 
     def _calc_transmission(self):
-        t1 = np.array(
-            [
-                np.exp(-d / mat.absorption_length(self.E))
-                for d, mat in zip(self.targets_1["d"], self.targets_1["mat"])
-            ]
-        )
-        self.targets_1["t"] = t1
-        t2 = np.array(
-            [
-                np.exp(-d / mat.absorption_length(self.E))
-                for d, mat in zip(self.targets_2["d"], self.targets_2["mat"])
-            ]
-        )
-        self.targets_2["t"] = t2
-        t_comb = (
-            (np.expand_dims(t1, axis=0)).T * (np.expand_dims(t2, axis=0))
-        ).flatten()
-        pos_comb = np.array(
-            [[p1, p2] for p1 in self.targets_1["pos"] for p2 in self.targets_2["pos"]]
-        )
-        self.transmissions = {"t": t_comb, "pos": pos_comb}
+        """Update the tabulated transmissions (sorted by "t") to self.E."""
+        self._transmission_engine.update_energy(self.E)
+        self.transmissions = self._transmission_engine.transmissions
 
     def _find_nearest(self, a, a0):
         "Element in nd array `a` closest to the scalar value `a0`"
@@ -233,8 +220,7 @@ class Att_usd(Assembly):
     def set_transmission(self, value):
         self._updateE()
         self._calc_transmission()
-        idx, t = self._find_nearest(self.transmissions["t"], value)
-        p1, p2 = self.transmissions["pos"][idx]
+        t, (p1, p2) = self._transmission_engine.find_nearest(value)
         self._xp.close()
         self.transl_1.set_target_value(p1)
         self.transl_2.set_target_value(p2)
@@ -249,15 +235,9 @@ class Att_usd(Assembly):
     def get_current_value(self):
         self._updateE()
         self._calc_transmission()
-        idx1, p1 = self._find_nearest(
-            self.targets_1["pos"], self.transl_1.get_current_value()
-        )
-        t1 = self.targets_1["t"][idx1]
-        idx2, p2 = self._find_nearest(
-            self.targets_2["pos"], self.transl_2.get_current_value()
+        return self._transmission_engine.get_transmission(
+            self.transl_1.get_current_value(), self.transl_2.get_current_value()
         )
-        t2 = self.targets_2["t"][idx2]
-        return t1 * t2
 
     def set_stage_config(self):
         for name, config in self.motor_configuration.items():
@@ -342,8 +322,7 @@ class Att_usd(Assembly):
                 raise AdjustableError("Soft limits violated!")
         self._updateE()
         self._calc_transmission()
-        idx, t = self._find_nearest(self.transmissions["t"], value)
-        p1, p2 = self.transmissions["pos"][idx]
+        t, (p1, p2) = self._transmission_engine.find_nearest(value)
         self._xp.close()
         print(f"Set transmission to {t:0.2E} | Moving to pos {[p1, p2]}")
         self.transl_1.set_target_value(p1)
@@ -376,14 +355,14 @@ class Att_usd(Assembly):
         self._updateE(energy=energy)
         self._calc_transmission()
         act_values = np.array(
-            [self._find_nearest(self.transmissions["t"], value) for value in values]
+            [self._transmission_engine.find_nearest(value)[0] for value in values]
         )
         if plot:
             plt.close("att_usd target_positions")
             plt.figure("att_usd target_positions")
-            plt.plot(values, act_values.T[1], "o-")
+            plt.plot(values, act_values, "o-")
             plt.grid()
             plt.xlabel("set transmission")
             plt.ylabel("reachable transmission")
             plt.tight_layout()
-        return act_values.T[1]
+        return act_values
@@ -2,6 +2,7 @@ from eco.bs.detector import DetectorPvEnum
 from eco.epics.detector import DetectorPvData
 from ..devices_general.motors import MotorRecord
 from epics import PV
+from ..epics.subscription_hub import hub
 from time import sleep
 from ..devices_general.utilities import Changer
 from ..aliases import Alias
@@ -55,6 +56,7 @@ class AttenuatorAramis(Assembly):
             )
 
         self.E_min = E_min
+        self._sleeptime = sleeptime
         # self._pv_status_str = PV(self.pvname + ":MOT2TRANS.VALD")
         # self._pv_status_int = PV(self.pvname + ":IDX_RB")
         # self._sleeptime = sleeptime
@@ -119,7 +121,14 @@ class AttenuatorAramis(Assembly):
                     f"Machine photon energy is below {self.E_min} - waiting for the machine to recover"
                 )
                 sleep(self._sleeptime)
-        self.energy_calc(energy)
+        # the IOC recalculates its transmission tables on every write, only
+        # write when its energy differs (it may also be set from elsewhere)
+        try:
+            energy_ioc = self.energy_calc.get_current_value()
+        except Exception:
+            energy_ioc = None
+        if not energy == energy_ioc:
+            self.energy_calc(energy)
         # print("Calculating transmission for %s eV" % energy)
         return
 
@@ -275,12 +284,12 @@ class AttenuatorAramisOld(Assembly):
 
     def set_transmission(self, value, energy=None):
         self.updateE(energy)
-        PV(self.pvname + ":3RD_HARM_SP").put(0)
+        hub.get_pv(self.pvname + ":3RD_HARM_SP").put(0)
         self.transmission(value)
 
     def set_transmission_third_harmonic(self, value, energy=None):
         self.updateE(energy)
-        PV(self.pvname + ":3RD_HARM_SP").put(1)
+        hub.get_pv(self.pvname + ":3RD_HARM_SP").put(1)
         self.transmission(value)
 
     def setE(self):
@@ -290,8 +299,8 @@ class AttenuatorAramisOld(Assembly):
         return all([m.get_moveDone() for m in self.motors])
 
     def get_transmission(self, verbose=True):
-        tFun = PV(self.pvname + ":TRANS_RB").value
-        tTHG = PV(self.pvname + ":TRANS3EDHARM_RB").value
+        tFun = hub.get_pv(self.pvname + ":TRANS_RB").value
+        tTHG = hub.get_pv(self.pvname + ":TRANS3EDHARM_RB").value
         if verbose:
             print("Transmission Fundamental: %s THG: %s" % (tFun, tTHG))
         return tFun, tTHG
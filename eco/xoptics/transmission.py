@@ -0,0 +1,123 @@
+"""Tabulated filter transmissions for attenuators.
+
+Absorption lengths are computed with xrayutilities once per material and
+distinct energy (rounded to 1 meV) and kept in a cache file, as
+interpolating between grid points is off near absorption edges. A
+TransmissionEngine keeps the combined transmissions of the filter stages
+sorted for the current energy, so that nearest transmission lookups are a
+searchsorted."""
+
+import json
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+
+def _material_key(material):
+    return f"{material.name}_{float(material.density):.1f}"
+
+
+class AbsorptionTable:
+    """Absorption length (um) of a material, cached per energy."""
+
+    def __init__(self, material, cache_dir=None):
+        self.material = material
+        self.key = _material_key(material)
+        self._lock = Lock()
+        self._values = {}
+        if cache_dir is None:
+            cache_dir = Path.home() / ".cache" / "eco" / "absorption"
+        self.cache_file = Path(cache_dir) / f"{self.key}.json"
+        try:
+            with open(self.cache_file, "r") as f:
+                self._values = json.load(f)
+        except Exception:
+            pass
+
+    def store_cache(self):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_file.as_posix() + "tmp", "w") as f:
+                json.dump(self._values, f)
+            Path(self.cache_file.as_posix() + "tmp").replace(self.cache_file)
+        except Exception as e:
+            print(f"Could not store absorption table {self.cache_file}: {e}")
+
+    def absorption_length(self, energy):
+        energy = round(float(energy), 3)
+        key = f"{energy:.3f}"
+        if key not in self._values:
+            with self._lock:
+                self._values[key] = float(self.material.absorption_length(energy))
+                self.store_cache()
+        return self._values[key]
+
+
+_tables = {}
+
+
+def get_absorption_table(material):
+    """Absorption table shared by all users of a material."""
+    key = _material_key(material)
+    if key not in _tables:
+        _tables[key] = AbsorptionTable(material)
+    return _tables[key]
+
+
+class TransmissionEngine:
+    """Transmissions of filter stages given as dicts with arrays "mat", "d"
+    (um) and "pos", and their combinations sorted by transmission. The
+    tables are only recalculated when the energy changes."""
+
+    def __init__(self, *stages):
+        self.stages = stages
+        self.energy = None
+        self.transmissions = None
+        for stage in stages:
+            stage["pos"] = np.asarray(stage["pos"], dtype=float)
+            stage["d"] = np.asarray(stage["d"], dtype=float)
+            stage["_tables"] = [get_absorption_table(mat) for mat in stage["mat"]]
+
+    def update_energy(self, energy):
+        if energy == self.energy:
+            return
+        absorption_lengths = {}
+        for stage in self.stages:
+            lengths = []
+            for table in stage["_tables"]:
+                if table.key not in absorption_lengths:
+                    absorption_lengths[table.key] = table.absorption_length(energy)
+                lengths.append(absorption_lengths[table.key])
+            stage["t"] = np.exp(-stage["d"] / np.asarray(lengths))
+        t_comb = self.stages[0]["t"]
+        for stage in self.stages[1:]:
+            t_comb = np.multiply.outer(t_comb, stage["t"])
+        t_comb = t_comb.ravel()
+        pos_comb = np.stack(
+            [
+                tpos.ravel()
+                for tpos in np.meshgrid(
+                    *[stage["pos"] for stage in self.stages], indexing="ij"
+                )
+            ],
+            axis=-1,
+        )
+        order = np.argsort(t_comb, kind="stable")
+        self.transmissions = {"t": t_comb[order], "pos": pos_comb[order]}
+        self.energy = energy
+
+    def find_nearest(self, value):
+        """(transmission, positions) of the combination nearest to value."""
+        t = self.transmissions["t"]
+        idx = int(np.searchsorted(t, value))
+        if idx == len(t) or (idx > 0 and value - t[idx - 1] <= t[idx] - value):
+            idx -= 1
+        return t[idx], self.transmissions["pos"][idx]
+
+    def get_transmission(self, *positions):
+        """Transmission at the filters nearest to the stage positions."""
+        t = 1.0
+        for stage, pos in zip(self.stages, positions):
+            t *= stage["t"][np.abs(stage["pos"] - pos).argmin()]
+        return t
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("bsread")
+
+from eco.detector.bs_stream_manager import (
+    BsStreamManager,
+    StandInBsSender,
+    _ChannelBuffer,
+)
+
+PORT = 9987
+
+
+@pytest.fixture
+def manager():
+    channels = {
+        "SIM:SCALAR": lambda pulse_id: float(pulse_id),
+        "SIM:WAVEFORM": lambda pulse_id: np.arange(4.0) + pulse_id,
+    }
+    with StandInBsSender(channels, port=PORT, rate=200, start_pulse_id=1000):
+        manager = BsStreamManager(
+            buffer_size=50,
+            receive_timeout=200,
+            linger=1,
+            source_kwargs={"host": "localhost", "port": PORT},
+        )
+        yield manager
+        manager.stop()
+
+
+def test_collect_samples(manager):
+    pulse_ids, values = manager.collect("SIM:SCALAR", samples=20, timeout=10)
+    assert len(pulse_ids) == 20
+    assert np.all(np.diff(pulse_ids) > 0)
+    assert np.array_equal(values, pulse_ids.astype(float))
+
+
+def test_aligned_after_wrap(manager):
+    manager.subscribe("SIM:SCALAR", "SIM:WAVEFORM")
+    buf = manager._buffers["SIM:WAVEFORM"]
+    assert manager._wait_for(lambda: buf.count > 2 * manager.buffer_size, 10)
+    pulse_ids, values = manager.get_aligned("SIM:SCALAR", "SIM:WAVEFORM", n=10)
+    assert len(pulse_ids) == 10
+    assert np.array_equal(values["SIM:SCALAR"], pulse_ids.astype(float))
+    assert np.array_equal(values["SIM:WAVEFORM"][:, 0], pulse_ids.astype(float))
+    manager.unsubscribe("SIM:SCALAR", "SIM:WAVEFORM")
+
+
+def test_get_range_returns_copies():
+    buf = _ChannelBuffer(8)
+    for pulse_id in range(20):
+        buf.append(pulse_id, float(pulse_id))
+    pulse_ids, values = buf.get_range(0)
+    assert list(pulse_ids) == list(range(12, 20))
+    values[:] = -1
+    buf.append(20, 20.0)
+    assert list(buf.get_range(0)[1]) == [float(i) for i in range(13, 21)]